@@ -2,7 +2,16 @@ import socket
 import time
 from machine import Pin, I2S, Timer
 import uasyncio as asyncio
-from myutil import RingBuffer
+import audio_codec
+from audio_pipeline import FramePool, IrqI2SSource
+from audio_player import PingPongI2S
+from audio_proto import CODEC_PCM16
+from jitter_buffer import JitterBuffer, WAITING
+import latency_trace
+from latency_trace import Tracer
+from myutil import PreRollBuffer, TokenBucket
+from resample import Resampler
+from vad import EchoGate, Vad
 
 # 状态标志
 STATE_STOPPED = 0      # 完全停止状态
@@ -20,6 +29,17 @@ class AudioChatClient:
 
         self.chunk_size = 1024  # UDP推荐的数据包大小
         self.sequence = 0  # 包序号，用于接收端重组
+        # 预分配的发送包: 2字节序号 + 音频数据, 每次原地改写
+        self._packet = bytearray(2 + self.chunk_size)
+        self._packet_view = memoryview(self._packet)
+        self._server = None  # sendto 的目标地址, 第一次发送时解析
+        # 上行编码: UDP 没有协商握手, 包里也没有编码字段, 需要和服务端事先约定;
+        # 改成 CODEC_ULAW / CODEC_IMA_ADPCM 可以把上行流量降到 1/2 / 1/4
+        self.uplink_codec = CODEC_PCM16
+        self.encoder = audio_codec.get(self.uplink_codec)
+        # 下行编码: 同样需要事先约定; 收到的包先解码到预分配的缓冲区, 再按序号放进抖动缓冲
+        self.downlink_codec = CODEC_PCM16
+        self.decoder = audio_codec.get(self.downlink_codec)
         self.audio_buffer_size = 1024
         self.current_state = STATE_STOPPED  # 初始状态为完全停止状态
         
@@ -27,23 +47,40 @@ class AudioChatClient:
         self.button = Pin(0, Pin.IN, Pin.PULL_UP)  # 使用GPIO0作为按钮输入
         self.led = Pin(2, Pin.OUT)                 # 使用GPIO2作为LED指示
 
-        # 添加预缓冲区相关参数
-        self.pre_buffer = []
-        self.pre_buffer_size = 10  # 保存最近5帧的数据
-        
          # 定义特殊的结束标记
         self.END_MARKER = b'END_OF_AUDIO'
+        # 打断标记: 服务端收到后取消正在发送的回复(和结束标记一样需要服务端识别)
+        self.CANCEL_MARKER = b'CANCEL_AUDIO'
         
-         # VAD相关参数
-        self.vad_threshold = 500  # 声音阈值，根据实际情况调整
-        self.silence_frames = 0   # 连续静音帧计数
-        self.voice_frames = 0     # 连续有声帧计数
-        self.max_silence_frames = 50  # 最大静音帧数
-        self.vad_window = []      # 滑动窗口
-        self.vad_window_size = 4  # 窗口数量
-        self.frames_to_confirm_silence = 50  # 降低到8帧，约2秒静音就停止
+        self.mic_rate = 16000  # 麦克风采样率
+        self.play_rate = 24000  # 扬声器采样率
+        # 服务端下行音频的采样率(UDP 包里没有这个字段, 需要事先约定), 和扬声器不同时播放前重采样
+        self.downlink_rate = self.play_rate
+        self.resample_mode = 'linear'
+        
+        # 预录缓冲: 保存检测到说话之前 pre_roll_ms 毫秒的音频, 麦克风直接读进去
+        self.pre_roll_ms = 300
+        self.pre_buffer = PreRollBuffer.for_duration(self.pre_roll_ms, self.audio_buffer_size,
+                                                     self.mic_rate)
         
-        self.is_speaking = False
+        # 发送限速: 令牌桶按采样率(16位单声道)放行, 留 50% 余量追上预缓冲的积压,
+        # 桶容量两个包, 避免一次性把整段数据灌进网络
+        self.send_pacer = TokenBucket(self.mic_rate * 2 * 3 // 2, 2 * (2 + self.chunk_size))
+        self.tx_packets = 0     # 已发送的包数
+        self.tx_bytes = 0       # 已发送的字节数(含序号)
+        self.tx_retries = 0     # 网络缓冲满(EAGAIN)重试的次数
+        self.tx_pps = 0         # 最近一秒的发包速率
+        self.send_queue = 0     # 发送积压: 还没发出的包数, 含麦克风队列里排着的帧
+        self.max_send_queue = 0
+        self._pps_count = 0
+        self._pps_start = time.ticks_ms()
+        
+         # VAD相关参数
+        self.vad_threshold = 500  # 声音阈值的下限, 实际门限随噪声底自适应
+        self.frames_to_confirm_silence = 50  # 连续50帧(约1.6秒)静音才停止
+        self.vad_mode = 'energy'  # 有风扇/键盘声的环境改为 'spectral', 少发静音帧
+        self.vad = Vad(window=4, min_voice_frames=2, min_threshold=self.vad_threshold,
+                       hangover_frames=self.frames_to_confirm_silence, mode=self.vad_mode)
         
         # I2S麦克风配置
         self.audio_in = I2S(
@@ -54,10 +91,22 @@ class AudioChatClient:
             mode=I2S.RX,           
             bits=16,               
             format=I2S.MONO,       
-            rate=16000,            
+            rate=self.mic_rate,            
             ibuf=4096,
         )
 
+        # 麦克风非阻塞采集: 中断里读进预分配的帧, 每帧带采集时间(ticks_us)和序号。
+        # 开始说话时按限速补发整个预录缓冲(约 0.2 秒), 这期间不取帧, 麦克风排队
+        # 的空帧要能装下这段时间采到的数据, 否则刚开口的几帧就丢了
+        frame_us = self.audio_buffer_size * 500000 // self.mic_rate
+        replay_us = (self.pre_buffer.blocks * (2 + self.chunk_size) * 1000000
+                     // self.send_pacer.rate)
+        mic_depth = replay_us // frame_us + 2
+        self.mic_pool = FramePool(mic_depth + 2, self.audio_buffer_size)
+        self.mic = IrqI2SSource(self.audio_in, self.mic_rate, depth=mic_depth,
+                                pool=self.mic_pool)
+        self.send_latency_us = 0  # 最近一帧从采集(最后一个采样)到发出的时间
+
         # I2S扬声器配置
         self.audio_out = I2S(
             0,                      
@@ -67,7 +116,7 @@ class AudioChatClient:
             mode=I2S.TX,           
             bits=16,               
             format=I2S.MONO,       
-            rate=24000,            
+            rate=self.play_rate,            
             ibuf=20000,
         )
 
@@ -78,29 +127,106 @@ class AudioChatClient:
         self.loop = None
         self.tasks = []
         
-        # 添加音频播放缓冲区
-        self.play_buffer = RingBuffer(32000)  # 32KB 缓冲区
-        self.min_playback_buffer = 4096  # 最小播放缓冲区大小
+        # 抖动缓冲: 按序号重排下行音频包, 按播放节奏每帧取一次
+        self.play_frame_bytes = 1024  # 每个下行包的音频字节数
+        self.play_frame_us = self.play_frame_bytes * 1000000 // (2 * self.downlink_rate)
+        self.jitter = JitterBuffer(self.play_frame_bytes, self.play_frame_us // 1000)
+        self._rx_pcm = bytearray(self.play_frame_bytes)
+        self._rx_pcm_view = memoryview(self._rx_pcm)
+        self.rx_dropped = 0  # 解码后超过一帧大小而丢弃的包数
+        self.resampler = Resampler(self.downlink_rate, self.play_rate, self.resample_mode)
+        # 扬声器用非阻塞写(双缓冲), 播放任务不会卡住事件循环; 帧直接重采样进 I2S 的缓冲区
+        self.speaker = PingPongI2S(self.audio_out, self.play_rate,
+                                   self.resampler.output_size(self.play_frame_bytes))
+        
+        # 全双工: 播放回复时麦克风也在听, 用户开口(不是扬声器的回声)就打断:
+        # 清空抖动缓冲和扬声器排着的块, 通知服务端取消这次回复, 补发预录缓冲开始录音
+        self.full_duplex = True
+        # 扬声器 ibuf 约 0.4 秒, 回声参考要盖住它和声学路径的延迟
+        self.echo_gate = EchoGate(coupling=384, tail_ms=600, slots=32)
+        self.barge_vad = Vad(window=2, min_voice_frames=1, min_threshold=self.vad_threshold,
+                             hangover_frames=2, mode=self.vad_mode)
+        self.barge_in_frames = 2  # 连续这么多帧有声且不是回声才算打断
+        self._barge_frames = 0
+        self.barge_ins = 0  # 打断次数
+        self._rx_muted = False  # 打断后丢掉被取消的回复里还在路上的音频, 直到这次录音结束
+        if self.full_duplex:
+            self.speaker.echo_ref = self.echo_gate
         
-    def send_audio(self, audio_buffer, num_read):
+        # 延迟打点: 开始说话、结束标记、下行音频到达、开始/结束播放的时间, 串口上调用 dump_trace()
+        self.trace = Tracer(128)
+        self.speaker.trace = self.trace
+        
+    async def send_audio(self, audio_buffer, num_read, pending=0):
+        """分块限速发送音频, 等待时让出事件循环而不是阻塞; pending 是排在这段之后的包数(补发预录缓冲时)"""
         try:
-            # 分块发送音频数据
-            audio_bytes = bytes(audio_buffer[:num_read])
-            for i in range(0, num_read, self.chunk_size):
-                chunk = audio_bytes[i:i + self.chunk_size]
-                # 添加序号到数据包
-                # print(f"send_audio sequence: {self.sequence}")
-                packet = self.sequence.to_bytes(2, 'big') + chunk
-                self.sock.sendto(packet, (self.host, self.port))
-                self.sequence = (self.sequence + 1) % 65536  # 循环使用序号
-                time.sleep_ms(2)  # 短暂延迟
+            if self._server is None:
+                self._server = socket.getaddrinfo(self.host, self.port)[0][-1]
+            src = memoryview(audio_buffer)
+            packet = self._packet
+            chunk_size = self.chunk_size
+            for i in range(0, num_read, chunk_size):
+                # 这次还没发的包, 加上等着取出发送的麦克风帧(每帧一个包)
+                self._note_backlog((num_read - i + chunk_size - 1) // chunk_size + pending)
+                n = min(chunk_size, num_read - i)
+                # 原地写入序号, 数据直接编码进发送包
+                n = self.encoder.encode(src[i:i + n], n, self._packet_view[2:])
+                packet[0] = self.sequence >> 8
+                packet[1] = self.sequence & 0xff
+                # 令牌不够时等待, 期间其他任务照常运行
+                wait_us = self.send_pacer.delay_us(2 + n)
+                while wait_us:
+                    await asyncio.sleep_ms((wait_us + 999) // 1000)
+                    wait_us = self.send_pacer.delay_us(2 + n)
+                while True:
+                    try:
+                        self.sock.sendto(self._packet_view[:2 + n], self._server)
+                        break
+                    except OSError as e:
+                        if e.args[0] != 11:  # EAGAIN
+                            raise
+                        # 网络缓冲满, 让出一下再发
+                        self.tx_retries += 1
+                        await asyncio.sleep_ms(1)
+                self.sequence = (self.sequence + 1) & 0xffff  # 循环使用序号
+                self._count_packet(2 + n)
                 
+            self._note_backlog(0)
             return True
             
         except Exception as e:
             print(f"send_audio error: {e}")
+            self._note_backlog(0)
             return False
             
+    def _note_backlog(self, packets):
+        queue = packets + self.mic.queued
+        self.send_queue = queue
+        if queue > self.max_send_queue:
+            self.max_send_queue = queue
+            
+    def _count_packet(self, size):
+        self.tx_packets += 1
+        self.tx_bytes += size
+        self._pps_count += 1
+        now = time.ticks_ms()
+        elapsed = time.ticks_diff(now, self._pps_start)
+        if elapsed >= 1000:
+            self.tx_pps = self._pps_count * 1000 // elapsed
+            self._pps_count = 0
+            self._pps_start = now
+            
+    def send_stats(self):
+        """发送统计: 包数、字节数、每秒包数、发送积压(包)"""
+        return {
+            'packets': self.tx_packets,
+            'bytes': self.tx_bytes,
+            'pps': self.tx_pps,
+            'queue': self.send_queue,
+            'max_queue': self.max_send_queue,
+            'retries': self.tx_retries,
+        }
+            
     def close(self):
         try:
             if self.sock:
@@ -110,50 +236,123 @@ class AudioChatClient:
             pass
         
     async def record_audio(self):
-        """异步音频处理：处理录音和语音检测"""
-        audio_buffer = bytearray(self.audio_buffer_size)
+        """异步音频处理：处理录音和语音检测; 全双工时播放回复期间也在听, 用户开口就打断"""
+        pre_buffer = self.pre_buffer
+        mic = self.mic
+        listening = False
         
         while True:
-            if self.current_state != STATE_STOPPED and self.current_state != STATE_PLAYING:
+            state = self.current_state
+            if state == STATE_STOPPED or (state == STATE_PLAYING and not self.full_duplex):
+                listening = False
+                mic.stop()
+            else:
+                # 麦克风在中断里读满一帧, 还没读满时不等待, 让出事件循环给接收和播放任务
+                frame = mic.take()
+                if frame is None:
+                    await asyncio.sleep_ms(5)
+                    continue
                 try:
-                    # 从麦克风读取数据
-                    num_read = self.audio_in.readinto(audio_buffer)
+                    audio_buffer = pre_buffer.next_block()
+                    num_read = frame.n
+                    audio_buffer[:num_read] = frame.data[:num_read]
+                    t_us = frame.t_us
+                    self.mic_pool.release(frame)
                     if num_read > 0:
-                        # 保存当前帧到预缓冲区
-                        self.pre_buffer.append(audio_buffer[:num_read])
-                        if len(self.pre_buffer) > self.pre_buffer_size:
-                            self.pre_buffer.pop(0)
+                        pre_buffer.commit(num_read)
+                        
+                        if state == STATE_PLAYING:
+                            if not listening:
+                                listening = True
+                                self.barge_vad.reset()
+                                self._barge_frames = 0
+                            if self.listen_for_barge_in(audio_buffer, num_read):
+                                listening = False
+                                self.barge_in()
+                                # 只补发打断判定的这几帧和前一帧, 更早的是扬声器的回声
+                                pre_buffer.trim(self.barge_in_frames + 1)
+                                self.vad.reset()
+                                for block in pre_buffer.views():
+                                    self.vad.process(block, len(block))
+                                await self.send_pre_roll(t_us, new_turn=False)
+                            continue
+                        listening = False
                             
                         has_voice = self.detect_voice(audio_buffer, num_read)
                         
                         # LED指示声音活动
-                        self.led.value(1 if self.is_speaking else 0)
+                        self.led.value(1 if self.vad.is_speaking else 0)
                         
                         if has_voice:
                             if self.current_state != STATE_RECORDING:
-                                # 首次检测到声音，先发送预缓冲区的数据
-                                print('发送预缓冲数据...')
-                                for buffered_data in self.pre_buffer:
-                                    self.send_audio(buffered_data, len(buffered_data))
-                                self.current_state = STATE_RECORDING
-                            
-                            print('发送音频数据...')
-                            self.send_audio(audio_buffer, num_read)
+                                # 首次检测到声音，发送预缓冲区的数据(已包含当前帧)
+                                await self.send_pre_roll(t_us)
+                            else:
+                                await self.send_audio(audio_buffer, num_read)
+                                self.send_latency_us = time.ticks_diff(time.ticks_us(), t_us)
                         else:
                             if self.current_state == STATE_RECORDING:
                                 print("检测到静音，停止发送")
+                                self.trace.mark(latency_trace.VAD_END)
                                 self.current_state = STATE_STANDBY
                                 print('发送结束标记...')
                                 self.send_end_marker()
                                 # 清空VAD窗口
-                                self.vad_window.clear()
+                                self.vad.reset()
                 except Exception as e:
                     print(f"音频处理错误: {e}")
+                continue
             
             await asyncio.sleep_ms(10)
 
+    async def send_pre_roll(self, t_us, new_turn=True):
+        """开始录音: 补发预录缓冲(最新一帧的采集时间为 t_us); 打断时 barge_in() 已经开始了这一轮"""
+        print('发送预缓冲数据...')
+        pre_buffer = self.pre_buffer
+        trace = self.trace
+        if new_turn:
+            trace.begin_turn()
+        # 预录缓冲里最早一帧的采集时间
+        frame_us = self.audio_buffer_size * 500000 // self.mic_rate
+        trace.mark(latency_trace.MIC_FIRST, pre_buffer.count,
+                   time.ticks_add(t_us, -(pre_buffer.count - 1) * frame_us))
+        trace.mark(latency_trace.VAD_START)
+        self.encoder.reset()
+        pending = pre_buffer.count
+        for buffered_data in pre_buffer.views():
+            pending -= 1
+            await self.send_audio(buffered_data, len(buffered_data), pending)
+        self.current_state = STATE_RECORDING
+
+    def listen_for_barge_in(self, buf, n):
+        """播放回复时处理一帧麦克风数据, 用户开口(不是回声)时返回 True"""
+        echo = self.echo_gate.is_echo(buf, n)
+        speaking = self.barge_vad.process(buf, n)
+        if speaking and not echo:
+            self._barge_frames += 1
+        else:
+            self._barge_frames = 0
+        return self._barge_frames >= self.barge_in_frames
+
+    def barge_in(self):
+        """用户打断回复: 清空抖动缓冲和扬声器排着的块, 通知服务端取消, 丢掉还在路上的回复音频"""
+        print("检测到打断, 停止播放")
+        self.trace.begin_turn()
+        self.trace.mark(latency_trace.BARGE_IN)
+        self.barge_ins += 1
+        self._rx_muted = True
+        self.current_state = STATE_STANDBY
+        self.jitter.reset()
+        self.speaker.flush()
+        try:
+            self.sock.sendto(self.CANCEL_MARKER, (self.host, self.port))
+        except Exception as e:
+            print(f"发送取消标记错误: {e}")
+
     def send_end_marker(self):
         """发送录音结束标记"""
+        # 接下来是这次录音的回复
+        self._rx_muted = False
         try:
             # 发送元数据包，标记结束
             end_metadata = {
@@ -163,6 +362,7 @@ class AudioChatClient:
             # 将元数据转换为字节并发送
             end_packet = self.END_MARKER
             self.sock.sendto(end_packet, (self.host, self.port))
+            self.trace.mark(latency_trace.END_SENT)
             print("已发送录音结束标记")
             
         except Exception as e:
@@ -207,16 +407,26 @@ class AudioChatClient:
         while True:
             try:
                 try:
-                    data, addr = self.sock.recvfrom(1500)
-                    if data and len(data) >= 3:
-                        message_type = data[0]
-                        sequence = int.from_bytes(data[1:3], 'big')
-                        audio_chunk = data[3:]
-                        if message_type == 1:
-                            # 将音频数据写入缓冲区
-                            self.play_buffer.write(audio_chunk)
-                            self.current_state = STATE_PLAYING
-                            self.last_playback_time = time.ticks_ms()
+                    # 一次取完所有已到达的包, 到达时间才准确
+                    while True:
+                        data, addr = self.sock.recvfrom(1500)
+                        if data and len(data) >= 3:
+                            message_type = data[0]
+                            sequence = (data[1] << 8) | data[2]
+                            if message_type == 1 and not self._rx_muted:
+                                # 解码后按序号放入抖动缓冲(pcm16 不解码, 直接放入)
+                                payload = memoryview(data)[3:]
+                                decoder = self.decoder
+                                if decoder.codec != CODEC_PCM16:
+                                    if decoder.decoded_size(len(payload)) > self.play_frame_bytes:
+                                        self.rx_dropped += 1
+                                        continue
+                                    n = decoder.decode(payload, len(payload), self._rx_pcm)
+                                    payload = self._rx_pcm_view[:n]
+                                self.jitter.put(sequence, payload)
+                                self.trace.once(latency_trace.RX_FIRST, sequence)
+                                self.current_state = STATE_PLAYING
+                                self.last_playback_time = time.ticks_ms()
                 except OSError as e:
                     if e.args[0] != 11:  # EAGAIN
                         print(f"接收错误: {e}")
@@ -231,74 +441,54 @@ class AudioChatClient:
             await asyncio.sleep_ms(1)
             
     async def play_audio(self):
-        """异步播放音频任务"""
+        """异步播放音频任务: 按采样率的节奏每帧从抖动缓冲取一次"""
+        frame = bytearray(self.play_frame_bytes)
+        frame_view = memoryview(frame)
+        resampler = self.resampler
+        speaker = self.speaker
+        next_due = time.ticks_us()
         while True:
-            if self.current_state == STATE_PLAYING:
+            now = time.ticks_us()
+            if self.current_state != STATE_PLAYING:
+                next_due = now
+                speaker.end()
+            elif time.ticks_diff(now, next_due) >= 0:
                 try:
-                    # 当缓冲区数据足够或者有任何数据且超过播放超时时间时都进行播放
-                    if (self.play_buffer.available >= self.min_playback_buffer or 
-                        (self.play_buffer.available > 0 and 
-                         time.ticks_diff(time.ticks_ms(), self.last_playback_time) > self.playback_timeout)):
-                        
-                        chunk = self.play_buffer.read(1024)  # 每次读取1024字节播放
-                        if chunk:
-                            self.audio_out.write(chunk)
-                            self.last_playback_time = time.ticks_ms()
+                    # I2S 两块缓冲区都没写完时 out 为 None, 这一帧照常取出后丢掉;
+                    # 只有真的取出了一帧才计 overrun, 还在攒数据时不算
+                    out = speaker.buffer()
+                    if resampler.passthrough and out is not None:
+                        n, status = self.jitter.get_into(out)
+                    else:
+                        n, status = self.jitter.get_into(frame)
+                    if status == WAITING:
+                        # 攒够目标深度后立即开始, 不等下一个节拍; 这期间 I2S 播空不算欠载
+                        next_due = now
+                        speaker.end()
+                    else:
+                        if out is not None:
+                            speaker.submit(n if resampler.passthrough
+                                           else resampler.process(frame_view, n, out))
+                        else:
+                            speaker.overrun()
+                        next_due = time.ticks_add(next_due, self.play_frame_us)
                 except Exception as e:
                     print(f"播放音频错误: {e}")
             
-            await asyncio.sleep_ms(5)
-            
-    def calculate_energy(self, buffer, length):
-        """计算音频片段的能量"""
-        energy = 0
-        for i in range(0, length, 2):
-            sample = buffer[i] | (buffer[i + 1] << 8)
-            if sample & 0x8000:  # 处理负数
-                sample = sample - 0x10000
-            energy += abs(sample)
-        return energy / (length // 2)
-        
-    def detect_voice(self, buffer, length):
-        """使用滑动窗口检测声音活动"""
-        try:
-            # 计算当前帧的能量
-            current_energy = self.calculate_energy(buffer, length)
-            
-            # 更新滑动窗口
-            self.vad_window.append(current_energy)
-            if len(self.vad_window) > self.vad_window_size:
-                self.vad_window.pop(0)
-                
-            # 计算平均能量
-            average_energy = sum(self.vad_window) / len(self.vad_window)
-            
-            # print(f"average_energy: {average_energy}, threshold: {self.vad_threshold}")
+            await asyncio.sleep_ms(2)
             
-            # 判断是否有声音
-            if average_energy > self.vad_threshold:
-                self.voice_frames += 1
-                self.silence_frames = 0
-                if self.voice_frames >= 2:  # 至少需要2帧连续检测到声音
-                    self.is_speaking = True
-                    print("detected speaking...")
-            else:
-                if self.is_speaking:  # 只在说话状态下计数静音帧
-                    self.silence_frames += 1
-                    print(f"静音帧数: {self.silence_frames}")
-                self.voice_frames = 0
-                
-            # 静音检测
-            if self.is_speaking and self.silence_frames >= self.frames_to_confirm_silence:
-                print(f"检测到{self.frames_to_confirm_silence}帧静音，停止录音")
-                self.is_speaking = False
+    def dump_trace(self):
+        """把延迟打点按 CSV 打印到串口(在 REPL 里调用)"""
+        self.trace.dump()
             
-            return self.is_speaking
-                
-        except Exception as e:
-            print(f"Voice detection error: {e}")
-            self.is_speaking = False
-            return self.is_speaking
+    def detect_voice(self, buffer, length):
+        """使用共用的 VAD 检测声音活动"""
+        speaking = self.vad.process(buffer, length)
+        if self.vad.started:
+            print("detected speaking...")
+        elif self.vad.ended:
+            print(f"检测到{self.frames_to_confirm_silence}帧静音，停止录音")
+        return speaking
     
     
     async def start_chat(self):
@@ -2,7 +2,16 @@ import time
 from machine import Pin, I2S, Timer
 import json
 import _thread
-from uwebsockets import connect  # 使用正确的导入方式
+from uwebsockets import Connector, OP_BYTES  # 使用正确的导入方式
+import audio_codec
+import audio_proto
+from audio_pipeline import FramePool, IrqI2SSource
+from audio_player import RingPlayer
+import latency_trace
+from latency_trace import Tracer
+from myutil import PreRollBuffer, Signal, WatermarkRing
+from resample import Resampler
+from vad import EchoGate, Vad
 
 # 首先需要安装websocket库
 # 可以使用以下命令通过upip安装：
@@ -10,100 +19,6 @@ from uwebsockets import connect  # 使用正确的导入方式
 # upip.install('micropython-websockets')
 
 
-class RingBuffer:
-    """环形缓冲区实现"""
-    def __init__(self, size):
-        self.size = size
-        self.buffer = bytearray(size)
-        self.write_pos = 0
-        self.read_pos = 0
-        self.available = 0
-        
-    def write(self, data):
-        """写入数据到缓冲区"""
-        print(f"write:begin写入数据到缓冲区,可用大小: {self.available}")
-        data_len = len(data)
-        
-        # 检查是否有足够的空间写入数据
-        if data_len > self.size - self.available:
-            print("write:缓冲区空间不足")
-            return 0
-        
-        write_size = 0
-            
-        # 计算可写入长度
-        if self.write_pos >= self.read_pos:
-            # 写指针在读指针后面或相等
-            # 可以写到缓冲区末尾，如果数据还有剩余且读指针不在开头，才能绕到开头继续写
-            first_part = min(data_len, self.size - self.write_pos)
-            # 写入第一部分
-            self.buffer[self.write_pos:self.write_pos + first_part] = data[:first_part]
-            write_size += first_part
-            
-            if first_part < data_len:
-                # 还有数据需要写入，且必须确保不会覆盖到读指针
-                if self.read_pos > 0:  # 只有读指针不在开头时才能写入第二部分
-                    second_part = min(data_len - first_part, self.read_pos)
-                    self.buffer[0:second_part] = data[first_part:first_part + second_part]
-                    self.write_pos = second_part
-                    write_size += second_part
-                else:
-                    # 读指针在开头，不能环绕写入
-                    self.write_pos = 0
-            else:
-                self.write_pos = (self.write_pos + first_part) % self.size
-        else:
-            # 写指针在读指针前面，只能写到读指针位置
-            first_part = min(data_len, self.read_pos - self.write_pos)
-            self.buffer[self.write_pos:self.write_pos + first_part] = data[:first_part]
-            self.write_pos += first_part
-            write_size += first_part
-            
-        self.available += write_size
-        print(f"write:after写入数据后，缓冲区可用大小: {self.available}")
-        return write_size
-        
-    def read(self, size):
-        """从缓冲区读取数据"""
-        # with self.lock:
-        if self.available == 0:
-            return bytearray(0)
-            
-        print(f"read--begin:从缓冲区读取数据，可用大小: {self.available}")
-        read_size = min(size, self.available)
-        
-        if self.read_pos < self.write_pos:
-            # 读指针在写指针前面，最多只能读取到写指针位置
-            first_part = min(read_size, self.write_pos - self.read_pos)
-            result = bytearray(first_part)
-            result = self.buffer[self.read_pos:self.read_pos + first_part]
-            self.read_pos += first_part
-            
-            self.available -= first_part
-            
-        else:
-            # 读指针在写指针后面或相等，需要考虑环绕读取
-            first_part = min(read_size, self.size - self.read_pos)
-            result = bytearray(read_size)
-            result[:first_part] = self.buffer[self.read_pos:self.read_pos + first_part]
-            
-            if first_part < read_size:
-                # 需要环绕读取
-                print(f"需要环绕读取")
-                second_part = min(read_size - first_part, self.write_pos)
-                result[first_part:] = self.buffer[0:second_part]
-                self.read_pos = second_part
-                
-                self.available -= (first_part + second_part)
-            else:
-                print(f"不需要环绕读取")
-                self.read_pos = (self.read_pos + first_part) % self.size
-                
-                self.available -= first_part
-                
-        print(f"read--after:从缓冲区读取数据，可用大小: {self.available}")
-        return result
-
 class AudioChatClient:
     def __init__(self):
         # 状态标志
@@ -116,6 +31,9 @@ class AudioChatClient:
         self.button = Pin(0, Pin.IN, Pin.PULL_UP)  # 使用GPIO0作为按钮输入
         self.led = Pin(2, Pin.OUT)                 # 使用GPIO2作为LED指示
         
+        self.mic_rate = 8000  # 麦克风采样率
+        self.play_rate = 24000  # 扬声器采样率, 下行音频的采样率不同时先重采样
+        
         # I2S麦克风配置
         self.audio_in = I2S(
             1,                      
@@ -125,7 +43,7 @@ class AudioChatClient:
             mode=I2S.RX,           
             bits=16,               
             format=I2S.MONO,       
-            rate=8000,            
+            rate=self.mic_rate,            
             ibuf=4096,
         )
         
@@ -138,7 +56,7 @@ class AudioChatClient:
             mode=I2S.TX,           
             bits=16,               
             format=I2S.MONO,       
-            rate=24000,            
+            rate=self.play_rate,            
             ibuf=4096,
             # dma_buf_count=8,
             # dma_buf_len=1024
@@ -150,28 +68,95 @@ class AudioChatClient:
         # self.ws_server = "ws://192.168.2.227:8000/ws"
         self.reconnect_attempts = 3
         self.is_connected = False
+        self.ws_compress = True  # 协商 permessage-deflate, 压缩JSON文本消息
+        self.connect_timeout = 3  # 连接和握手超时(秒)
+        self.reconnect_backoff_ms = 200  # 重连失败后的等待, 逐次递增
+        # 缓存解析好的地址和连接参数, 重连只需要TCP握手加一次HTTP往返
+        self.ws_connector = Connector(self.ws_server, compress=self.ws_compress,
+                                      timeout=self.connect_timeout)
+        
+        # 音频传输协议: 连接时协商, 服务端支持则用二进制帧, 否则JSON+hex
+        self.binary_audio = False
+        self._server_binary = False  # 该服务端之前是否同意过二进制模式
+        self.hello_timeout = 1  # 等待协商回复的秒数
+        # 上行编码: 协商时优先提出, 服务端不支持时退回 pcm16; 帧头里标明实际编码
+        self.uplink_codec = audio_proto.CODEC_IMA_ADPCM
+        self.encoder = audio_codec.get(audio_proto.CODEC_PCM16)
+        self.audio_sequence = 0
+        self.rx_chunk_size = 1024  # 每次从WebSocket读取的最大字节数
+        # 下行解码: 服务端可以发压缩的 TTS 音频, 按块解码进播放环形缓冲区
+        self.downlink_codecs = (audio_proto.CODEC_IMA_ADPCM, audio_proto.CODEC_ULAW,
+                                audio_proto.CODEC_PCM16)
+        self._decoders = {codec: audio_codec.get(codec) for codec in self.downlink_codecs}
+        self._rx_decoder = None  # 当前接收中的二进制音频消息的解码器, None 表示丢弃
+        # 环形缓冲区的连续空间不够一块时, 先解码到这里再拷贝(ADPCM 一块最多展开 4 倍)
+        self._rx_pcm = bytearray(4 * self.rx_chunk_size)
+        self.rx_dropped = 0  # 丢弃的音频消息数(不支持的编码)
+        self.resample_mode = 'linear'  # 'polyphase' 音质更好, 但每个采样要多算几倍
+        self.resample_chunk = 512  # 每次重采样的输入字节数
+        self._resampler = None  # 按下行采样率创建, 采样率不变时一直复用
+        self._rx_resampler = None  # 当前接收中的消息要用的重采样器, None 表示不需要
+        self._rs_out = None
         
         # 音频缓冲区
         self.audio_buffer_size = 1024  # 保持4096字节以获得足够的检测窗口
-        self.vad_window = []
-        self.vad_window_size = 4  # 保持4个窗口
-        self.vad_threshold = 200  # 降低阈值，使其更容易检测到声音
-        self.frames_to_confirm_silence = 6  # 降低到8帧，约2秒静音就停止
-        
-        # 确保这些变量被正确初始化
-        self.voice_frames = 0
-        self.silence_frames = 0
-        self.is_speaking = False
+        # 麦克风非阻塞采集: 中断里读进预分配的帧(前面留出帧头), 每帧带采集时间和序号
+        self.mic_pool = FramePool(4, self.audio_buffer_size, audio_proto.HEADER_SIZE)
+        self.mic = IrqI2SSource(self.audio_in, self.mic_rate, pool=self.mic_pool)
+        self.vad_threshold = 200  # 声音阈值的下限, 实际门限随噪声底自适应
+        self.frames_to_confirm_silence = 6  # 连续6帧静音就停止
+        self.vad_mode = 'energy'  # 有风扇/键盘声的环境改为 'spectral', 少发静音帧
+        self.vad = Vad(window=4, min_voice_frames=3, min_threshold=self.vad_threshold,
+                       hangover_frames=self.frames_to_confirm_silence, mode=self.vad_mode)
         
         # 音频播放缓冲区
-        self.play_buffer = RingBuffer(1024 * 32)  # 8KB的环形缓冲区
+        # 32KB的环形缓冲区, 接收线程写, 播放线程读; 攒够高水位开始播放,
+        # 缓冲区满时接收线程等播放线程播到低水位再继续写
         self.play_chunk_size = 1024  # 每次播放2KB
-        self._is_playing = False
-        self._player_thread_running = True
+        self.play_buffer = WatermarkRing(1024 * 32, high=self.play_chunk_size * 16,
+                                         low=self.play_chunk_size * 8)
+        self.play_flush_ms = 200  # 这么久没有新的下行音频, 不够缓冲门限也开始播放(回复的结尾)
+        self.play_irq = True  # I2S 非阻塞写, 写完由中断回调唤醒播放线程
+        # 播放线程只在越过水位、回复结尾的定时器和 I2S 写完时被唤醒, 不轮询
+        self.player = RingPlayer(self.play_buffer, self.audio_out, self.play_chunk_size,
+                                 Timer(0), self.play_flush_ms, use_irq=self.play_irq)
+        
+        # 全双工: 播放回复时麦克风也在听, 用户开口(不是扬声器的回声)就打断:
+        # 清空播放缓冲区, 通知服务端取消这次回复, 直接开始录音
+        self.full_duplex = True
+        self.echo_gate = EchoGate(coupling=384, tail_ms=300)  # 麦克风电平不超过参考电平x1.5判为回声
+        self.barge_vad = Vad(window=2, min_voice_frames=1, min_threshold=self.vad_threshold,
+                             hangover_frames=2, mode=self.vad_mode)
+        self.barge_in_frames = 2  # 连续这么多帧有声且不是回声才算打断
+        self._barge_frames = 0
+        self._barge_preroll = PreRollBuffer(self.barge_in_frames + 1, self.audio_buffer_size)
+        self._preroll_packet = bytearray(audio_proto.HEADER_SIZE + self.audio_buffer_size)
+        self.barge_ins = 0  # 打断次数
+        self._rx_muted = False  # 打断后丢掉被取消的回复里还在路上的音频, 直到这次录音结束
+        self._barged = False  # 刚打断过, 接下来的录音属于打断时开始的那一轮
+        # 麦克风线程只在按键、开始播放时被唤醒
+        self.mic_wake = Signal()
+        self._record_requested = False
+        self._mic_running = True
+        if self.full_duplex:
+            self.player.echo_ref = self.echo_gate
+            self.player.on_start = self.mic_wake.set
+        
+        # 延迟打点: 录音、VAD、结束标记、回复音频到达、开始/结束播放的时间,
+        # 串口上调用 dump_trace(), 或服务端发 {'type': 'trace'} 取回 CSV
+        self.trace = Tracer(128)
+        self.player.trace = self.trace
         
         self._ws_monitor_running = False
-        self._last_ws_check = time.time()
-        self.ws_check_interval = 5  # 每5秒检查一次连接状态
+        self._last_ws_check = time.ticks_ms()  # 上次重连失败的时间
+        self._reconnect_failed = False
+        self.ws_check_interval = 5  # 重连失败后, 每5秒再试一次
+        self.ws_monitor_interval_ms = 100  # 监控线程的检查周期
+        
+        # 心跳: 每200ms发一次ping, 连续2次没有回应(pong或任何数据都算)就认为连接已断开,
+        # 断线后最多约0.6秒发现。接收线程等播放缓冲区时最多停一块音频的时间, 不会误判
+        self.ping_interval_ms = 200
+        self.max_missed_pongs = 2
         
     def blink_led(self, times=1, interval=0.2):
         """LED闪烁指示"""
@@ -181,48 +166,101 @@ class AudioChatClient:
             self.led.value(0)
             time.sleep(interval)
             
-    def connect_websocket(self):
-        """连接WebSocket服务器"""
+    def connect_websocket(self, indicate=True):
+        """连接WebSocket服务器, indicate 为 False 时(后台重连)不闪灯"""
         for attempt in range(self.reconnect_attempts):
             try:
-                # 使用uwebsockets的connect函数创建连接
-                self.ws = connect(self.ws_server)
-                print("WebSocket连接成功")
-                self.blink_led(2)  # 连接成功指示
+                self.ws = self.ws_connector.reconnect(self.ws)
+                print(f"WebSocket连接成功, 耗时 {self.ws_connector.handshake_ms} ms")
+                self.negotiate_protocol()
+                self.ws.set_keepalive(self.ping_interval_ms, self.max_missed_pongs)
                 self.is_connected = True
+                if indicate:
+                    self.blink_led(2)  # 连接成功指示
                 return True
             except Exception as e:
                 print(f"WebSocket连接失败 (尝试 {attempt + 1}/{self.reconnect_attempts}): {e}")
-                self.blink_led(5, 0.1)  # 错误指示
-                time.sleep(2)
+                time.sleep_ms(self.reconnect_backoff_ms * (attempt + 1))
+        if indicate:
+            self.blink_led(5, 0.1)  # 错误指示
         return False
     
+    def negotiate_protocol(self):
+        """协商音频传输格式"""
+        self.ws.send(audio_proto.hello_message(self.mic_rate, self.uplink_codec,
+                                               self.downlink_codecs))
+        if self._server_binary:
+            # 之前协商成功过, 不再等回复(由接收线程处理), 重连少一个往返
+            self.binary_audio = True
+            return
+        self.binary_audio = False
+        self.set_encoder(audio_proto.CODEC_PCM16)
+        try:
+            self.ws.settimeout(self.hello_timeout)
+            reply = self.ws.recv()
+            self.binary_audio = audio_proto.accepts_binary(reply)
+            self._server_binary = self.binary_audio
+            if self.binary_audio:
+                self.set_encoder(audio_proto.reply_codec(json.loads(reply)))
+        except OSError as e:
+            # 旧服务端不回复hello, 超时后使用JSON+hex
+            print(f"协商超时, 使用JSON音频: {e}")
+        finally:
+            self.ws.settimeout(None)
+        print("音频传输格式:", "binary" if self.binary_audio else "json",
+              audio_proto.CODEC_NAMES[self.encoder.codec])
+    
+    def set_encoder(self, codec):
+        """切换上行编码(只在二进制模式下生效), 编码格式不变时保留编码状态"""
+        if codec != self.encoder.codec:
+            self.encoder = audio_codec.get(codec)
+    
     def _is_ws_connected(self):
-        return self.ws.open and self.is_connected
+        return self.ws is not None and self.ws.open and self.is_connected
     
     
     
     def receive_messages(self):
         """接收服务器消息的线程"""
+        # 固定大小的接收缓冲区, 再长的音频回复也按块流过, 内存占用不变
+        rx_buffer = bytearray(self.rx_chunk_size)
+        rx_view = memoryview(rx_buffer)
+        message = None
+        first = True  # 下一块是否是新消息的开头
         while True:
             if not self._is_ws_connected():
                 time.sleep(0.5)  # 连接断开时等待
+                first = True
                 continue
                 
             try:
-                # 使用uwebsockets的recv方法接收消息
-                message = self.ws.recv()
-                if message is None:  # 检查是否接收到None
-                    time.sleep(0.01)  # 没有消息时短暂休眠
+                num_read, opcode, done = self.ws.recv_into(rx_buffer)
+                if opcode is None:  # 连接已关闭
+                    first = True
+                    time.sleep(0.01)
+                    continue
+                
+                if opcode == OP_BYTES:
+                    # 二进制帧: 帧头 + 音频数据, 收到一块就播放一块
+                    self.handle_audio_frame(rx_view[:num_read], first)
+                    first = done
+                    continue
+                
+                # 文本消息拼接完整后再解析
+                if first:
+                    message = bytearray(rx_view[:num_read])
+                else:
+                    message += rx_view[:num_read]
+                first = done
+                if not done:
                     continue
                     
-                data = json.loads(message)
+                data = json.loads(message.decode('utf-8'))
+                message = None
                 
                 if data['type'] == 'audio':
-                    print("ws:Received audio data")
                     audio_bytes = bytes.fromhex(data['audio'])
-                    self.audio_out.write(audio_bytes)
-                    # self.play_audio(audio_bytes)
+                    self.play_audio(audio_bytes)
                     
                 elif data['type'] == 'text':
                     print("AI回复:", data['text'])
@@ -230,132 +268,297 @@ class AudioChatClient:
                 elif data['type'] == 'status':
                     print("状态:", data['message'])
                     
+                elif data['type'] == 'hello':
+                    # 重连时没有等待的协商回复
+                    self.binary_audio = data.get('audio') == 'binary'
+                    self._server_binary = self.binary_audio
+                    self.set_encoder(audio_proto.reply_codec(data))
+                    
                 elif data['type'] == 'error':
                     print("错误:", data['message'])
                     self.blink_led(3, 0.1)
+                    
+                elif data['type'] == 'trace':
+                    self.ws.send(json.dumps({'type': 'trace', 'csv': self.trace.csv()}))
             except OSError as e:
-                if e.args[0] == 128:  # ENOTCONN
+                first = True
+                if e.args[0] == 128 or not self.ws.open:  # ENOTCONN, 或心跳超时已关闭
                     print("WebSocket连接已断开")
+                    # 等待监控线程重连, 本线程继续运行
                     self.is_connected = False
-                    break
                 else:
                     print(f"网络错误: {e}")
                     # 其他网络错误可能是临时的，可以继续尝试
                     time.sleep(1)        
             except Exception as e:
+                first = True
                 print("接收消息错误:", e)
                 import sys
                 sys.print_exception(e)
                 time.sleep(0.5)  # 发生错误时等待longer
                 
-    def detect_voice_activity(self, audio_data):
-        """改进的语音活动检测"""
-        try:
-            # 创建音频数据的副本以避免修改原始数据
-            audio_copy = audio_data[:]
-            
-            # 计算当前帧的音量
-            total = 0
-            data_length = len(audio_copy)  
-            i = 0
-            while i < data_length - 1:
-                # 将两个字节组合成16位整数
-                value = (audio_copy[i+1] << 8) | audio_copy[i]
-                if value & 0x8000:
-                    value -= 65536
-                total += abs(value)
-                i += 2
-            
-            current_average = total / (data_length // 2)
-            
-            # 更新滑动窗口
-            self.vad_window.append(current_average)
-            if len(self.vad_window) > self.vad_window_size:
-                self.vad_window.pop(0)
-            
-            # 计算窗口平均值
-            window_average = sum(self.vad_window) / len(self.vad_window)
-            
-            print(f"当前音量: {window_average:.2f}, 阈值: {self.vad_threshold}")
-            
-            # 声音检测逻辑
-            if window_average > self.vad_threshold:
-                self.voice_frames += 1
-                self.silence_frames = 0
-                if self.voice_frames > 2:
-                    self.is_speaking = True
-                    print("检测到说话")
+    def handle_audio_frame(self, frame, first=True):
+        """处理二进制音频帧, first 表示是消息的第一块(带帧头)"""
+        if not first:
+            # 后续数据块只有音频数据, 沿用第一块的解码器(ADPCM 的解码状态接着上一块)
+            decoder = self._rx_decoder
+            if decoder is None:
+                return
+            self.decode_to_player(decoder, frame)
+            return
+        self._rx_decoder = None
+        if len(frame) < audio_proto.HEADER_SIZE:
+            return
+        msg_type, codec, sequence, sample_rate = audio_proto.unpack_header(frame)
+        if msg_type != audio_proto.MSG_AUDIO:
+            print("未知的二进制消息类型:", msg_type)
+            return
+        decoder = self._decoders.get(codec)
+        if decoder is None:
+            print("不支持的音频编码:", codec)
+            self.rx_dropped += 1
+            return
+        self._rx_decoder = decoder
+        decoder.start_stream()
+        self._rx_resampler = self.resampler_for(sample_rate)
+        self.decode_to_player(decoder, memoryview(frame)[audio_proto.HEADER_SIZE:])
+    
+    def resampler_for(self, sample_rate):
+        """下行采样率和扬声器不同时返回重采样器, 只在采样率变化时创建"""
+        if not sample_rate or sample_rate == self.play_rate:
+            return None
+        resampler = self._resampler
+        if resampler is None or resampler.in_rate != sample_rate:
+            resampler = Resampler(sample_rate, self.play_rate, self.resample_mode)
+            self._rs_out = bytearray(resampler.output_size(self.resample_chunk))
+            self._resampler = resampler
+            print("下行音频重采样: %d -> %d Hz" % (sample_rate, self.play_rate))
+        return resampler
+    
+    def decode_to_player(self, decoder, payload):
+        """把一块音频解码进播放环形缓冲区, 连续空间够时直接解码进去, 不经过中间缓冲"""
+        size = decoder.stream_size(len(payload))
+        if not size or self._rx_muted:
+            return
+        self.trace.once(latency_trace.RX_FIRST, size)
+        ring = self.play_buffer
+        if self._rx_resampler is not None:
+            # 采样率不同: 先解码到预分配的缓冲区, 再分段重采样进环形缓冲区
+            n = decoder.decode_stream(payload, len(payload), self._rx_pcm)
+            self.resample_to_player(self._rx_resampler, n)
+            return
+        # 缓冲区满时等播放线程腾出空间, 播放线程已经停止时丢掉;
+        # 等的时候用户打断了(discard() 清空缓冲区会唤醒这里), 这块属于被取消的回复, 也丢掉
+        if not self.player.wait_space(size) or self._rx_muted:
+            return
+        view = ring.write_views(size)[0]
+        if len(view) >= size:
+            ring.commit(decoder.decode_stream(payload, len(payload), view))
+        else:
+            # 可写区域在缓冲区末尾折返, 先解码到预分配的缓冲区
+            n = decoder.decode_stream(payload, len(payload), self._rx_pcm)
+            ring.write_from(self._rx_pcm, n)
+        self.player.received()
+    
+    def resample_to_player(self, resampler, nbytes):
+        """把 _rx_pcm 的前 nbytes 字节按 resample_chunk 分段重采样, 写入播放环形缓冲区"""
+        ring = self.play_buffer
+        src = memoryview(self._rx_pcm)
+        chunk = self.resample_chunk
+        for i in range(0, nbytes, chunk):
+            n = min(chunk, nbytes - i)
+            size = resampler.output_size(n)
+            if not self.player.wait_space(size) or self._rx_muted:
+                return
+            view = ring.write_views(size)[0]
+            if len(view) >= size:
+                ring.commit(resampler.process(src[i:i + n], n, view))
             else:
-                if self.is_speaking:  # 只在说话状态下计数静音帧
-                    self.silence_frames += 1
-                    print(f"静音帧数: {self.silence_frames}")
-                self.voice_frames = 0
-            
-            # 静音检测
-            if self.is_speaking and self.silence_frames >= self.frames_to_confirm_silence:
-                print(f"检测到{self.frames_to_confirm_silence}帧静音，停止录音")
-                return False
-            
-            return self.is_speaking
-            
-        except Exception as e:
-            print(f"VAD错误: {e}")
-            import sys
-            sys.print_exception(e)
+                m = resampler.process(src[i:i + n], n, self._rs_out)
+                ring.write_from(self._rs_out, m)
+        self.player.received()
+                
+    def detect_voice_activity(self, audio_data, num_read=None):
+        """语音活动检测, 说话结束(连续静音)时返回 False"""
+        speaking = self.vad.process(audio_data, num_read)
+        if self.vad.started:
+            self.trace.mark(latency_trace.VAD_START)
+            print("检测到说话")
+        elif self.vad.ended:
+            self.trace.mark(latency_trace.VAD_END)
+            print(f"检测到{self.frames_to_confirm_silence}帧静音，停止录音")
             return False
+        return speaking
                 
-    def start_recording(self):
-        """开始录音并发送"""
+    def send_mic_audio(self, packet, audio_buffer, num_read):
+        """发送一块麦克风音频; packet 开头留 HEADER_SIZE 字节帧头, audio_buffer 是其后的音频区"""
+        if self.binary_audio:
+            # 在麦克风帧里原地编码, 不需要额外内存
+            encoder = self.encoder
+            size = encoder.encode(audio_buffer, num_read, audio_buffer)
+            audio_proto.pack_header(packet, audio_proto.MSG_AUDIO,
+                                    self.audio_sequence, self.mic_rate,
+                                    encoder.codec)
+            self.audio_sequence = (self.audio_sequence + 1) % 65536
+            self.ws.send_into(packet, 0, audio_proto.HEADER_SIZE + size)
+        else:
+            message = {
+                'type': 'audio',
+                'audio': bytes(audio_buffer[:num_read]).hex()
+            }
+            self.ws.send(json.dumps(message))
+    
+    def start_recording(self, barge_in=False):
+        """开始录音并发送; barge_in 为打断回复时自动开始的录音, 先补发打断前听到的几帧, 说完自动停止"""
         self.current_state = self.STATE_RECORDING
-        audio_buffer = bytearray(self.audio_buffer_size)
+        if self._barged:
+            self._barged = False  # barge_in() 已经开始了新的一轮(按键打断或自动打断)
+        else:
+            self.trace.begin_turn()
+        trace = self.trace
+        # 麦克风在中断里读进帧池的帧, 帧头写在帧的 headroom 里, 和音频数据一起发出
+        mic = self.mic
         
         # 重置VAD相关的计数器
-        self.voice_frames = 0
-        self.silence_frames = 0
-        self.is_speaking = False
-        self.vad_window = []
+        self.vad.reset()
+        self.encoder.reset()
+        mic.start()
         
         total_bytes = 0
+        if barge_in and self._is_ws_connected():
+            packet = self._preroll_packet
+            audio_buffer = memoryview(packet)[audio_proto.HEADER_SIZE:]
+            try:
+                for block in self._barge_preroll.views():
+                    audio_buffer[:len(block)] = block
+                    self.send_mic_audio(packet, audio_buffer, len(block))
+                    total_bytes += len(block)
+            except OSError as e:
+                print("WebSocket连接已断开")
+                self.is_connected = False
+                self.stop_recording()
+                return
+        self._barge_preroll.clear()
+        
         while self.current_state == self.STATE_RECORDING:
+            # 取一帧麦克风数据(带采集时间和序号), 还没读满就等中断回调
+            frame = mic.take()
+            if frame is None:
+                mic.ready.wait()
+                continue
             try:
-                # 从麦克读取数据
-                num_read = self.audio_in.readinto(audio_buffer)
-                if num_read > 0:
+                audio_buffer = frame.data
+                num_read = frame.n  # 实际读到的字节数, 不足一帧时后面是旧数据
+                if not num_read:
+                    continue
+                trace.once(latency_trace.MIC_FIRST, frame.seq, frame.t_us)
                     
-                    # 检测是否有声音活动
-                    # has_voice = self.detect_voice_activity(audio_buffer)
+                # 检测是否有声音活动; 按键录音由按键结束, 打断时的录音说完就停
+                if barge_in:
+                    has_voice = self.detect_voice_activity(audio_buffer, num_read)
+                else:
                     has_voice = True
-                    self.led.value(1 if has_voice else 0)  # LED指示
-                    
-                    # 只在检测到声音活动时才发送音频数据
-                    if self._is_ws_connected():
-                        try:
-                            message = {
-                                'type': 'audio',
-                                'audio': bytes(audio_buffer[:num_read]).hex()
-                            }
-                            total_bytes += num_read
-                            print(f"发送数据块大小: {num_read} bytes")
-                            self.ws.send(json.dumps(message))
-                            # time.sleep_ms(50)
-                        except OSError as e:
-                            print("WebSocket连接已断开")
-                            self.is_connected = False  # 确保连接状态正确更新
-                            self.stop_recording()
-                            break  # 退出接收循环，让监控线程处理重连
-                        except Exception as e:
-                            print(f"发送数据错误: {e}")
-                    
-                    # 如果已经开始说话且检测到足够长的静音，自动停止录音
-                    if not has_voice and self.is_speaking:
-                        print("检测到足够长的静音，自动停止录音")
-                        print(f"总共发送数据: {total_bytes} bytes")
+                self.led.value(1 if has_voice else 0)  # LED指示
+                
+                # 只在检测到声音活动时才发送音频数据
+                if self._is_ws_connected():
+                    try:
+                        total_bytes += num_read
+                        self.send_mic_audio(frame.buf, audio_buffer, num_read)
+                        # time.sleep_ms(50)
+                    except OSError as e:
+                        print("WebSocket连接已断开")
+                        self.is_connected = False  # 确保连接状态正确更新
                         self.stop_recording()
-                        break
+                        break  # 退出接收循环，让监控线程处理重连
+                    except Exception as e:
+                        print(f"发送数据错误: {e}")
+                
+                # 如果已经开始说话且检测到足够长的静音，自动停止录音
+                if not has_voice and self.vad.ended:
+                    print("检测到足够长的静音，自动停止录音")
+                    print(f"总共发送数据: {total_bytes} bytes")
+                    self.stop_recording()
+                    break
                     
             except Exception as e:
                 print(f"录音错误: {e}")
                 break
+            finally:
+                self.mic_pool.release(frame)
+        mic.stop()
+        if mic.dropped:
+            print(f"麦克风丢帧: {mic.dropped}/{mic.frames}")
+    
+    def listen_for_barge_in(self):
+        """播放回复时处理一帧麦克风数据, 用户开口(不是回声)时返回 True"""
+        mic = self.mic
+        frame = mic.take()
+        if frame is None:
+            mic.ready.wait()
+            return False
+        try:
+            data = frame.data
+            n = frame.n
+            # 留着打断时补发, 开头的字不丢
+            self._barge_preroll.next_block()[:n] = data[:n]
+            self._barge_preroll.commit(n)
+            echo = self.echo_gate.is_echo(data, n)
+            speaking = self.barge_vad.process(data, n)
+        finally:
+            self.mic_pool.release(frame)
+        if speaking and not echo:
+            self._barge_frames += 1
+        else:
+            self._barge_frames = 0
+        return self._barge_frames >= self.barge_in_frames
+    
+    def barge_in(self):
+        """用户打断回复: 清空播放缓冲区, 通知服务端取消, 丢掉还在路上的回复音频"""
+        print("检测到打断, 停止播放")
+        self.trace.begin_turn()
+        self.trace.mark(latency_trace.BARGE_IN)
+        self._barged = True
+        self.barge_ins += 1
+        self._rx_muted = True
+        self.player.discard()
+        if self._is_ws_connected():
+            try:
+                self.ws.send(json.dumps({'type': 'cancel'}))
+            except Exception as e:
+                print(f"发送取消信号失败: {e}")
+    
+    def mic_thread(self):
+        """麦克风线程: 按键录音; 全双工时播放回复期间也在听, 用户开口就打断"""
+        print("麦克风线程开始运行")
+        mic = self.mic
+        listening = False
+        while self._mic_running:
+            try:
+                if self._record_requested:
+                    self._record_requested = False
+                    listening = False
+                    if self.player.playing:
+                        self.barge_in()  # 播放时按键也是打断
+                    self.start_recording()
+                elif (self.full_duplex and self.player.playing
+                        and self.current_state == self.STATE_IDLE):
+                    if not listening:
+                        listening = True
+                        self.barge_vad.reset()
+                        self._barge_frames = 0
+                        self._barge_preroll.clear()
+                    if self.listen_for_barge_in():
+                        listening = False
+                        self.barge_in()
+                        self.start_recording(barge_in=True)
+                else:
+                    listening = False
+                    mic.stop()
+                    self.mic_wake.wait()
+            except Exception as e:
+                print("麦克风线程错误:", e)
+                time.sleep_ms(10)
                 
     def stop_recording(self):
         """停止录音"""
@@ -367,101 +570,54 @@ class AudioChatClient:
                     self.ws.send(json.dumps({
                         'type': 'end_recording'
                     }))
+                    self.trace.mark(latency_trace.END_SENT)
                 except Exception as e:
                     print(f"发送结束信号失败: {e}")
+            # 接下来是这次录音的回复
+            self._rx_muted = False
             
             # 重置所有状态
-            self.voice_frames = 0
-            self.silence_frames = 0
-            self.is_speaking = False
-            self.vad_window = []
+            self.vad.reset()
             self.led.value(0)
             
-    def start_audio_player(self):
-        """开始播放音频"""
-        self._is_playing = True
-        
     def stop_audio_player(self):
-        """停止当前音频的播放"""
-        self._is_playing = False
+        """停止当前音频的播放, 丢掉还没播的数据"""
+        self.player.discard()
         
     def audio_player_thread(self):
         """音频播放线程"""
         print("播放线程开始运行")
-        buffer_low_threshold = self.play_chunk_size * 8
-        buffer_high_threshold = self.play_chunk_size * 16
-        waiting_for_data = True
-        last_data_time = time.time()  # 记录最后一次有数据的时间
-        
-        while self._player_thread_running:
+        while True:
             try:
-                if not self._is_playing:
-                    time.sleep_ms(10)
-                    waiting_for_data = True
-                    continue
-                    
-                current_time = time.time()
-                
-                # 检查是否长时间没有新数据
-                if self.play_buffer.available == 0 and (current_time - last_data_time) > 5:
-                    print("5秒内没有新数据，重置播放状态")
-                    waiting_for_data = True
-                    self._is_playing = False
-                    continue
-                    
-                # 缓冲区管理策略
-                if waiting_for_data:
-                    if self.play_buffer.available < buffer_high_threshold:
-                        print(f"play:等待数据积累，当前: {self.play_buffer.available}/{buffer_high_threshold}")
-                        time.sleep_ms(10)
-                        continue
-                    waiting_for_data = False
-                
-                # 播放逻辑
-                if self.play_buffer.available > 0:
-                    last_data_time = current_time  # 更新最后一次有数据的时间
-                    chunk_size = min(self.play_chunk_size, self.play_buffer.available)
-                    chunk = self.play_buffer.read(chunk_size)
-                    
-                    try:
-                        num_written = 0
-                        while num_written < len(chunk):
-                            num_written += self.audio_out.write(chunk[num_written:len(chunk)])
-                    except Exception as e:
-                        print(f"I2S写入错误: {e}")
-                        time.sleep_ms(10)
-                else:
-                    time.sleep_ms(5)
-                    
+                self.player.run()
+                break
             except Exception as e:
                 print("播放线程错误:", e)
                 time.sleep_ms(10)
 
     def play_audio(self, audio_bytes):
-        """处理接收到的音频数据"""
+        """处理接收到的音频数据: 写入环形缓冲区, 缓冲区满时等播放线程腾出空间"""
+        if self._rx_muted:
+            return
+        self.trace.once(latency_trace.RX_FIRST, len(audio_bytes))
         try:
-            # 写入环形缓冲区
-            while len(audio_bytes) > 0:
-                written = self.play_buffer.write(audio_bytes)
-                if written == 0:
-                    # 缓冲区满，等待一会
-                    time.sleep_ms(20)
-                else:
-                    audio_bytes = audio_bytes[written:]
-            
-            # 开始播放
-            self.start_audio_player()
-                
+            # 等空间时被打断, 写入中止, 被取消的回复不会写进清空后的缓冲区
+            self.player.write(audio_bytes)
         except Exception as e:
             print("音频写入环形缓冲区错误:", e)
             
+    def dump_trace(self):
+        """把延迟打点按 CSV 打印到串口(在 REPL 里调用)"""
+        self.trace.dump()
+            
     def button_handler(self, pin):
         """按钮中断处理"""
         time.sleep(0.02)  # 消除按钮抖动
         if pin.value() == 0:  # 按钮按下
             if self.current_state == self.STATE_IDLE:
                 print("开始录音...")
-                _thread.start_new_thread(self.start_recording, ())
+                self._record_requested = True
+                self.mic_wake.set()
             elif self.current_state == self.STATE_RECORDING:
                 print("停止录音...")
                 self.stop_recording()
@@ -473,16 +629,25 @@ class AudioChatClient:
         
         while self._ws_monitor_running:
             try:
-                current_time = time.time()
-                if not self._is_ws_connected() and (current_time - self._last_ws_check) >= self.ws_check_interval:
+                current_time = time.ticks_ms()
+                if self._is_ws_connected():
+                    # 发送心跳, 连续几次没有回应时判定断开
+                    if not self.ws.keepalive():
+                        print("心跳超时，WebSocket已断开, RTT:", self.ws.rtt_stats())
+                        self.is_connected = False
+                        continue
+                elif (not self._reconnect_failed or
+                      time.ticks_diff(current_time, self._last_ws_check) >= self.ws_check_interval * 1000):
                     print("检测到WebSocket断开，尝试重连...")
-                    if self.connect_websocket():
+                    if self.connect_websocket(indicate=False):
                         print("WebSocket重连成功")
+                        self._reconnect_failed = False
                     else:
                         print("WebSocket重连失败")
+                        self._reconnect_failed = True
                     self._last_ws_check = current_time
                     
-                time.sleep(1)
+                time.sleep_ms(self.ws_monitor_interval_ms)
             except Exception as e:
                 print(f"WebSocket监控错误: {e}")
                 time.sleep(1)
@@ -504,6 +669,9 @@ class AudioChatClient:
             # 启动播放线程
             _thread.start_new_thread(self.audio_player_thread, ())
             
+            # 启动麦克风线程(按键录音、全双工打断)
+            _thread.start_new_thread(self.mic_thread, ())
+            
             # 设置按钮中断
             self.button.irq(trigger=Pin.IRQ_FALLING, handler=self.button_handler)
             
@@ -522,7 +690,9 @@ class AudioChatClient:
         """清理资源"""
         self._ws_monitor_running = False  # 停止WebSocket监控
         self.current_state = self.STATE_IDLE
-        self._player_thread_running = False
+        self.player.stop()
+        self._mic_running = False
+        self.mic_wake.set()
         self.ws.close()
         self.audio_in.deinit()
         self.audio_out.deinit()
@@ -0,0 +1,459 @@
+"""
+上行/下行音频编解码: PCM16 / G.711 μ-law (2:1) / IMA-ADPCM (4:1)
+
+输入输出都是缓冲区 + 字节数, 不分配内存; 编码可以原地进行
+(dst 和 src 是同一块缓冲区), μ-law 解码也可以原地进行。
+IMA-ADPCM 每个数据块(一帧)前有 4 字节块头: 预测值(int16 小端)、
+步长下标、保留字节, 记录的是编码这一块之前的状态, 所以丢了前面的包
+也能从任意一块开始解码。每字节两个采样, 低 4 位在前。
+采样数须为偶数(帧大小都是 2 的幂)。
+一块很长的 ADPCM 数据(一条音频消息)可能分成几段收到: start_stream()
+之后逐段调用 decode_stream(), 预测值和步长下标在段之间延续, 被拆开的
+块头先缓存起来; 每字节两个完整的采样, 段边界不会切开采样。
+
+支持 viper 的端口(esp32)用原生循环, 其余端口(包括 CPython)用等价的
+Python 实现。
+"""
+from array import array
+
+import audio_proto
+from audio_proto import CODEC_PCM16, CODEC_ULAW, CODEC_IMA_ADPCM
+
+ADPCM_HEADER = 4
+
+_STEPS = array('H', (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767))
+
+
+def _ulaw_to_linear(u):
+    u = ~u & 0xff
+    exponent = (u >> 4) & 7
+    x = (((u & 0x0f) << 3) + 0x84) << exponent
+    x -= 0x84
+    return -x if u & 0x80 else x
+
+
+_ULAW_TABLE = array('h', [_ulaw_to_linear(u) for u in range(256)])
+
+
+# Python 实现 (CPython 和没有 viper 的端口)
+
+def _sample(mv, i):
+    x = mv[2 * i] | (mv[2 * i + 1] << 8)
+    return x - 0x10000 if x & 0x8000 else x
+
+
+def _ulaw_encode_python(src, n, dst):
+    s = memoryview(src)
+    d = memoryview(dst)
+    for i in range(n):
+        x = _sample(s, i)
+        sign = 0
+        if x < 0:
+            sign = 0x80
+            x = -x
+        if x > 32635:
+            x = 32635
+        x += 0x84
+        exponent = 7
+        mask = 0x4000
+        while exponent and not x & mask:
+            exponent -= 1
+            mask >>= 1
+        d[i] = (sign | (exponent << 4) | ((x >> (exponent + 3)) & 0x0f)) ^ 0xff
+
+
+def _ulaw_decode_python(src, n, dst):
+    s = memoryview(src)
+    d = memoryview(dst)
+    table = _ULAW_TABLE
+    # 从后往前, 允许原地解码
+    for i in range(n - 1, -1, -1):
+        x = table[s[i]] & 0xffff
+        d[2 * i] = x & 0xff
+        d[2 * i + 1] = x >> 8
+
+
+def _ima_step(x, state):
+    """编码一个采样, 更新 state=[预测值, 下标], 返回 4 位码"""
+    predictor, index = state[0], state[1]
+    step = _STEPS[index]
+    diff = x - predictor
+    nibble = 0
+    if diff < 0:
+        nibble = 8
+        diff = -diff
+    vpdiff = step >> 3
+    if diff >= step:
+        nibble |= 4
+        diff -= step
+        vpdiff += step
+    step >>= 1
+    if diff >= step:
+        nibble |= 2
+        diff -= step
+        vpdiff += step
+    step >>= 1
+    if diff >= step:
+        nibble |= 1
+        vpdiff += step
+    _ima_update(state, nibble, vpdiff)
+    return nibble
+
+
+def _ima_update(state, nibble, vpdiff):
+    predictor = state[0] - vpdiff if nibble & 8 else state[0] + vpdiff
+    state[0] = -32768 if predictor < -32768 else 32767 if predictor > 32767 else predictor
+    m = nibble & 7
+    index = state[1] - 1 if m < 4 else state[1] + (m - 3) * 2
+    state[1] = 0 if index < 0 else 88 if index > 88 else index
+
+
+def _ima_encode_python(src, n, dst, state):
+    s = memoryview(src)
+    d = memoryview(dst)
+    # 先读出第一对采样, 再写块头, 原地编码时块头会覆盖它们
+    x0 = _sample(s, 0)
+    x1 = _sample(s, 1)
+    predictor = state[0] & 0xffff
+    d[0] = predictor & 0xff
+    d[1] = predictor >> 8
+    d[2] = state[1]
+    d[3] = 0
+    for k in range(n // 2):
+        low = _ima_step(x0, state)
+        high = _ima_step(x1, state)
+        # 写第 k 个字节之前先读下一对, 原地编码时不会被覆盖
+        if 2 * k + 3 < n:
+            x0 = _sample(s, 2 * k + 2)
+            x1 = _sample(s, 2 * k + 3)
+        d[ADPCM_HEADER + k] = low | (high << 4)
+
+
+def _ima_load_header(src, state):
+    """从 4 字节块头取出解码的初始状态"""
+    predictor = src[0] | (src[1] << 8)
+    state[0] = predictor - 0x10000 if predictor & 0x8000 else predictor
+    state[1] = src[2] if src[2] <= 88 else 88
+
+
+def _ima_decode_python(src, nbytes, dst, state):
+    # 解码 nbytes 字节的数据(不含块头), 从 state 开始并更新它
+    s = memoryview(src)
+    d = memoryview(dst)
+    j = 0
+    for k in range(nbytes):
+        byte = s[k]
+        for nibble in (byte & 0x0f, byte >> 4):
+            step = _STEPS[state[1]]
+            vpdiff = step >> 3
+            if nibble & 4:
+                vpdiff += step
+            if nibble & 2:
+                vpdiff += step >> 1
+            if nibble & 1:
+                vpdiff += step >> 2
+            _ima_update(state, nibble, vpdiff)
+            x = state[0] & 0xffff
+            d[j] = x & 0xff
+            d[j + 1] = x >> 8
+            j += 2
+
+
+_ulaw_encode = _ulaw_encode_python
+_ulaw_decode = _ulaw_decode_python
+_ima_encode = _ima_encode_python
+_ima_decode = _ima_decode_python
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _ulaw_encode_native(src, n: int, dst):
+        s = ptr16(src)
+        d = ptr8(dst)
+        i = 0
+        while i < n:
+            x = int(s[i])
+            if x & 0x8000:
+                x -= 0x10000
+            sign = 0
+            if x < 0:
+                sign = 0x80
+                x = 0 - x
+            if x > 32635:
+                x = 32635
+            x += 0x84
+            exponent = 7
+            mask = 0x4000
+            while exponent > 0 and (x & mask) == 0:
+                exponent -= 1
+                mask >>= 1
+            d[i] = (sign | (exponent << 4) | ((x >> (exponent + 3)) & 0x0f)) ^ 0xff
+            i += 1
+
+    @micropython.viper
+    def _ulaw_decode_native(src, n: int, dst):
+        s = ptr8(src)
+        d = ptr16(dst)
+        table = ptr16(_ULAW_TABLE)
+        i = n - 1
+        while i >= 0:
+            d[i] = table[s[i]]
+            i -= 1
+
+    @micropython.viper
+    def _ima_encode_native(src, n: int, dst, state):
+        s = ptr16(src)
+        d = ptr8(dst)
+        st = ptr32(state)
+        steps = ptr16(_STEPS)
+        predictor = int(st[0])
+        index = int(st[1])
+        x0 = int(s[0])
+        x1 = int(s[1])
+        d[0] = predictor & 0xff
+        d[1] = (predictor >> 8) & 0xff
+        d[2] = index
+        d[3] = 0
+        k = 0
+        while k < (n >> 1):
+            out = 0
+            j = 0
+            while j < 2:
+                x = x0 if j == 0 else x1
+                if x & 0x8000:
+                    x -= 0x10000
+                step = int(steps[index])
+                diff = x - predictor
+                nibble = 0
+                if diff < 0:
+                    nibble = 8
+                    diff = 0 - diff
+                vpdiff = step >> 3
+                if diff >= step:
+                    nibble |= 4
+                    diff -= step
+                    vpdiff += step
+                step >>= 1
+                if diff >= step:
+                    nibble |= 2
+                    diff -= step
+                    vpdiff += step
+                step >>= 1
+                if diff >= step:
+                    nibble |= 1
+                    vpdiff += step
+                if nibble & 8:
+                    predictor -= vpdiff
+                else:
+                    predictor += vpdiff
+                if predictor > 32767:
+                    predictor = 32767
+                elif predictor < -32768:
+                    predictor = -32768
+                m = nibble & 7
+                if m < 4:
+                    index -= 1
+                else:
+                    index += (m - 3) * 2
+                if index < 0:
+                    index = 0
+                elif index > 88:
+                    index = 88
+                out |= nibble << (j * 4)
+                j += 1
+            if 2 * k + 3 < n:
+                x0 = int(s[2 * k + 2])
+                x1 = int(s[2 * k + 3])
+            d[4 + k] = out
+            k += 1
+        st[0] = predictor
+        st[1] = index
+
+    @micropython.viper
+    def _ima_decode_native(src, nbytes: int, dst, state):
+        s = ptr8(src)
+        d = ptr16(dst)
+        st = ptr32(state)
+        steps = ptr16(_STEPS)
+        predictor = int(st[0])
+        index = int(st[1])
+        j = 0
+        k = 0
+        while k < nbytes:
+            byte = int(s[k])
+            h = 0
+            while h < 2:
+                nibble = (byte >> (h * 4)) & 0x0f
+                step = int(steps[index])
+                vpdiff = step >> 3
+                if nibble & 4:
+                    vpdiff += step
+                if nibble & 2:
+                    vpdiff += step >> 1
+                if nibble & 1:
+                    vpdiff += step >> 2
+                if nibble & 8:
+                    predictor -= vpdiff
+                else:
+                    predictor += vpdiff
+                if predictor > 32767:
+                    predictor = 32767
+                elif predictor < -32768:
+                    predictor = -32768
+                m = nibble & 7
+                if m < 4:
+                    index -= 1
+                else:
+                    index += (m - 3) * 2
+                if index < 0:
+                    index = 0
+                elif index > 88:
+                    index = 88
+                d[j] = predictor & 0xffff
+                j += 1
+                h += 1
+            k += 1
+        st[0] = predictor
+        st[1] = index
+
+    _ulaw_encode = _ulaw_encode_native
+    _ulaw_decode = _ulaw_decode_native
+    _ima_encode = _ima_encode_native
+    _ima_decode = _ima_decode_native
+except (ImportError, AttributeError):
+    pass
+
+
+class Pcm16:
+    """原样传输"""
+    codec = CODEC_PCM16
+
+    def encoded_size(self, nbytes):
+        return nbytes
+
+    def decoded_size(self, nbytes):
+        return nbytes
+
+    def encode(self, src, nbytes, dst):
+        if dst is not src:
+            memoryview(dst)[:nbytes] = memoryview(src)[:nbytes]
+        return nbytes
+
+    decode = encode
+
+    def reset(self):
+        pass
+
+    def start_stream(self):
+        """开始接收一条新的音频消息"""
+        pass
+
+    def stream_size(self, nbytes):
+        """decode_stream() 一段 nbytes 字节最多输出的字节数"""
+        return self.decoded_size(nbytes)
+
+    def decode_stream(self, src, nbytes, dst):
+        """解码消息里的一段(可能是开头、中间或结尾), 返回输出的字节数"""
+        return self.decode(src, nbytes, dst)
+
+
+class Ulaw(Pcm16):
+    """G.711 μ-law, 每个采样 1 字节"""
+    codec = CODEC_ULAW
+
+    def encoded_size(self, nbytes):
+        return nbytes >> 1
+
+    def decoded_size(self, nbytes):
+        return nbytes * 2
+
+    def encode(self, src, nbytes, dst):
+        n = nbytes >> 1
+        _ulaw_encode(src, n, dst)
+        return n
+
+    def decode(self, src, nbytes, dst):
+        _ulaw_decode(src, nbytes, dst)
+        return nbytes * 2
+
+
+class ImaAdpcm(Pcm16):
+    """IMA-ADPCM, 每个采样 4 位, 编码状态在帧之间延续"""
+    codec = CODEC_IMA_ADPCM
+
+    def __init__(self):
+        self._state = array('i', [0, 0])  # 预测值, 步长下标
+        self._block = array('i', [0, 0])  # decode() 用的解码状态
+        self._stream = array('i', [0, 0])  # decode_stream() 在段之间延续的解码状态
+        self._header = bytearray(ADPCM_HEADER)  # 被拆开的块头
+        self._header_len = ADPCM_HEADER
+
+    def reset(self):
+        self._state[0] = self._state[1] = 0
+
+    def encoded_size(self, nbytes):
+        return ADPCM_HEADER + (nbytes >> 2)
+
+    def decoded_size(self, nbytes):
+        return (nbytes - ADPCM_HEADER) * 4 if nbytes > ADPCM_HEADER else 0
+
+    def encode(self, src, nbytes, dst):
+        n = (nbytes >> 1) & ~1
+        if not n:
+            return 0
+        _ima_encode(src, n, dst, self._state)
+        return ADPCM_HEADER + (n >> 1)
+
+    def decode(self, src, nbytes, dst):
+        if nbytes <= ADPCM_HEADER:
+            return 0
+        mv = memoryview(src)
+        _ima_load_header(mv, self._block)
+        _ima_decode(mv[ADPCM_HEADER:], nbytes - ADPCM_HEADER, dst, self._block)
+        return (nbytes - ADPCM_HEADER) * 4
+
+    def start_stream(self):
+        self._header_len = 0
+
+    def stream_size(self, nbytes):
+        return nbytes * 4
+
+    def decode_stream(self, src, nbytes, dst):
+        mv = memoryview(src)
+        start = 0
+        have = self._header_len
+        if have < ADPCM_HEADER:
+            # 块头还没收全, 先攒起来
+            start = min(ADPCM_HEADER - have, nbytes)
+            self._header[have:have + start] = mv[:start]
+            self._header_len = have + start
+            if self._header_len < ADPCM_HEADER:
+                return 0
+            _ima_load_header(self._header, self._stream)
+        if nbytes <= start:
+            return 0
+        _ima_decode(mv[start:] if start else src, nbytes - start, dst, self._stream)
+        return (nbytes - start) * 4
+
+
+_CODECS = {
+    CODEC_PCM16: Pcm16,
+    CODEC_ULAW: Ulaw,
+    CODEC_IMA_ADPCM: ImaAdpcm,
+}
+
+
+def get(codec):
+    """编码格式对应的编解码器(每个音频流一个实例, ADPCM 编码有状态)"""
+    try:
+        return _CODECS[codec]()
+    except KeyError:
+        raise ValueError('unsupported codec: %s' % audio_proto.CODEC_NAMES.get(codec, codec))
@@ -0,0 +1,590 @@
+"""
+音频流水线: 数据源 -> 若干处理环节 -> 输出
+
+麦克风采集、VAD、编解码、重采样、网络发送、播放都写成环节(Stage),
+不同的部署(本地回环、WebSocket 对话、UDP 广播)只是不同的组合。
+
+帧(Frame)来自预分配的帧池(FramePool), 在环节之间传递引用, 不拷贝:
+  - 数据源把采样读进帧里, 打上序号和采集时间(ticks_us)
+  - 环节 process(frame) 返回要交给下一环节的帧; 返回 None 表示到此
+    为止; 返回另一帧(例如解码后变长)时原来的帧自动归还; 返回帧的
+    元组时后面的环节对每一帧依次处理(例如预录缓冲在开始说话时补发)
+  - 需要把帧留到以后(队列、预录缓冲)的环节调用 frame.retain(),
+    用完后 pool.release(frame)
+  - 帧的 headroom 留给协议头, 传输环节可以原地写头, 整包一次发出
+每个环节的调用次数、平均/最大耗时(微秒)都有统计, 见 stats()。
+
+调度: run() 在当前线程循环, start_thread() 开一个线程运行,
+run_async() 是协程, 每处理一帧让出一次事件循环。
+帧池只在流水线所在的线程/任务里使用, 不加锁。
+在 CPython 上也能运行(配合 tools/fake_i2s.py 的 I2S 替身)。
+"""
+from array import array
+
+from myutil import ticks_us, ticks_diff, Signal
+
+try:
+    from time import sleep_ms
+except ImportError:  # CPython
+    from time import sleep as _sleep
+
+    def sleep_ms(ms):
+        _sleep(ms / 1000)
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    import asyncio
+
+
+async def _async_sleep_ms(ms):
+    if hasattr(asyncio, 'sleep_ms'):
+        await asyncio.sleep_ms(ms)
+    else:
+        await asyncio.sleep(ms / 1000)
+
+
+class Frame:
+    """池里的一帧: data 是 headroom 之后的音频区, n 是有效字节数"""
+
+    def __init__(self, pool, size, headroom):
+        self.pool = pool
+        self.buf = bytearray(headroom + size)
+        self.headroom = headroom
+        self.data = memoryview(self.buf)[headroom:]
+        self.size = size
+        self.refs = 0
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.seq = 0
+        self.t_us = 0       # 采集时间 ticks_us
+        self.rate = 0       # 采样率, 0 表示未知
+        self.codec = 0      # audio_proto 的编码格式
+        self.voice = False  # VAD 判决
+
+    def retain(self):
+        self.refs += 1
+        return self
+
+    def copy_meta(self, other):
+        """从另一帧复制序号、时间等信息(转换成新帧时用)"""
+        self.seq = other.seq
+        self.t_us = other.t_us
+        self.rate = other.rate
+        self.codec = other.codec
+        self.voice = other.voice
+
+
+class FramePool:
+    """count 个 size 字节的帧, 用数组做空闲栈, 取还都不分配内存"""
+
+    def __init__(self, count, size, headroom=0):
+        self.frames = [Frame(self, size, headroom) for _ in range(count)]
+        self._free = list(self.frames)
+        self._top = count
+        self.frame_bytes = size
+        self.exhausted = 0  # 没有空闲帧的次数
+
+    @property
+    def free(self):
+        return self._top
+
+    def get(self):
+        """取一帧(引用计数 1), 没有空闲帧时返回 None"""
+        if not self._top:
+            self.exhausted += 1
+            return None
+        self._top -= 1
+        frame = self._free[self._top]
+        frame.reset()
+        frame.refs = 1
+        return frame
+
+    def release(self, frame):
+        frame.refs -= 1
+        if frame.refs == 0:
+            self._free[self._top] = frame
+            self._top += 1
+
+
+class Stage:
+    """环节基类; pool 在加入流水线时设置"""
+    name = 'stage'
+    pool = None
+
+    def process(self, frame):
+        return frame
+
+    def flush(self):
+        """流水线停止时调用, 归还留着的帧"""
+
+
+class Source(Stage):
+    """
+    数据源: read(frame) 把数据读进 frame.data, 返回字节数, 暂时没有数据返回 0。
+    stamps 为 False 时由流水线填序号和读完的时间, 自己记录采集时间的数据源设为 True。
+    自己管理帧的数据源(例如中断里填好的帧)改写 take()
+    """
+    name = 'source'
+    stamps = False
+
+    def read(self, frame):
+        return 0
+
+    def take(self):
+        """取一帧填好的数据(设置好 n), 没有数据或没有空闲帧时返回 None"""
+        frame = self.pool.get()
+        if frame is None:
+            return None
+        n = self.read(frame)
+        if not n:
+            self.pool.release(frame)
+            return None
+        frame.n = n
+        return frame
+
+
+class Pipeline:
+    """source -> stages; 帧池默认按 frames x frame_bytes 预分配"""
+
+    def __init__(self, source, stages, pool=None, frames=4, frame_bytes=1024,
+                 headroom=0, name='pipeline'):
+        self.name = name
+        self.pool = pool or FramePool(frames, frame_bytes, headroom)
+        self.source = source
+        self.stages = list(stages)
+        for stage in [source] + self.stages:
+            stage.pool = self.pool
+        count = len(self.stages) + 1  # 下标 0 是数据源
+        self._calls = array('i', [0] * count)
+        self._total_us = array('i', [0] * count)
+        self._max_us = array('i', [0] * count)
+        self._seq = 0
+        self.running = False
+
+    def step(self):
+        """读一帧并走完所有环节, 没有数据(或没有空闲帧)时返回 False"""
+        t0 = ticks_us()
+        frame = self.source.take()
+        if frame is None:
+            return False
+        if not self.source.stamps:
+            frame.t_us = ticks_us()  # 读完的时刻, 即这一帧最后一个采样的采集时间
+            frame.seq = self._seq
+            self._seq = (self._seq + 1) & 0xffff
+        self._account(0, t0)
+        self._run_from(0, frame)
+        return True
+
+    def _run_from(self, index, frame):
+        stages = self.stages
+        while index < len(stages):
+            t0 = ticks_us()
+            out = stages[index].process(frame)
+            self._account(index + 1, t0)
+            index += 1
+            if out is not frame:
+                self.pool.release(frame)
+                if out is None:
+                    return
+                if isinstance(out, tuple):
+                    for item in out:
+                        self._run_from(index, item)
+                    return
+                frame = out
+        self.pool.release(frame)
+
+    def _account(self, i, t0):
+        dt = ticks_diff(ticks_us(), t0)
+        self._calls[i] += 1
+        self._total_us[i] += dt
+        if dt > self._max_us[i]:
+            self._max_us[i] = dt
+
+    def stats(self):
+        """[(环节名, 调用次数, 平均微秒, 最大微秒)], 第一项是数据源"""
+        result = []
+        for i, stage in enumerate([self.source] + self.stages):
+            calls = self._calls[i]
+            result.append((stage.name, calls, self._total_us[i] // calls if calls else 0,
+                           self._max_us[i]))
+        return result
+
+    def reset_stats(self):
+        for i in range(len(self._calls)):
+            self._calls[i] = self._total_us[i] = self._max_us[i] = 0
+
+    def stop(self):
+        self.running = False
+
+    def _finish(self):
+        for stage in [self.source] + self.stages:
+            stage.flush()
+
+    def run(self, idle_ms=2):
+        """在当前线程循环运行, 直到 stop()"""
+        self.running = True
+        try:
+            while self.running:
+                if not self.step():
+                    sleep_ms(idle_ms)
+        finally:
+            self._finish()
+
+    def start_thread(self, idle_ms=2):
+        """在新线程里运行"""
+        import _thread
+        self.running = True
+        _thread.start_new_thread(self.run, (idle_ms,))
+
+    async def run_async(self, idle_ms=2):
+        """协程版本: 每处理一帧让出一次事件循环, 没有数据时等待 idle_ms"""
+        self.running = True
+        try:
+            while self.running:
+                if self.step():
+                    await _async_sleep_ms(0)
+                else:
+                    await _async_sleep_ms(idle_ms)
+        finally:
+            self._finish()
+
+
+# 常用环节
+
+class I2SSource(Source):
+    """I2S 麦克风, 阻塞读满一帧"""
+    name = 'i2s_in'
+
+    def __init__(self, i2s, rate):
+        self.i2s = i2s
+        self.rate = rate
+
+    def read(self, frame):
+        n = self.i2s.readinto(frame.data)
+        frame.rate = self.rate
+        return n
+
+
+class _FrameQueue:
+    """定长的单生产者/单消费者帧队列, 下标规则同 myutil.RingBuffer"""
+
+    def __init__(self, n):
+        self._items = [None] * n
+        self._n = n
+        self._head = 0  # 只由生产者修改
+        self._tail = 0  # 只由消费者修改
+
+    def __len__(self):
+        return (self._head - self._tail) % (2 * self._n)
+
+    def put(self, item):
+        if len(self) == self._n:
+            return False
+        self._items[self._head % self._n] = item
+        self._head = (self._head + 1) % (2 * self._n)
+        return True
+
+    def get(self):
+        if self._head == self._tail:
+            return None
+        i = self._tail % self._n
+        item = self._items[i]
+        self._items[i] = None
+        self._tail = (self._tail + 1) % (2 * self._n)
+        return item
+
+
+class IrqI2SSource(Source):
+    """
+    非阻塞 I2S 麦克风(I2S.irq): readinto() 立即返回, 读满一帧后回调
+
+    回调里给帧打上采集时间(ticks_us, 这一帧最后一个采样)和序号, 放进完成
+    队列, 马上把下一个空帧交给 I2S, 采集不停顿; take() 从完成队列取帧,
+    同时从帧池补充 depth 个空帧。没有空帧时读进丢弃缓冲区, 计入 dropped,
+    序号照样递增, 下游从序号的间隔能看出丢了几帧。
+    回调和 take() 只通过单生产者/单消费者的帧队列交接, 不碰帧池; 完成队列
+    放不下的帧(也算丢弃)经退还队列由 take() 还给帧池。
+    谁启动下一次读只在一处决定: I2S 空闲时 _arm_token 里有一个令牌, 回调
+    停下时放回令牌, start() 和回调都要先取到令牌(list.pop() 是原子的)才能
+    启动读, 不会两边都不启动, 也不会重复启动。
+    在线程里可以 ready.wait() 等下一帧, 事件循环里没有帧就让出。
+    帧池要给采集留 depth + 1 帧。不在流水线里用时传入 pool。
+    """
+    name = 'i2s_irq'
+    stamps = True
+
+    def __init__(self, i2s, rate, depth=2, pool=None):
+        self.i2s = i2s
+        self.rate = rate
+        self.depth = depth
+        if pool is not None:
+            self.pool = pool
+        self._empty = _FrameQueue(depth)      # take() 放, 回调取
+        self._full = _FrameQueue(depth + 1)   # 回调放, take() 取
+        self._back = _FrameQueue(depth + 1)   # 回调放, take() 还给帧池
+        self._reading = None  # 正在读的帧, None 表示读进丢弃缓冲区
+        self._scratch = None
+        self._seq = 0
+        self._arm_token = [True]  # I2S 空闲时有一个令牌, 取到的一方启动读
+        self.running = False
+        self.ready = Signal()  # 每读满一帧 set() 一次
+        self.frames = 0       # 读满的帧数(含丢弃的)
+        self.dropped = 0      # 没有空帧、或完成队列满而丢弃的帧数
+        i2s.irq(self._on_read)
+
+    def start(self):
+        """开始采集, 丢掉上次停止前留下的帧"""
+        if self._scratch is None:
+            self._scratch = bytearray(self.pool.frame_bytes)
+        if not self.running:
+            frame = self._full.get()
+            while frame is not None:
+                self.pool.release(frame)
+                frame = self._full.get()
+        self.running = True
+        self._refill()
+        self._arm()
+
+    def stop(self):
+        """停止采集(正在读的这一帧读完为止)"""
+        self.running = False
+
+    @property
+    def queued(self):
+        """已经读满、还没被 take() 取走的帧数"""
+        return len(self._full)
+
+    def take(self):
+        if not self.running:
+            self.start()
+        self._refill()
+        return self._full.get()
+
+    def _refill(self):
+        pool = self.pool
+        frame = self._back.get()
+        while frame is not None:
+            pool.release(frame)
+            frame = self._back.get()
+        while len(self._empty) < self.depth:
+            frame = pool.get()
+            if frame is None:
+                return
+            self._empty.put(frame)
+
+    def _arm(self):
+        """I2S 空闲时启动下一次读, 已经在读(令牌被取走)时什么都不做"""
+        try:
+            self._arm_token.pop()
+        except IndexError:
+            return
+        self._read_next()
+
+    def _read_next(self):
+        frame = self._empty.get()
+        self._reading = frame
+        if frame is None:
+            self.i2s.readinto(self._scratch)
+        else:
+            # 非阻塞时返回要读的字节数, 回调时读满的就是这么多
+            frame.n = self.i2s.readinto(frame.data) or 0
+
+    def _on_read(self, i2s):
+        now = ticks_us()
+        frame = self._reading
+        seq = self._seq
+        self._seq = (seq + 1) & 0xffff
+        self.frames += 1
+        if frame is None:
+            self.dropped += 1
+        else:
+            frame.t_us = now
+            frame.seq = seq
+            frame.rate = self.rate
+            if self._full.put(frame):
+                self.ready.set()
+            else:
+                self.dropped += 1
+                self._back.put(frame)
+        if self.running:
+            self._read_next()
+            return
+        self._reading = None
+        self._arm_token.append(True)
+        # stop() 之后 start() 可能在上面检查 running 之后才运行, 没取到令牌
+        if self.running:
+            self._arm()
+
+    def flush(self):
+        self.running = False
+        pool = self.pool
+        for queue in (self._full, self._empty, self._back):
+            frame = queue.get()
+            while frame is not None:
+                pool.release(frame)
+                frame = queue.get()
+
+
+class I2SSink(Stage):
+    """I2S 扬声器, 阻塞写完整帧"""
+    name = 'i2s_out'
+
+    def __init__(self, i2s):
+        self.i2s = i2s
+
+    def process(self, frame):
+        data = frame.data
+        n = frame.n
+        written = 0
+        while written < n:
+            written += self.i2s.write(data[written:n])
+        return None
+
+
+class VadStage(Stage):
+    """VAD 判决写进 frame.voice; gate=True 时丢掉非说话帧"""
+    name = 'vad'
+
+    def __init__(self, vad, gate=False):
+        self.vad = vad
+        self.gate = gate
+
+    def process(self, frame):
+        frame.voice = self.vad.process(frame.data, frame.n)
+        if self.gate and not frame.voice:
+            return None
+        return frame
+
+
+class PreRollStage(Stage):
+    """
+    预录缓冲: 不在说话时留住最近 blocks 帧不往下传, 开始说话时把它们和
+    当前帧一起交给后面的环节。帧池要比 blocks 多留几帧给其他环节。
+    """
+    name = 'preroll'
+
+    def __init__(self, blocks):
+        self.blocks = blocks
+        self._held = [None] * blocks
+        self._next = 0
+        self.count = 0
+        self.speaking = False
+
+    def process(self, frame):
+        if frame.voice:
+            if self.speaking:
+                return frame
+            self.speaking = True
+            # 开始说话: 补发预录的帧(从旧到新), 引用交给流水线
+            frames = []
+            for i in range(self.count):
+                k = (self._next - self.count + i) % self.blocks
+                frames.append(self._held[k])
+                self._held[k] = None
+            self.count = 0
+            frames.append(frame.retain())
+            return tuple(frames)
+        self.speaking = False
+        old = self._held[self._next]
+        if old is not None:
+            self.pool.release(old)
+        self._held[self._next] = frame.retain()
+        self._next = (self._next + 1) % self.blocks
+        if self.count < self.blocks:
+            self.count += 1
+        return None
+
+    def flush(self):
+        for i in range(self.blocks):
+            if self._held[i] is not None:
+                self.pool.release(self._held[i])
+                self._held[i] = None
+        self.count = 0
+
+
+class EncodeStage(Stage):
+    """原地编码(audio_codec), 编码状态在帧之间延续"""
+    name = 'encode'
+
+    def __init__(self, codec):
+        self.codec = codec
+
+    def process(self, frame):
+        frame.n = self.codec.encode(frame.data, frame.n, frame.data)
+        frame.codec = self.codec.codec
+        return frame
+
+
+class DecodeStage(Stage):
+    """解码到池里的新帧(解码后变长); 帧池的帧要放得下解码结果"""
+    name = 'decode'
+
+    def __init__(self, codecs):
+        self.codecs = codecs  # {编码格式: 解码器}
+        self.dropped = 0
+
+    def process(self, frame):
+        decoder = self.codecs.get(frame.codec)
+        out = self.pool.get()
+        if (decoder is None or out is None
+                or decoder.decoded_size(frame.n) > out.size):
+            self.dropped += 1
+            if out is not None:
+                self.pool.release(out)
+            return None
+        out.copy_meta(frame)
+        out.n = decoder.decode(frame.data, frame.n, out.data)
+        out.codec = 0
+        return out
+
+
+class ResampleStage(Stage):
+    """重采样到池里的新帧; 帧池的帧要放得下 output_size(最大输入)"""
+    name = 'resample'
+
+    def __init__(self, resampler):
+        self.resampler = resampler
+        self.dropped = 0
+
+    def process(self, frame):
+        resampler = self.resampler
+        if resampler.passthrough:
+            return frame
+        out = self.pool.get()
+        if out is None or resampler.output_size(frame.n) > out.size:
+            self.dropped += 1
+            if out is not None:
+                self.pool.release(out)
+            return None
+        out.copy_meta(frame)
+        out.n = resampler.process(frame.data, frame.n, out.data)
+        out.rate = resampler.out_rate
+        return out
+
+
+class RingSink(Stage):
+    """写进 myutil.RingBuffer, 交给另一个线程播放; 空间不够时丢掉放不下的部分"""
+    name = 'ring'
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.overflow = 0  # 丢掉的字节数
+
+    def process(self, frame):
+        written = self.ring.write_from(frame.data, frame.n)
+        self.overflow += frame.n - written
+        return None
+
+
+class FuncStage(Stage):
+    """用函数做环节, 例如网络发送: fn(frame) 返回 frame/None/帧元组"""
+
+    def __init__(self, fn, name='func'):
+        self.fn = fn
+        self.name = name
+
+    def process(self, frame):
+        return self.fn(frame)
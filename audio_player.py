@@ -0,0 +1,318 @@
+"""
+环形缓冲区 -> I2S 的播放线程, 由事件驱动, 不轮询
+
+接收线程(生产者)把下行音频写进 myutil.WatermarkRing, 播放线程(消费者)
+写给 I2S。两边都只在需要时被唤醒:
+  - 攒数据: 可读数据越过高水位时环形缓冲区唤醒播放线程; 回复的结尾
+    不够高水位时, 最后一次写入 flush_ms 之后由一次性定时器唤醒
+  - 播放中播空(欠载): 把高水位临时降到 1 字节, 来了数据就接着播;
+    idle_reset_ms 内都没有新数据则回到攒数据状态
+  - 缓冲区满: 生产者等待, 播放线程每播完一块就看一次, 腾出生产者要的
+    空间就唤醒它; 接收线程最多停一块音频的时间, 后面的心跳 pong 不会积压
+  - use_irq=True 时 I2S 用非阻塞写(I2S.irq), 直接把环形缓冲区里的
+    数据交给 I2S, 写完的回调里唤醒播放线程再释放这段空间
+wakeups/underruns 等计数用来观察唤醒次数和欠载情况。
+全双工时 echo_ref(vad.EchoGate)记下每块播放数据的电平作为回声参考,
+on_start 在每次开始播放、以及中途播空后接着播时调用(例如唤醒麦克风
+线程监听打断), 和 playing 由 False 变 True 的时机一致。
+trace(latency_trace.Tracer)不为 None 时记下开始播放和播完的时间。
+
+PingPongI2S 是给事件循环/接收线程直接写 I2S 用的非阻塞输出(双缓冲)。
+"""
+from latency_trace import PLAY_FIRST, PLAY_LAST
+from myutil import ticks_ms, ticks_us, ticks_diff, ticks_add, Signal
+
+
+class RingPlayer:
+    """
+    ring: myutil.WatermarkRing, high/low 为攒数据和唤醒生产者的水位
+    timer: machine.Timer 或兼容对象(tools/fake_i2s.py 的 FakeTimer), 默认 Timer(0)
+    """
+
+    def __init__(self, ring, audio_out, chunk=1024, timer=None, flush_ms=200,
+                 idle_reset_ms=5000, use_irq=False):
+        if timer is None:
+            from machine import Timer
+            timer = Timer(0)
+        self.ring = ring
+        self.audio_out = audio_out
+        self.chunk = chunk
+        self.timer = timer
+        self.flush_ms = flush_ms
+        self.idle_reset_ms = idle_reset_ms
+        self.high = ring.high  # 攒数据的门限, 播放中 ring.high 会临时改成 1
+        self.use_irq = use_irq
+        self.running = False
+        self.buffering = True     # 正在攒数据, 还没开始播放
+        self.empty = False        # 播放中播空, 等下一段数据
+        self.echo_ref = None      # vad.EchoGate, 全双工时记录回声参考
+        self.on_start = None      # 开始播放/播空后接着播时调用(在播放线程里)
+        self.trace = None         # latency_trace.Tracer, 记录开始播放/播完
+        self._flush_due = False   # 定时器置位: flush_ms 内没有新数据
+        self._discard = False     # discard() 请求丢掉缓冲区里的数据
+        self._discards = 0        # discard() 的次数, write() 用来发现等待期间被丢弃
+        self._want = 0            # 生产者在等的空间(字节), 0 表示没有在等
+        self._written = Signal()  # 非阻塞 I2S 写完
+        self.wakeups = 0          # 播放线程等数据被唤醒的次数
+        self.underruns = 0        # 回复中途播空又接着播的次数
+        if use_irq:
+            audio_out.irq(self._on_written)
+
+    # 生产者(接收线程)
+
+    def received(self):
+        """每写进一段音频后调用: 记下时间, 重新开始计 flush_ms"""
+        self._flush_due = False
+        self.timer.init(mode=self.timer.ONE_SHOT, period=self.flush_ms, callback=self._on_flush)
+
+    def wait_space(self, size):
+        """等环形缓冲区腾出 size 字节, 播放线程播完一块就可能唤醒; 播放线程没在运行时返回 False"""
+        ring = self.ring
+        # 先登记再检查, 播放线程在这之间腾出的空间不会错过
+        self._want = size
+        while ring.free < size:
+            if not self.running:
+                self._want = 0
+                return False
+            ring.space_ready.wait()
+        self._want = 0
+        return True
+
+    def write(self, buf, n=None):
+        """把 buf 的前 n 字节(默认全部)写进环形缓冲区, 空间不够时等播放线程腾出;
+        播放线程没在运行, 或等待期间 discard() 了, 丢掉写不下的部分, 返回写入的字节数"""
+        if n is None:
+            n = len(buf)
+        src = memoryview(buf)
+        ring = self.ring
+        discards = self._discards
+        done = ring.write_from(src, n)
+        while (done < n and self.wait_space(min(n - done, self.chunk))
+               and self._discards == discards):
+            done += ring.write_from(src[done:n])
+        self.received()
+        return done
+
+    @property
+    def playing(self):
+        """正在播放(已经开始且还有数据)"""
+        return not self.buffering and not self.empty
+
+    def discard(self):
+        """丢掉还没播放的数据(在播放线程里执行), 下一段音频重新攒数据"""
+        self._discards += 1
+        self._discard = True
+        self.ring.data_ready.set()
+
+    # 回调
+
+    def _on_flush(self, timer):
+        self._flush_due = True
+        self.ring.data_ready.set()
+
+    def _on_written(self, i2s):
+        self._written.set()
+
+    # 消费者(播放线程)
+
+    def _wait_data(self, mark):
+        """等可读数据达到 mark 字节; 先改水位再检查, 不会错过刚写入的数据"""
+        ring = self.ring
+        ring.high = mark
+        if ring.available < mark and not self._discard:
+            ring.data_ready.wait()
+            self.wakeups += 1
+
+    def _play(self, view):
+        n = len(view)
+        if self.echo_ref is not None:
+            self.echo_ref.reference(view, n)
+        if self.use_irq:
+            # 非阻塞写: I2S 从环形缓冲区里取数据, 写完的回调之后才释放这段空间
+            self.audio_out.write(view)
+            self._written.wait()
+        else:
+            written = 0
+            while written < n:
+                written += self.audio_out.write(view[written:])
+        ring = self.ring
+        ring.consume(n)
+        want = self._want
+        if want and ring.free >= want:
+            ring.space_ready.set()
+
+    def run(self):
+        """播放循环, 直到 stop()"""
+        ring = self.ring
+        self.running = True
+        empty_ms = 0
+        while self.running:
+            if self._discard:
+                self._discard = False
+                ring.clear()
+                self.buffering = True
+            available = ring.available
+            if self.buffering:
+                # 够高水位, 或者回复的结尾(flush_ms 内没有新数据)就开始播放
+                if available >= self.high or (available and self._flush_due):
+                    self.buffering = False
+                    self.empty = False
+                    if self.on_start is not None:
+                        self.on_start()
+                    if self.trace is not None:
+                        self.trace.once(PLAY_FIRST, available)
+                else:
+                    self._wait_data(self.high)
+                    continue
+            elif not available:
+                if not self.empty:
+                    self.empty = True
+                    empty_ms = ticks_ms()
+                    if self.trace is not None:
+                        self.trace.mark(PLAY_LAST)  # 刚写完最后一块
+                self._wait_data(1)
+                if ticks_diff(ticks_ms(), empty_ms) > self.idle_reset_ms:
+                    # 很久以后才来的数据是新的回复, 先攒够再播
+                    self.buffering = True
+                elif ring.available:
+                    self.underruns += 1  # 同一段回复中途播空了
+                continue
+            if self.empty:
+                # 播空后接着播: 和开始播放一样通知(麦克风线程在播空时停下了)
+                self.empty = False
+                if self.on_start is not None:
+                    self.on_start()
+            self._play(ring.peek_views(self.chunk)[0])
+
+    def stop(self):
+        self.running = False
+        self.ring.data_ready.set()
+        self.ring.space_ready.set()  # 唤醒等空间的生产者
+        self.timer.deinit()
+
+
+class PingPongI2S:
+    """
+    非阻塞 I2S 输出: 两块预分配的缓冲区轮流交给 I2S(I2S.irq 非阻塞模式)
+
+    write() 只拷贝不等待, 网络接收/事件循环永远不会卡在 I2S 上:
+      - 拷进空闲的那一块; I2S 空闲时立即提交, 否则排在正在播放的那块之后,
+        由写完的回调接着提交
+      - 两块都在用时丢掉这次的数据, 返回 0, 计一次 overrun
+      - irq 回调只说明数据已拷进 I2S 的内部缓冲区(ibuf), 不是已经播完, 所以
+        按 rate 估算已提交的音频什么时候播完, 提交时已经播完了计一次 underrun;
+        一段音频写完后调用 end(), 下一段开头的间隔不算
+    trace(latency_trace.Tracer)不为 None 时记下一段音频第一次和最后一次提交的时间。
+    也可以用 buffer() 取空闲块直接填(例如重采样输出), 再 submit(n); 没有
+    空闲块而丢掉一帧时调用 overrun() 计数。
+    echo_ref(vad.EchoGate)不为 None 时记下每块提交数据的电平作为回声参考。
+    flush() 丢掉排着还没交给 I2S 的块(打断时), 已经拷进 ibuf 的音频照样播完。
+    回调和 write() 只通过 _queued/_done 两个计数和 _idle 标志交互, 各自只写
+    自己的那个计数; 回调在 write() 之间运行(MicroPython 的 irq 回调是调度执行的)。
+    flush() 也不改 _done, 只记下要跳到的计数, 由下一次回调跳过去。
+    """
+
+    def __init__(self, i2s, rate, size=2048, sample_bytes=2):
+        self.i2s = i2s
+        self.size = size
+        self.rate = rate
+        self._byte_rate = rate * sample_bytes
+        self._bufs = (bytearray(size), bytearray(size))
+        self._views = (memoryview(self._bufs[0]), memoryview(self._bufs[1]))
+        self._lens = [0, 0]
+        self._queued = 0     # 填好的块数(模 4), 只由 write/submit 修改
+        self._done = 0       # I2S 写完的块数(模 4), 只由回调修改
+        self._idle = True    # I2S 没有正在写的块, 回调置 True, submit 置 False
+        self._active = False  # 一段音频播放中, 播空算欠载
+        self._end_us = ticks_us()  # 估算的已提交音频播完的时间
+        self._submit_us = 0  # 最近一次提交的时间
+        self._flush_to = 0   # flush() 时的 _queued, 回调把 _done 跳到这里
+        self._flushes = 0    # flush() 的次数, 只由 flush 修改
+        self._flushed = 0    # 回调已处理的 flush 次数, 只由回调修改
+        self.trace = None
+        self.echo_ref = None
+        self.underruns = 0
+        self.overruns = 0
+        i2s.irq(self._on_done)
+
+    @property
+    def pending(self):
+        """已提交还没写完的块数(0~2)"""
+        return (self._queued - self._done) & 3
+
+    def buffer(self):
+        """空闲块的 memoryview, 两块都在用时返回 None"""
+        if self.pending >= 2:
+            return None
+        return self._views[self._queued & 1]
+
+    def overrun(self):
+        """没有空闲块, 调用方丢掉了一帧"""
+        self.overruns += 1
+
+    def submit(self, n):
+        """提交 buffer() 里填好的前 n 字节"""
+        if not n:
+            return
+        now = ticks_us()
+        start = self._end_us
+        if ticks_diff(now, start) > 0:
+            if self._active:
+                self.underruns += 1
+            start = now
+        if not self._active and self.trace is not None:
+            self.trace.once(PLAY_FIRST, n, now)
+        self._submit_us = now
+        self._end_us = ticks_add(start, n * 1000000 // self._byte_rate)
+        if self.echo_ref is not None:
+            self.echo_ref.reference(self._views[self._queued & 1], n)
+        self._lens[self._queued & 1] = n
+        self._queued = (self._queued + 1) & 3
+        self._active = True
+        if self._idle:
+            self._start(self._done)
+
+    def write(self, buf, n=None):
+        """拷贝 buf 的前 n 字节(默认全部, 不超过 size)并提交, 返回拷贝的字节数, 没有空闲块返回 0"""
+        if n is None:
+            n = len(buf)
+        if n > self.size:
+            n = self.size
+        view = self.buffer()
+        if view is None:
+            self.overrun()
+            return 0
+        view[:n] = memoryview(buf)[:n]
+        self.submit(n)
+        return n
+
+    def end(self):
+        """一段音频写完了, 接下来播空不算欠载"""
+        if self._active and self.trace is not None:
+            self.trace.mark(PLAY_LAST, 0, self._submit_us)
+        self._active = False
+
+    def flush(self):
+        """丢掉已提交还没交给 I2S 的块, 并结束这段音频"""
+        self._flush_to = self._queued
+        self._flushes += 1
+        self._end_us = ticks_us()
+        self.end()
+
+    def _start(self, k):
+        self._idle = False
+        i = k & 1
+        self.i2s.write(self._views[i][:self._lens[i]])
+
+    def _on_done(self, i2s):
+        done = (self._done + 1) & 3
+        if self._flushed != self._flushes:
+            self._flushed = self._flushes
+            # flush 之后 I2S 又空闲过时 _flush_to 已经落在 done 之前, 不用跳
+            if ((self._flush_to - done) & 3) <= ((self._queued - done) & 3):
+                done = self._flush_to
+        self._done = done
+        if (self._queued - done) & 3:
+            self._start(done)
+        else:
+            self._idle = True
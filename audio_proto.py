@@ -0,0 +1,88 @@
+"""
+音频二进制帧协议
+
+音频数据走二进制(OP_BYTES)帧: 6字节定长头 + 音频数据
+    偏移 0  消息类型    1B
+    偏移 1  编码格式    1B
+    偏移 2  序号        2B 大端, 65536 循环
+    偏移 4  采样率      2B 大端, 单位 Hz
+控制消息(end_recording/text/status/error)仍然使用JSON文本帧。
+
+协商: 连接建立后客户端发送 hello_message(), 服务端回复
+{"type": "hello", "audio": "binary"} 才启用二进制模式,
+否则(旧服务端)继续使用 JSON + hex。
+hello 里 codecs 按优先顺序列出客户端能发的上行编码, 服务端在回复的
+codec 里选定一个; 回复里没有 codec 的旧服务端按 pcm16 处理。
+每个音频帧头里也带着编码格式, 接收端按帧解码。
+下行(服务端发给设备的 TTS 音频)同理: hello 里 downlink_codecs 列出设备
+能解码的编码, 服务端从中任选, 不认识这个字段的旧服务端照旧发 pcm16。
+IMA-ADPCM 的一块必须放在同一个音频消息里, 不能跨消息拆分。
+"""
+import json
+import struct
+
+# 消息类型
+MSG_AUDIO = 1       # 音频数据
+
+# 编码格式
+CODEC_PCM16 = 0     # 16位小端 PCM
+CODEC_ULAW = 1      # G.711 μ-law, 2:1
+CODEC_IMA_ADPCM = 2  # IMA-ADPCM, 4:1, 每帧带 4 字节块头
+
+CODEC_NAMES = {
+    CODEC_PCM16: 'pcm16',
+    CODEC_ULAW: 'ulaw',
+    CODEC_IMA_ADPCM: 'ima-adpcm',
+}
+
+HEADER_FORMAT = '!BBHH'
+HEADER_SIZE = 6
+
+
+def pack_header(buf, msg_type, sequence, sample_rate, codec=CODEC_PCM16, offset=0):
+    """把帧头写入 buf[offset:offset + HEADER_SIZE], 不分配新对象"""
+    struct.pack_into(HEADER_FORMAT, buf, offset,
+                     msg_type, codec, sequence & 0xffff, sample_rate)
+
+
+def unpack_header(data):
+    """解析帧头, 返回 (消息类型, 编码格式, 序号, 采样率)"""
+    return struct.unpack_from(HEADER_FORMAT, data, 0)
+
+
+def codec_by_name(name, default=None):
+    for codec, codec_name in CODEC_NAMES.items():
+        if codec_name == name:
+            return codec
+    return default
+
+
+def hello_message(sample_rate, codec=CODEC_PCM16, downlink=(CODEC_PCM16,)):
+    """客户端协商消息, 上行首选 codec, pcm16 总是可以作为退路; downlink 为能解码的下行编码"""
+    offer = [CODEC_NAMES[codec]]
+    if codec != CODEC_PCM16:
+        offer.append(CODEC_NAMES[CODEC_PCM16])
+    return json.dumps({
+        'type': 'hello',
+        'audio': 'binary',
+        'sample_rate': sample_rate,
+        'codec': CODEC_NAMES[codec],
+        'codecs': offer,
+        'downlink_codecs': [CODEC_NAMES[c] for c in downlink],
+    })
+
+
+def accepts_binary(reply):
+    """服务端的协商回复是否同意二进制模式"""
+    if not isinstance(reply, str):
+        return False
+    try:
+        data = json.loads(reply)
+    except ValueError:
+        return False
+    return data.get('type') == 'hello' and data.get('audio') == 'binary'
+
+
+def reply_codec(data):
+    """服务端在协商回复(已解析的 dict)里选定的上行编码, 没有或不认识时为 pcm16"""
+    return codec_by_name(data.get('codec'), CODEC_PCM16)
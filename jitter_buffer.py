@@ -0,0 +1,218 @@
+"""
+自适应抖动缓冲 (UDP 音频下行)
+
+按序号把收到的音频包放进预分配的槽位, 按播放节奏逐帧取出:
+  - 乱序到达的包按序号归位, 重复包和已经错过播放时间的迟到包直接丢弃
+  - 轮到的包丢失时做丢包隐藏: 'repeat' 重复上一帧一次, 之后补静音;
+    'silence' 直接补静音. 后面暂时没有数据时同样补帧等待, 等太久
+    (max_depth 帧)就认为这一段结束, 重新攒数据
+  - 目标深度(开始播放前要攒的帧数)由到达间隔抖动(RFC 3550 的估计方法)
+    自适应调整: 干净的局域网上只缓冲一两帧, 网络繁忙时自动加深,
+    发生欠载时再临时加一帧
+
+序号 2 字节, 65536 循环。所有状态都是整数, put/get_into 不分配内存。
+"""
+from array import array
+
+try:
+    from micropython import const
+except ImportError:  # CPython, 电脑上的测试工具
+    def const(x):
+        return x
+
+from myutil import ticks_ms, ticks_diff
+
+# get_into() 的返回状态
+PLAYED = const(0)     # 正常的一帧
+CONCEALED = const(1)  # 丢包隐藏补出来的一帧
+WAITING = const(2)    # 还在攒数据, 没有输出
+
+_SEQ_MASK = const(0xffff)
+_SEQ_HALF = const(0x8000)
+
+
+class JitterBuffer:
+    """
+    frame_bytes: 每帧最大字节数; frame_ms: 每帧的播放时长;
+    slots: 槽位数(2 的幂), 也是能容纳的最大序号跨度
+    """
+
+    def __init__(self, frame_bytes=1024, frame_ms=20, slots=32,
+                 min_depth=2, max_depth=12, conceal='repeat'):
+        n = 1
+        while n < slots:
+            n <<= 1
+        self.slots = n
+        self._mask = n - 1
+        self.frame_bytes = frame_bytes
+        self.frame_ms = frame_ms
+        self.min_depth = min_depth
+        self.max_depth = min(max_depth, n - 1)
+        self.repeat_last = conceal == 'repeat'
+        self._data = bytearray(n * frame_bytes)
+        self._mv = memoryview(self._data)
+        self._len = array('H', [0] * n)
+        self._seq = array('i', [-1] * n)  # 槽位里的序号, -1 表示空
+        self._silence = bytes(frame_bytes)
+        self._jitter16 = 0     # 到达抖动估计 * 16 (ms)
+        self._boost = 0        # 欠载后额外增加的深度
+        self.target = self.min_depth
+        self.received = self.duplicates = self.late = 0
+        self.concealed = self.underruns = 0
+        self.reset()
+
+    def reset(self):
+        """清空缓冲, 下一个包作为新的开始; 抖动估计和统计保留"""
+        for i in range(self.slots):
+            self._seq[i] = -1
+        self._next = -1        # 下一个要播放的序号, -1 表示还没收到包
+        self._highest = -1     # 收到的最大序号
+        self._started = False  # 是否已经攒够开始播放
+        self._last_slot = -1   # 上一帧播放的槽位, 用于重复隐藏
+        self._concealing = 0   # 连续隐藏的帧数
+        self._stall = 0        # 没有后续数据时已经补了的帧数
+        self._last_arrival = None
+        self._last_arrival_seq = 0
+
+    @property
+    def jitter_ms(self):
+        return self._jitter16 >> 4
+
+    @property
+    def depth(self):
+        """从下一个要播放的帧到收到的最大序号之间的帧数(含空洞)"""
+        if self._next < 0 or self._highest < 0:
+            return 0
+        span = (self._highest - self._next + 1) & _SEQ_MASK
+        return 0 if span >= _SEQ_HALF else span
+
+    def put(self, sequence, payload, now=None):
+        """放入一个包, 返回是否被接收(重复/迟到/过长时返回 False)"""
+        length = len(payload)
+        if length > self.frame_bytes:
+            return False
+        sequence &= _SEQ_MASK
+        if now is None:
+            now = ticks_ms()
+
+        if self._next < 0:
+            self._next = self._highest = sequence
+        diff = (sequence - self._next) & _SEQ_MASK
+        if diff >= _SEQ_HALF:
+            if self._started:
+                # 已经错过播放时间
+                self.late += 1
+                return False
+            if _SEQ_HALF * 2 - diff < self.slots - 1 - self.depth:
+                # 还没开始播放, 乱序先到的包后面的包可以往前补
+                self._next = sequence
+            else:
+                # 发送端重启, 从这个包重新开始
+                self.reset()
+                self._next = self._highest = sequence
+        elif diff >= self.slots - 1:
+            # 序号跳得太远(长时间中断), 从这个包重新开始
+            self.reset()
+            self._next = self._highest = sequence
+
+        slot = sequence & self._mask
+        if self._seq[slot] == sequence:
+            self.duplicates += 1
+            return False
+        start = slot * self.frame_bytes
+        self._mv[start:start + length] = payload
+        self._len[slot] = length
+        self._seq[slot] = sequence
+        self.received += 1
+        if ((sequence - self._highest) & _SEQ_MASK) < _SEQ_HALF:
+            self._highest = sequence
+        self._update_jitter(sequence, now)
+        return True
+
+    def _update_jitter(self, sequence, now):
+        # D = 到达间隔 - 发送间隔(序号差 * 帧时长), J += (|D| - J) / 16
+        if self._last_arrival is not None:
+            gap = (sequence - self._last_arrival_seq) & _SEQ_MASK
+            if gap >= _SEQ_HALF:
+                gap -= _SEQ_HALF * 2
+            d = ticks_diff(now, self._last_arrival) - gap * self.frame_ms
+            if d < 0:
+                d = -d
+            self._jitter16 += d - (self._jitter16 >> 4)
+        self._last_arrival = now
+        self._last_arrival_seq = sequence
+        # 缓冲约 3 倍抖动, 向上取整到整帧
+        depth = 1 + (3 * self._jitter16 + 16 * self.frame_ms - 1) // (16 * self.frame_ms)
+        depth += self._boost
+        self.target = max(self.min_depth, min(self.max_depth, depth))
+
+    def get_into(self, buf):
+        """
+        按播放节奏每帧调用一次, 把下一帧写入 buf,
+        返回 (字节数, PLAYED/CONCEALED/WAITING)
+        """
+        if not self._started:
+            if self.depth < self.target:
+                return 0, WAITING
+            self._started = True
+            self._stall = 0
+
+        if self.depth == 0:
+            # 后面没有任何数据: 先补帧等一等, 等太久就当作这一段说完了
+            self._stall += 1
+            if self._stall > self.max_depth:
+                self._started = False
+                self._concealing = 0
+                # 下一段的第一个包和这一段的间隔不是网络抖动
+                self._last_arrival = None
+                return 0, WAITING
+            return self._conceal(buf)
+        if self._stall:
+            # 停顿后数据又来了, 说明缓冲不够深
+            self.underruns += 1
+            self._stall = 0
+            if self._boost < self.max_depth:
+                self._boost += 1
+
+        sequence = self._next
+        self._next = (sequence + 1) & _SEQ_MASK
+        slot = sequence & self._mask
+        if self._seq[slot] != sequence:
+            # 丢包(或者迟到太久)
+            self.concealed += 1
+            return self._conceal(buf)
+        self._seq[slot] = -1
+        n = self._len[slot]
+        start = slot * self.frame_bytes
+        buf[:n] = self._mv[start:start + n]
+        self._last_slot = slot
+        if self._concealing:
+            self._concealing = 0
+        elif self._boost and self._jitter16 < 16 * self.frame_ms:
+            # 网络恢复平稳后慢慢撤掉欠载时加的深度
+            self._boost -= 1
+        return n, PLAYED
+
+    def _conceal(self, buf):
+        self._concealing += 1
+        last = self._last_slot
+        if self.repeat_last and self._concealing == 1 and last >= 0:
+            # 只接收 slots - 1 以内的序号, 上一帧的槽位不会被新包覆盖
+            n = self._len[last]
+            start = last * self.frame_bytes
+            buf[:n] = self._mv[start:start + n]
+        else:
+            n = self.frame_bytes
+            buf[:n] = self._silence
+        return n, CONCEALED
+
+    def stats(self):
+        return {
+            'received': self.received,
+            'duplicates': self.duplicates,
+            'late': self.late,
+            'concealed': self.concealed,
+            'underruns': self.underruns,
+            'jitter_ms': self.jitter_ms,
+            'target': self.target,
+        }
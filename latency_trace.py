@@ -0,0 +1,103 @@
+"""
+语音往返的延迟打点
+
+在关键位置记下事件的时间(ticks_us), 用来分析一次对话的时间花在哪一段:
+  mic_first   这次录音的第一帧麦克风数据(帧的采集时间)
+  vad_start   VAD 判定开始说话
+  vad_end     VAD 判定说话结束
+  end_sent    发出录音结束标记
+  rx_first    收到回复的第一块下行音频
+  play_first  第一次写 I2S(开始播放)
+  play_last   最后一次写 I2S(播完; 中途播空会记多次, 取最后一次)
+  barge_in    播放时检测到用户打断
+每条记录是 (轮次, 事件, 时间, 参数), 存在预分配的循环数组里, 满了覆盖
+最旧的记录; 打点不分配内存、不打印, 不会像逐块 print 那样拖慢串口。
+begin_turn() 开始新的一轮(一次录音到它的回复), once() 每轮只记第一次。
+需要时 dump() 按 CSV 打印到串口, 或 csv() 取出文本从 WebSocket 发回,
+电脑上用 tools/trace_histogram.py 统计各段延迟的分布。
+时间只保留低 30 位(和 MicroPython 的 ticks 周期一致), 相减时按回绕处理。
+多个线程同时打点时不加锁, 极少数情况下会互相覆盖一条记录。
+"""
+from array import array
+
+from myutil import ticks_us
+
+MIC_FIRST = 0
+VAD_START = 1
+VAD_END = 2
+END_SENT = 3
+RX_FIRST = 4
+PLAY_FIRST = 5
+PLAY_LAST = 6
+BARGE_IN = 7
+
+EVENT_NAMES = ('mic_first', 'vad_start', 'vad_end', 'end_sent', 'rx_first',
+               'play_first', 'play_last', 'barge_in')
+
+TICKS_MASK = 0x3fffffff
+CSV_HEADER = 'turn,event,t_us,arg'
+
+
+class Tracer:
+    """size 条记录的循环打点缓冲区"""
+
+    def __init__(self, size=128):
+        self.size = size
+        self._turns = array('H', [0] * size)
+        self._events = bytearray(size)
+        self._times = array('i', [0] * size)
+        self._args = array('i', [0] * size)
+        self._next = 0
+        self.count = 0   # 已存的记录数
+        self.turn = 0    # 当前轮次
+        self._seen = 0   # 本轮已经记过的事件(once 用的位图)
+        self.enabled = True
+
+    def begin_turn(self):
+        """开始新的一轮"""
+        self.turn = (self.turn + 1) & 0xffff
+        self._seen = 0
+
+    def mark(self, event, arg=0, t=None):
+        """记下事件, t 默认为当前 ticks_us(也可以传入帧的采集时间)"""
+        if not self.enabled:
+            return
+        if t is None:
+            t = ticks_us()
+        i = self._next
+        self._next = (i + 1) % self.size
+        self._turns[i] = self.turn
+        self._events[i] = event
+        self._times[i] = t & TICKS_MASK
+        self._args[i] = arg
+        if self.count < self.size:
+            self.count += 1
+
+    def once(self, event, arg=0, t=None):
+        """本轮第一次发生时才记"""
+        bit = 1 << event
+        if self._seen & bit:
+            return
+        self._seen |= bit
+        self.mark(event, arg, t)
+
+    def clear(self):
+        self.count = 0
+
+    def lines(self):
+        """CSV 表头和各条记录(从旧到新), 不含换行"""
+        yield CSV_HEADER
+        i = (self._next - self.count) % self.size
+        for _ in range(self.count):
+            yield '%d,%s,%d,%d' % (self._turns[i], EVENT_NAMES[self._events[i]],
+                                   self._times[i], self._args[i])
+            i = (i + 1) % self.size
+
+    def dump(self, write=print):
+        """逐行输出 CSV, 默认打印到串口"""
+        for line in self.lines():
+            write(line)
+
+    def csv(self):
+        """整个 CSV 文本, 用于从网络发回"""
+        return '\n'.join(self.lines())
@@ -1,8 +1,10 @@
 from machine import Pin, I2S
 import time
+from audio_pipeline import I2SSink, I2SSource, Pipeline
 
 class AudioLoop:
     def __init__(self):
+        self.rate = 16000
         # 配置麦克风(输入)
         self.audio_in = I2S(
             1,                      # I2S(1)用于输入
@@ -12,7 +14,7 @@ class AudioLoop:
             mode=I2S.RX,           # 接收模式
             bits=16,               # 采样位数
             format=I2S.MONO,       # 单声道
-            rate=16000,            # 采样率
+            rate=self.rate,        # 采样率
             ibuf=4096              # 输入缓冲区
         )
         
@@ -25,26 +27,23 @@ class AudioLoop:
             mode=I2S.TX,           # 发送模式
             bits=16,               # 采样位数
             format=I2S.MONO,       # 单声道
-            rate=16000,            # 采样率
+            rate=self.rate,        # 采样率
             ibuf=4096              # 输出缓冲区
         )
         
     def audio_loop(self):
         """从麦克风读取并实时播放"""
-        # 创建音频缓冲区
-        audio_buffer = bytearray(1024)
+        # 麦克风直接送扬声器, 两帧轮流使用
+        self.pipeline = Pipeline(I2SSource(self.audio_in, self.rate),
+                                 [I2SSink(self.audio_out)], frames=2, frame_bytes=1024)
         
         print("开始音频循环...")
         try:
-            while True:
-                # 从麦克风读取数据
-                num_read = self.audio_in.readinto(audio_buffer)
-                if num_read > 0:
-                    # 直接写入扬声器
-                    self.audio_out.write(audio_buffer[:num_read])
+            self.pipeline.run()
                     
         except KeyboardInterrupt:
             print("停止音频循环")
+            print("各环节耗时:", self.pipeline.stats())
         finally:
             self.stop()
     
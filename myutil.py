@@ -1,93 +1,333 @@
+import struct
+from array import array
+
+try:
+    from time import ticks_ms, ticks_us, ticks_diff, ticks_add
+except ImportError:
+    # CPython(电脑上调试/跑测试工具)没有 ticks_*, 用单调时钟模拟
+    from time import monotonic_ns as _monotonic_ns
+
+    def ticks_ms():
+        return _monotonic_ns() // 1000000
+
+    def ticks_us():
+        return _monotonic_ns() // 1000
+
+    def ticks_diff(end, start):
+        return end - start
+
+    def ticks_add(ticks, delta):
+        return ticks + delta
+
+try:
+    from _thread import allocate_lock
+except ImportError:  # 不支持线程的端口
+    allocate_lock = None
+
+
+class TokenBucket:
+    """
+    令牌桶限速: 每秒补充 rate 个令牌(例如字节), 最多攒 burst 个
+
+    只用小整数运算(内部以千分之一令牌计), 不分配内存。
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._credit = burst * 1000  # 千分之一令牌
+        self._max_idle_us = burst * 1000000 // rate  # 攒满一桶需要的时间
+        self._last = ticks_us()
+
+    def _refill(self):
+        now = ticks_us()
+        elapsed = ticks_diff(now, self._last)
+        self._last = now
+        if elapsed <= 0:
+            return
+        if elapsed > self._max_idle_us:
+            elapsed = self._max_idle_us
+        rate = self.rate
+        # elapsed * rate / 1000, 拆开算避免大整数
+        credit = self._credit + elapsed * (rate // 1000) + elapsed * (rate % 1000) // 1000
+        self._credit = min(credit, self.burst * 1000)
+
+    def delay_us(self, n):
+        """取 n 个令牌: 够则扣除并返回 0, 不够返回还需等待的微秒数(不扣除)"""
+        self._refill()
+        need = n * 1000
+        if self._credit >= need:
+            self._credit -= need
+            return 0
+        return (need - self._credit) // max(1, self.rate // 1000) + 1
+
+
 class RingBuffer:
-    """环形缓冲区实现"""
+    """
+    单生产者/单消费者(SPSC)无锁环形缓冲区
+
+    一个线程只写(write/write_from/write_views+commit), 另一个线程只读
+    (read/readinto/peek_views+consume), 不需要加锁:
+      - _head 只由生产者修改, _tail 只由消费者修改
+      - 生产者先拷贝数据再更新 _head, 消费者先拷贝数据再更新 _tail;
+        对整数属性的一次赋值是原子的(GIL), 所以对方看到新的下标时,
+        下标之前的数据一定已经写好/读完
+      - 每个操作开头只读一次对方的下标, 之后对方再怎么改都只会让
+        可读/可写的空间变大, 不会越界
+    下标按 2*size 取模循环, 用来区分满和空, 且始终是小整数, 不会分配内存。
+    size 向上取整到 2 的幂, 取模只需要位与。
+    """
+
     def __init__(self, size):
-        self.size = size
-        self.buffer = bytearray(size)
-        self.write_pos = 0
-        self.read_pos = 0
-        self.available = 0
-        
+        n = 1
+        while n < size:
+            n <<= 1
+        self.size = n
+        self._mask = n - 1
+        self._wrap = 2 * n - 1
+        self.buffer = bytearray(n)
+        self._mv = memoryview(self.buffer)
+        self._head = 0  # 写入位置, 只由生产者修改
+        self._tail = 0  # 读出位置, 只由消费者修改
+
+    @property
+    def available(self):
+        """可读字节数"""
+        return (self._head - self._tail) & self._wrap
+
+    @property
+    def free(self):
+        """可写字节数"""
+        return self.size - ((self._head - self._tail) & self._wrap)
+
+    def _views(self, start, n):
+        """从 start 开始 n 字节对应的一到两个连续 memoryview"""
+        start &= self._mask
+        first = min(n, self.size - start)
+        if first == n:
+            return (self._mv[start:start + n],)
+        return self._mv[start:self.size], self._mv[:n - first]
+
+    # 生产者
+
+    def write_views(self, n=None):
+        """可写区域(最多 n 字节)的 memoryview 元组, 填好后调用 commit()"""
+        free = self.free
+        if n is None or n > free:
+            n = free
+        if not n:
+            return ()
+        return self._views(self._head, n)
+
+    def commit(self, n):
+        """发布 write_views() 里已填好的前 n 字节"""
+        self._head = (self._head + n) & self._wrap
+
+    def write_from(self, buf, n=None):
+        """从 buf 拷贝最多 n 字节(默认全部), 返回写入的字节数, 空间不足时只写一部分"""
+        if n is None or n > len(buf):
+            n = len(buf)
+        src = memoryview(buf)
+        done = 0
+        for view in self.write_views(n):
+            size = len(view)
+            view[:] = src[done:done + size]
+            done += size
+        self.commit(done)
+        return done
+
     def write(self, data):
-        """写入数据到缓冲区"""
-        # print(f"write:begin写入数据到缓冲区,可用大小: {self.available}")
-        data_len = len(data)
-        
-        # 检查是否有足够的空间写入数据
-        if data_len > self.size - self.available:
-            print("write:缓冲区空间不足")
-            return 0
-        
-        write_size = 0
-            
-        # 计算可写入长度
-        if self.write_pos >= self.read_pos:
-            # 写指针在读指针后面或相等
-            # 可以写到缓冲区末尾，如果数据还有剩余且读指针不在开头，才能绕到开头继续写
-            first_part = min(data_len, self.size - self.write_pos)
-            # 写入第一部分
-            self.buffer[self.write_pos:self.write_pos + first_part] = data[:first_part]
-            write_size += first_part
-            
-            if first_part < data_len:
-                # 还有数据需要写入，且必须确保不会覆盖到读指针
-                if self.read_pos > 0:  # 只有读指针不在开头时才能写入第二部分
-                    second_part = min(data_len - first_part, self.read_pos)
-                    self.buffer[0:second_part] = data[first_part:first_part + second_part]
-                    self.write_pos = second_part
-                    write_size += second_part
-                else:
-                    # 读指针在开头，不能环绕写入
-                    self.write_pos = 0
-            else:
-                self.write_pos = (self.write_pos + first_part) % self.size
-        else:
-            # 写指针在读指针前面，只能写到读指针位置
-            first_part = min(data_len, self.read_pos - self.write_pos)
-            self.buffer[self.write_pos:self.write_pos + first_part] = data[:first_part]
-            self.write_pos += first_part
-            write_size += first_part
-            
-        self.available += write_size
-        # print(f"write:after写入数据后，缓冲区可用大小: {self.available}")
-        return write_size
-        
+        """写入数据, 返回写入的字节数"""
+        return self.write_from(data)
+
+    # 消费者
+
+    def peek_views(self, n=None):
+        """可读数据(最多 n 字节)的 memoryview 元组, 不拷贝, 用完后调用 consume()"""
+        available = self.available
+        if n is None or n > available:
+            n = available
+        if not n:
+            return ()
+        return self._views(self._tail, n)
+
+    def consume(self, n):
+        """丢弃最前面的 n 字节, 释放空间给生产者"""
+        self._tail = (self._tail + n) & self._wrap
+
+    def readinto(self, buf, n=None):
+        """读出最多 n 字节(默认 len(buf))到 buf, 返回读出的字节数"""
+        if n is None or n > len(buf):
+            n = len(buf)
+        dst = memoryview(buf)
+        done = 0
+        for view in self.peek_views(n):
+            size = len(view)
+            dst[done:done + size] = view
+            done += size
+        self.consume(done)
+        return done
+
     def read(self, size):
-        """从缓冲区读取数据"""
-        # with self.lock:
-        if self.available == 0:
-            return bytearray(0)
-            
-        # print(f"read--begin:从缓冲区读取数据，可用大小: {self.available}")
-        read_size = min(size, self.available)
-        
-        if self.read_pos < self.write_pos:
-            # 读指针在写指针前面，最多只能读取到写指针位置
-            first_part = min(read_size, self.write_pos - self.read_pos)
-            result = bytearray(first_part)
-            result = self.buffer[self.read_pos:self.read_pos + first_part]
-            self.read_pos += first_part
-            
-            self.available -= first_part
-            
+        """读出最多 size 字节, 返回新的 bytearray (会分配内存, 循环里请用 readinto)"""
+        result = bytearray(min(size, self.available))
+        n = self.readinto(result)
+        return result if n == len(result) else result[:n]
+
+    def clear(self):
+        """丢弃所有可读数据, 只能在消费者线程调用"""
+        self._tail = self._head
+
+
+class Signal:
+    """
+    二值信号量: 一个线程 wait() 阻塞等待, 另一个线程或中断回调 set() 唤醒
+
+    set() 在没人等待时会保留到下一次 wait(), 多次 set() 只算一次, 所以等待方
+    要在循环里重新检查条件。MicroPython 的锁不支持超时, wait() 一直等到 set()。
+    不支持线程的端口上用标志位代替锁, wait() 空转等中断回调 set()。
+    """
+
+    def __init__(self):
+        self._lock = allocate_lock() if allocate_lock else None
+        if self._lock:
+            self._lock.acquire()
+        self._flag = False
+        self.wakeups = 0  # wait() 返回的次数
+
+    def set(self):
+        if not self._lock:
+            self._flag = True
+            return
+        try:
+            self._lock.release()
+        except RuntimeError:
+            pass  # 已经是置位状态
+
+    def wait(self):
+        if self._lock:
+            self._lock.acquire()
         else:
-            # 读指针在写指针后面或相等，需要考虑环绕读取
-            first_part = min(read_size, self.size - self.read_pos)
-            result = bytearray(read_size)
-            result[:first_part] = self.buffer[self.read_pos:self.read_pos + first_part]
-            
-            if first_part < read_size:
-                # 需要环绕读取
-                # print(f"需要环绕读取")
-                second_part = min(read_size - first_part, self.write_pos)
-                result[first_part:] = self.buffer[0:second_part]
-                self.read_pos = second_part
-                
-                self.available -= (first_part + second_part)
-            else:
-                # print(f"不需要环绕读取")
-                self.read_pos = (self.read_pos + first_part) % self.size
-                
-                self.available -= first_part
-                
-        # print(f"read--after:从缓冲区读取数据，可用大小: {self.available}")
-        return result
\ No newline at end of file
+            while not self._flag:
+                pass
+            self._flag = False
+        self.wakeups += 1
+
+
+class WatermarkRing(RingBuffer):
+    """
+    带高低水位事件的 RingBuffer
+
+      - 可读数据增加到 high(含)以上时 data_ready.set(), 消费者等数据攒够时用
+      - 可读数据减少到 low(含)以下时 space_ready.set(), 生产者等空间时用
+    只在越过水位的那一次通知, 不用轮询。先更新下标再读水位, 消费者可以
+    在等待前修改 high(先改水位, 再检查一次 available, 再 wait())。
+    生产者等待的空间不能超过 size - low, 否则越过低水位后仍然不够。
+    """
+
+    def __init__(self, size, high, low):
+        super().__init__(size)
+        self.high = high
+        self.low = low
+        self.data_ready = Signal()
+        self.space_ready = Signal()
+
+    def commit(self, n):
+        self._head = (self._head + n) & self._wrap
+        after = self.available
+        if after >= self.high > after - n:
+            self.data_ready.set()
+
+    def consume(self, n):
+        self._tail = (self._tail + n) & self._wrap
+        after = self.available
+        if after <= self.low < after + n:
+            self.space_ready.set()
+
+    def clear(self):
+        super().clear()
+        self.space_ready.set()
+
+
+class PreRollBuffer:
+    """
+    预录缓冲: blocks 块 x block_size 字节的预分配循环存储, 满了覆盖最旧的一块
+
+    录音直接读进 next_block() 返回的槽位再 commit(), 检测到说话时用
+    views() 按时间顺序取出各块的 memoryview 发送, 全程不拷贝、不分配。
+    """
+
+    def __init__(self, blocks, block_size):
+        self.blocks = blocks
+        self.block_size = block_size
+        self.buffer = bytearray(blocks * block_size)
+        self._mv = memoryview(self.buffer)
+        self._len = array('H', [0] * blocks)
+        self._next = 0   # 下一个要写的槽位
+        self.count = 0   # 已存的块数
+
+    @classmethod
+    def for_duration(cls, ms, block_size, sample_rate, sample_bytes=2):
+        """能保存 ms 毫秒音频(另加正在录的一块)的预录缓冲"""
+        block_ms = block_size * 1000 // (sample_rate * sample_bytes)
+        return cls((ms + block_ms - 1) // block_ms + 1, block_size)
+
+    def next_block(self):
+        """下一个槽位的可写 memoryview, 写完后调用 commit()"""
+        start = self._next * self.block_size
+        return self._mv[start:start + self.block_size]
+
+    def commit(self, n):
+        """保存 next_block() 里写入的 n 字节, 成为最新的一块"""
+        self._len[self._next] = n
+        self._next = (self._next + 1) % self.blocks
+        if self.count < self.blocks:
+            self.count += 1
+
+    def views(self):
+        """从旧到新依次返回各块数据的 memoryview"""
+        i = (self._next - self.count) % self.blocks
+        for _ in range(self.count):
+            start = i * self.block_size
+            yield self._mv[start:start + self._len[i]]
+            i = (i + 1) % self.blocks
+
+    def trim(self, blocks):
+        """只保留最新的 blocks 块"""
+        if self.count > blocks:
+            self.count = blocks
+
+    def clear(self):
+        self.count = 0
+
+
+def read_wav_header(stream):
+    """
+    读取 WAV 文件头, 读完后 stream 停在音频数据的开头。
+    返回 (采样率, 声道数, 位数, 数据字节数); 不是 PCM WAV 时抛出 ValueError
+    """
+    riff = stream.read(12)
+    if len(riff) < 12 or riff[0:4] != b'RIFF' or riff[8:12] != b'WAVE':
+        raise ValueError('not a WAV file')
+    fmt = None
+    while True:
+        head = stream.read(8)
+        if len(head) < 8:
+            raise ValueError('WAV data chunk not found')
+        size = struct.unpack('<I', head[4:8])[0]
+        if head[0:4] == b'data':
+            if fmt is None:
+                raise ValueError('WAV fmt chunk not found')
+            return fmt[2], fmt[1], fmt[5], size
+        # 块长度为奇数时后面有一个填充字节
+        skip = size + (size & 1)
+        if head[0:4] == b'fmt ':
+            fmt = struct.unpack('<HHIIHH', stream.read(skip)[:16])
+            if fmt[0] != 1:  # WAVE_FORMAT_PCM
+                raise ValueError('unsupported WAV format: %d' % fmt[0])
+            continue
+        while skip > 0:
+            skipped = len(stream.read(min(skip, 256)))
+            if not skipped:
+                raise ValueError('truncated WAV header')
+            skip -= skipped
@@ -0,0 +1,352 @@
+"""
+流式定点重采样 (16位单声道 PCM)
+
+把任意输入采样率转换到 I2S 配置的输出采样率, 按块处理, 块与块之间
+保存少量历史采样, 拼接处没有跳变。采样率之比约分成 L/M(输出/输入),
+相位用整数累加, 长时间运行也不会漂移。
+  - mode='linear':    相邻两点线性插值, 最快, 适合语音上采样
+  - mode='polyphase': 多相 FIR(加窗 sinc, taps 个抽头, Q14 系数),
+    降采样时截止频率随之降低以抗混叠; L 很大时(如 44100 -> 24000)
+    相位量化到 max_phases 个
+工作缓冲区和系数表在构造时分配, process() 不分配内存。每个相位分子
+对应的插值系数/系数组起点也预先算成表, 内核里没有除法(viper 不支持 //)。
+支持 viper 的端口(esp32)用原生循环, 其余端口用等价的 Python 实现。
+"""
+import math
+from array import array
+
+try:
+    from micropython import const
+except ImportError:  # CPython, 电脑上的测试工具
+    def const(x):
+        return x
+
+# _state 的下标, viper 函数最多 4 个参数, 其余参数放在这里
+_POS = const(0)    # 当前输出对应的工作缓冲区下标(整数部分)
+_ACC = const(1)    # 相位分子, 0 <= acc < L
+_OUT = const(2)    # 本次已输出的采样数
+_L = const(3)
+_M = const(4)
+_END = const(5)    # 工作缓冲区里的有效采样数
+_P = const(6)      # 相位数
+_TAPS = const(7)
+_ROUND = const(8)  # 本次最多输出的采样数
+_TAB = const(9)    # coef 里按相位分子 acc 查的表的起点
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _linear_python(work, dst, st, coef):
+    pos, acc, j, L, M, end = st[_POS], st[_ACC], st[_OUT], st[_L], st[_M], st[_END]
+    limit, tab = st[_ROUND], st[_TAB]
+    while pos + 2 <= end and j < limit:
+        x0 = work[pos]
+        dst[j] = x0 + (((work[pos + 1] - x0) * coef[tab + acc]) >> 14)
+        j += 1
+        acc += M
+        while acc >= L:
+            acc -= L
+            pos += 1
+    st[_POS] = pos
+    st[_ACC] = acc
+    st[_OUT] = j
+
+
+def _polyphase_python(work, dst, st, coef):
+    pos, acc, j, L, M, end = st[_POS], st[_ACC], st[_OUT], st[_L], st[_M], st[_END]
+    taps, limit, tab = st[_TAPS], st[_ROUND], st[_TAB]
+    while pos + taps <= end and j < limit:
+        base = coef[tab + acc]
+        total = 0
+        for k in range(taps):
+            total += coef[base + k] * work[pos + k]
+        total >>= 14
+        dst[j] = -32768 if total < -32768 else 32767 if total > 32767 else total
+        j += 1
+        acc += M
+        while acc >= L:
+            acc -= L
+            pos += 1
+    st[_POS] = pos
+    st[_ACC] = acc
+    st[_OUT] = j
+
+
+def _downmix_python(buf, frames):
+    mv = memoryview(buf)
+    for i in range(frames):
+        o = i * 4
+        left = mv[o] | (mv[o + 1] << 8)
+        right = mv[o + 2] | (mv[o + 3] << 8)
+        if left & 0x8000:
+            left -= 0x10000
+        if right & 0x8000:
+            right -= 0x10000
+        x = ((left + right) >> 1) & 0xffff
+        mv[i * 2] = x & 0xff
+        mv[i * 2 + 1] = x >> 8
+
+
+_linear = _linear_python
+_polyphase = _polyphase_python
+_downmix = _downmix_python
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _linear_native(work, dst, st, coef):
+        w = ptr16(work)
+        d = ptr16(dst)
+        s = ptr32(st)
+        c = ptr16(coef)
+        pos = s[_POS]
+        acc = s[_ACC]
+        j = s[_OUT]
+        L = s[_L]
+        M = s[_M]
+        end = s[_END]
+        limit = s[_ROUND]
+        tab = s[_TAB]
+        while pos + 2 <= end and j < limit:
+            x0 = int(w[pos])
+            if x0 & 0x8000:
+                x0 -= 0x10000
+            x1 = int(w[pos + 1])
+            if x1 & 0x8000:
+                x1 -= 0x10000
+            d[j] = x0 + (((x1 - x0) * int(c[tab + acc])) >> 14)
+            j += 1
+            acc += M
+            while acc >= L:
+                acc -= L
+                pos += 1
+        s[_POS] = pos
+        s[_ACC] = acc
+        s[_OUT] = j
+
+    @micropython.viper
+    def _polyphase_native(work, dst, st, coef):
+        w = ptr16(work)
+        d = ptr16(dst)
+        s = ptr32(st)
+        c = ptr16(coef)
+        pos = s[_POS]
+        acc = s[_ACC]
+        j = s[_OUT]
+        L = s[_L]
+        M = s[_M]
+        end = s[_END]
+        taps = s[_TAPS]
+        limit = s[_ROUND]
+        tab = s[_TAB]
+        while pos + taps <= end and j < limit:
+            base = int(c[tab + acc])
+            total = 0
+            k = 0
+            while k < taps:
+                h = int(c[base + k])
+                if h & 0x8000:
+                    h -= 0x10000
+                x = int(w[pos + k])
+                if x & 0x8000:
+                    x -= 0x10000
+                total += h * x
+                k += 1
+            total >>= 14
+            if total > 32767:
+                total = 32767
+            elif total < -32768:
+                total = -32768
+            d[j] = total
+            j += 1
+            acc += M
+            while acc >= L:
+                acc -= L
+                pos += 1
+        s[_POS] = pos
+        s[_ACC] = acc
+        s[_OUT] = j
+
+    @micropython.viper
+    def _downmix_native(buf, frames: int):
+        p = ptr16(buf)
+        i = 0
+        while i < frames:
+            left = int(p[2 * i])
+            right = int(p[2 * i + 1])
+            if left & 0x8000:
+                left -= 0x10000
+            if right & 0x8000:
+                right -= 0x10000
+            p[i] = ((left + right) >> 1) & 0xffff
+            i += 1
+
+    _linear = _linear_native
+    _polyphase = _polyphase_native
+    _downmix = _downmix_native
+except Exception:  # 没有 viper, 或原生代码编译失败时用 Python 实现
+    pass
+
+
+def _design(L, M, phases, taps):
+    """多相系数表: phases 组, 每组 taps 个 Q14 系数, 每组之和为 1.0"""
+    cutoff = 0.9 * min(1.0, L / M)  # 相对输入奈奎斯特频率
+    half = taps // 2
+    coef = array('h', [0] * (phases * taps))
+    for p in range(phases):
+        delay = p / phases
+        row = []
+        for k in range(taps):
+            t = k - (half - 1) - delay
+            x = math.pi * cutoff * t
+            h = cutoff * (math.sin(x) / x if x else 1.0)
+            row.append(h * (0.5 + 0.5 * math.cos(math.pi * t / half)))
+        total = sum(row)
+        acc = 0
+        for k in range(taps):
+            value = int(round(row[k] / total * 16384))
+            coef[p * taps + k] = value
+            acc += value
+        coef[p * taps + half - 1] += 16384 - acc  # 舍入误差补到中心抽头
+    return coef
+
+
+class Resampler:
+    """
+    in_rate -> out_rate 的流式重采样器, 每个音频流一个实例。
+    block: 每次送进内核的最大输入采样数, 决定工作缓冲区大小。
+    """
+
+    def __init__(self, in_rate, out_rate, mode='linear', taps=8, max_phases=64, block=256):
+        if mode not in ('linear', 'polyphase'):
+            raise ValueError('unknown resampler mode: %s' % mode)
+        g = _gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.mode = mode
+        self.passthrough = in_rate == out_rate
+        L = out_rate // g
+        M = in_rate // g
+        if mode == 'linear':
+            taps = 2
+            phases = L
+            # 相位分子 acc 对应的插值系数(Q14)
+            self._coef = array('h', [(acc << 14) // L for acc in range(L)])
+            tab = 0
+            self._kernel = _linear
+        else:
+            taps = max(2, taps & ~1)
+            phases = min(L, max_phases)
+            self._coef = _design(L, M, phases, taps)
+            # 系数表后面接着每个相位分子 acc 对应的系数组起点(量化到 phases 个相位)
+            tab = len(self._coef)
+            for acc in range(L):
+                self._coef.append((acc if phases == L else acc * phases // L) * taps)
+            self._kernel = _polyphase
+        self.taps = taps
+        self.block = block
+        self._history = taps - 1
+        self._work = bytearray((self._history + block) * 2)
+        self._work_mv = memoryview(self._work)
+        # Python 内核按 16 位下标读写, 需要 memoryview.cast(CPython); viper 直接用缓冲区
+        self._work_h = self._work_mv.cast('h') if hasattr(self._work_mv, 'cast') else self._work
+        self._state = array('i', [0] * 10)
+        st = self._state
+        st[_L] = L
+        st[_M] = M
+        st[_P] = phases
+        st[_TAPS] = taps
+        st[_TAB] = tab
+        self.reset()
+
+    def reset(self):
+        """开始新的音频流: 历史清零, 相位归零"""
+        for i in range(len(self._work)):
+            self._work[i] = 0
+        st = self._state
+        st[_POS] = st[_ACC] = 0
+        self._kept = self._history  # 工作缓冲区开头保留的历史采样数
+
+    def output_size(self, nbytes):
+        """输入 nbytes 字节时最多输出的字节数, 用来准备 dst"""
+        if self.passthrough:
+            return nbytes
+        st = self._state
+        return ((nbytes >> 1) * st[_L] // st[_M] + 2) * 2
+
+    def process(self, src, nbytes, dst):
+        """转换 src 的前 nbytes 字节, 写入 dst, 返回写入的字节数; dst 至少 output_size(nbytes)"""
+        if self.passthrough:
+            memoryview(dst)[:nbytes] = memoryview(src)[:nbytes]
+            return nbytes
+        src = memoryview(src)
+        out = memoryview(dst)
+        if hasattr(out, 'cast'):
+            out = out.cast('h')
+        st = self._state
+        st[_OUT] = 0
+        st[_ROUND] = self.output_size(nbytes) >> 1
+        work = self._work
+        work_mv = self._work_mv
+        total = nbytes >> 1
+        i = 0
+        while i < total:
+            n = min(self.block, total - i)
+            kept = self._kept
+            # 新的一块接在保留的历史后面
+            work_mv[kept * 2:(kept + n) * 2] = src[i * 2:(i + n) * 2]
+            end = kept + n
+            st[_END] = end
+            self._kernel(self._work_h, out, st, self._coef)
+            # 保留最后 taps-1 个采样给下一块, 下标随之平移
+            keep = min(end, self._history)
+            shift = end - keep
+            if shift:
+                for k in range(keep * 2):
+                    work[k] = work[shift * 2 + k]
+            st[_POS] -= shift
+            self._kept = keep
+            i += n
+        return st[_OUT] * 2
+
+
+def downmix_stereo(buf, nbytes):
+    """16位立体声原地混成单声道(左右取平均), 返回单声道字节数"""
+    frames = nbytes >> 2
+    _downmix(buf, frames)
+    return frames * 2
+
+
+def stream_to_i2s(readinto, audio_out, in_rate, out_rate, channels=1, mode='linear', chunk=1024):
+    """
+    从 readinto(buf) 持续读取 16 位 PCM(单声道或立体声), 混成单声道并重采样到
+    out_rate 后写入 audio_out(I2S), 读到结尾返回。缓冲区只在开始时分配一次。
+    """
+    if channels not in (1, 2):
+        raise ValueError('unsupported channel count: %d' % channels)
+    frame = 2 * channels
+    buf = bytearray(chunk)
+    mv = memoryview(buf)
+    resampler = Resampler(in_rate, out_rate, mode)
+    out = bytearray(resampler.output_size(chunk))
+    out_mv = memoryview(out)
+    pending = 0  # 上次读到的不完整采样帧的字节数, 放在 buf 开头
+    while True:
+        n = readinto(mv[pending:])
+        if not n:
+            return
+        n += pending
+        usable = n - n % frame
+        size = downmix_stereo(buf, usable) if channels == 2 else usable
+        size = resampler.process(buf, size, out)
+        written = 0
+        while written < size:
+            written += audio_out.write(out_mv[written:size])
+        pending = n - usable
+        for k in range(pending):
+            buf[k] = buf[usable + k]
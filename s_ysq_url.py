@@ -1,15 +1,21 @@
 import urequests
 from machine import Pin, I2S
 import os
+from myutil import read_wav_header
+from resample import stream_to_i2s
 
 class B525Player:
-    def __init__(self, sck_pin=12, ws_pin=14, sd_pin=13):
+    def __init__(self, sck_pin=12, ws_pin=14, sd_pin=13, rate=44100, resample_mode='linear'):
         """初始化B525音频播放器
         Args:
             sck_pin: I2S时钟引脚
             ws_pin: I2S字选择引脚  
             sd_pin: I2S数据引脚
+            rate: I2S输出采样率, WAV文件的采样率不同时自动重采样
+            resample_mode: 'linear' 或 'polyphase'(音质更好, 更耗CPU)
         """
+        self.rate = rate
+        self.resample_mode = resample_mode
         # 配置I2S接口
         self.audio_out = I2S(
             0,                          # I2S ID
@@ -19,7 +25,7 @@ class B525Player:
             mode=I2S.TX,               # 发送模式
             bits=16,                   # 采样位数
             format=I2S.MONO,         # 立体声
-            rate=44100,                # 采样率
+            rate=rate,                 # 采样率
             ibuf=20000                 # 内部缓冲区大小
         )
         
@@ -35,28 +41,15 @@ class B525Player:
                 print("HTTP请求错误:", response.status_code)
                 return
 
-            # 跳过WAV文件头(44字节)
-            for _ in range(44):
-                response.raw.read(1)
-            
-            # 读取并播放音频数据
-            buf = bytearray(1024)
-            while True:
-                # 从URL读取音频数据
-                chunk = response.raw.read(1024)
-                if not chunk:
-                    break
-                
-                # 将数据复制到缓冲区
-                for i in range(len(chunk)):
-                    buf[i] = chunk[i]
-                
-                # 通过I2S接口发送数据
-                num_written = 0
-                while num_written < len(chunk):
-                    num_written += self.audio_out.write(buf[num_written:len(chunk)])
-            
-            response.close()
+            # 按文件头里的格式读取, 再转换成I2S的采样率
+            try:
+                rate, channels, bits, _ = read_wav_header(response.raw)
+                if bits != 16:
+                    raise ValueError('只支持16位WAV, 当前 %d 位' % bits)
+                stream_to_i2s(response.raw.readinto, self.audio_out, rate, self.rate,
+                              channels, self.resample_mode)
+            finally:
+                response.close()
                         
         except Exception as e:
             print("播放错误:", e)
@@ -69,6 +62,6 @@ class B525Player:
 player = B525Player()
 
 # 从URL播放WAV文件
-player.play_from_url('http://192.168.0.109/audio_f/aa.wav')  # WAV文件需要是16位立体声、44.1kHz格式
+player.play_from_url('http://192.168.0.109/audio_f/aa.wav')  # 16位单声道或立体声WAV, 采样率任意
 player.stop()
 
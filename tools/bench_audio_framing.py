@@ -0,0 +1,87 @@
+"""
+音频上行帧格式性能对比: JSON+hex vs 二进制帧 (CPython)
+
+在本机启动 ws_audio_server 替身, 用 uwebsockets 客户端按
+audio_chat_client 的方式发送 1KB PCM 块, 比较线上字节数和吞吐量
+(计时包含服务端解码)。
+
+用法: python3 tools/bench_audio_framing.py [--chunks 2000]
+"""
+import argparse
+import json
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import audio_proto  # noqa: E402
+import uwebsockets  # noqa: E402
+import ws_audio_server  # noqa: E402
+
+CHUNK = 1024
+SAMPLE_RATE = 8000
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def run(port, sessions, binary, chunks):
+    ws = uwebsockets.connect('ws://127.0.0.1:%d/ws' % port)
+    if binary:
+        ws.send(audio_proto.hello_message(SAMPLE_RATE))
+        assert audio_proto.accepts_binary(ws.recv())
+
+    header = audio_proto.HEADER_SIZE
+    packet = bytearray(header + CHUNK)
+    pcm = memoryview(packet)[header:]
+    pcm[:] = os.urandom(CHUNK)
+
+    start = time.perf_counter()
+    for seq in range(chunks):
+        if binary:
+            audio_proto.pack_header(packet, audio_proto.MSG_AUDIO, seq, SAMPLE_RATE)
+            ws.send_into(packet, 0, header + CHUNK)
+        else:
+            ws.send(json.dumps({'type': 'audio', 'audio': bytes(pcm).hex()}))
+    ws.send(json.dumps({'type': 'end_recording'}))
+    ws.recv()  # status, 说明服务端已处理完所有音频
+    ws.close()
+    session = sessions.get(timeout=10)
+    elapsed = time.perf_counter() - start
+    assert session.audio_bytes == chunks * CHUNK
+    return session, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--chunks', type=int, default=2000)
+    args = parser.parse_args()
+
+    port = free_port()
+    sessions = queue.Queue()
+    threading.Thread(target=ws_audio_server.serve, daemon=True,
+                     kwargs={'port': port, 'host': '127.0.0.1', 'echo': False,
+                             'on_session': sessions.put}).start()
+    time.sleep(0.2)
+
+    audio = args.chunks * CHUNK
+    print(f"{args.chunks} chunks x {CHUNK} B PCM = {audio:,} audio bytes")
+    print(f"{'mode':>8} {'wire bytes':>12} {'overhead':>9} {'chunks/s':>10} {'audio MB/s':>11}")
+    for binary in (False, True):
+        session, elapsed = run(port, sessions, binary, args.chunks)
+        wire = session.stream.bytes_in
+        print(f"{'binary' if binary else 'json':>8} {wire:>12,} {wire / audio:>8.2f}x "
+              f"{args.chunks / elapsed:>10,.0f} {audio / elapsed / 1e6:>11.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+麦克风采集: 阻塞读 vs 中断读 (CPython, asyncio)
+
+用 fake_i2s 的麦克风替身(16kHz, 每帧 1024 字节), 在 asyncio 里运行
+  - 采集流水线: 数据源 -> 记录延迟的环节(偶尔模拟一次慢的网络发送)
+  - 另一个每 1ms 醒一次的任务, 记录它被耽误的最长时间(事件循环的响应性)
+数据源分别用阻塞的 I2SSource 和 audio_pipeline.IrqI2SSource, 有/没有
+慢发送各跑一次, 输出: 帧数、数据源报告的丢帧数、序号间隔(应等于丢帧数)、
+I2S 溢出丢掉的数据(阻塞读时丢了也看不出来)、采集到处理的平均/最大延迟、
+1ms 任务的最大延迟。
+
+用法: python3 tools/bench_capture.py [--seconds 3] [--stall-ms 150] [--stall-every 20]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from audio_pipeline import FuncStage, I2SSource, IrqI2SSource, Pipeline  # noqa: E402
+from fake_i2s import FakeI2S  # noqa: E402
+from myutil import ticks_diff, ticks_us  # noqa: E402
+
+RATE = 16000
+FRAME = 1024
+
+
+class Probe:
+    """记录采集延迟和序号间隔; 每 stall_every 帧阻塞 stall_ms(慢的网络发送)"""
+
+    def __init__(self, stall_every, stall_ms):
+        self.stall_every = stall_every
+        self.stall_ms = stall_ms
+        self.count = 0
+        self.gaps = 0
+        self.total_us = 0
+        self.max_us = 0
+        self._last_seq = None
+
+    def __call__(self, frame):
+        delay = ticks_diff(ticks_us(), frame.t_us)
+        self.total_us += delay
+        self.max_us = max(self.max_us, delay)
+        if self._last_seq is not None:
+            self.gaps += (frame.seq - self._last_seq - 1) & 0xffff
+        self._last_seq = frame.seq
+        self.count += 1
+        if self.stall_every and self.count % self.stall_every == 0:
+            time.sleep(self.stall_ms / 1000)
+        return None
+
+
+async def ticker(state):
+    """每 1ms 醒一次, 记录最长的迟到时间"""
+    worst = 0
+    while state['running']:
+        t0 = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - t0 - 0.001)
+    state['lag'] = worst
+
+
+async def run(kind, seconds, stall_every, stall_ms):
+    mic = FakeI2S(FakeI2S.RX, RATE)
+    # 中断读留 4 帧空帧, 和 I2S 内部缓冲区(4096 字节)能扛的阻塞时间相当
+    source = IrqI2SSource(mic, RATE, depth=4) if kind == 'irq' else I2SSource(mic, RATE)
+    probe = Probe(stall_every, stall_ms)
+    pipeline = Pipeline(source, [FuncStage(probe, 'probe')], frames=6, frame_bytes=FRAME,
+                        name=kind)
+    state = {'running': True}
+    tasks = [asyncio.ensure_future(pipeline.run_async(idle_ms=2)),
+             asyncio.ensure_future(ticker(state))]
+    await asyncio.sleep(seconds)
+    pipeline.stop()
+    state['running'] = False
+    await asyncio.gather(*tasks)
+    dropped = getattr(source, 'dropped', 0)
+    return (probe.count, dropped, probe.gaps, mic.overflow // FRAME,
+            probe.total_us // max(1, probe.count), probe.max_us, state['lag'] * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--stall-ms', type=int, default=150, help='慢发送阻塞的时间')
+    parser.add_argument('--stall-every', type=int, default=20, help='每多少帧慢一次, 0 不模拟')
+    args = parser.parse_args()
+
+    print(f'{"send":<7}{"source":<10}{"frames":>7}{"dropped":>9}{"seq gaps":>10}'
+          f'{"overflow":>10}{"avg us":>9}{"max us":>9}{"loop lag ms":>13}')
+    for label, every in (('fast', 0), ('stall', args.stall_every)):
+        for kind in ('blocking', 'irq'):
+            frames, dropped, gaps, lost, avg_us, max_us, lag = asyncio.run(
+                run(kind, args.seconds, every, args.stall_ms))
+            print(f'{label:<7}{kind:<10}{frames:>7}{dropped:>9}{gaps:>10}{lost:>10}'
+                  f'{avg_us:>9}{max_us:>9}{lag:>13.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+"""
+上行编解码测试 (CPython)
+
+用 vad_fixtures 的样本逐帧(1024 字节)编码, 检查:
+  - 往返: 参考解码器(有 audioop 时用 audioop, 否则用本文件里按
+    G.711 / IMA 推荐算法写的实现)和 audio_codec 的解码结果逐字节一致,
+    并给出信噪比
+  - 原地编码和编码到另一块缓冲区的结果一致
+  - ADPCM 的每一块都能单独解码(模拟丢包后从任意一块开始)
+再测编码吞吐量, 以 16kHz 单声道实时所需的速率为 1x。
+CPython 上走 Python 实现, 设备上走 viper 实现, 速度差一两个数量级。
+
+用法: python3 tools/bench_codec.py [--seconds 2]
+"""
+import argparse
+import math
+import os
+import sys
+import time
+import warnings
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import audio_codec  # noqa: E402
+import vad_fixtures  # noqa: E402
+from audio_proto import CODEC_IMA_ADPCM, CODEC_NAMES, CODEC_PCM16, CODEC_ULAW  # noqa: E402
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore', DeprecationWarning)
+    try:
+        import audioop
+    except ImportError:  # Python 3.13 起移除
+        audioop = None
+
+
+def ulaw_reference(payload):
+    out = array('h')
+    for u in payload:
+        u = ~u & 0xff
+        t = ((u & 0x0f) << 3) + 0x84
+        t <<= (u & 0x70) >> 4
+        out.append(0x84 - t if u & 0x80 else t - 0x84)
+    return out.tobytes()
+
+
+def ima_reference(block):
+    """按 IMA 推荐算法解码一块(4 字节块头 + 低 4 位在前的码字)"""
+    steps = audio_codec._STEPS
+    adjust = (-1, -1, -1, -1, 2, 4, 6, 8)
+    predictor = int.from_bytes(block[0:2], 'little', signed=True)
+    index = block[2]
+    out = array('h')
+    for byte in block[4:]:
+        for code in (byte & 0x0f, byte >> 4):
+            step = steps[index]
+            diff = step >> 3
+            if code & 4:
+                diff += step
+            if code & 2:
+                diff += step >> 1
+            if code & 1:
+                diff += step >> 2
+            predictor += -diff if code & 8 else diff
+            predictor = max(-32768, min(32767, predictor))
+            index = max(0, min(88, index + adjust[code & 7]))
+            out.append(predictor)
+    return out.tobytes()
+
+
+def reference_decoder(codec):
+    if audioop is not None:
+        if codec == CODEC_ULAW:
+            return lambda payload: audioop.ulaw2lin(bytes(payload), 2)
+
+        def ima(block):
+            # audioop 高 4 位在前, 初始状态取自块头
+            state = (int.from_bytes(block[0:2], 'little', signed=True), block[2])
+            swapped = bytes(((b >> 4) | ((b & 0x0f) << 4)) for b in block[4:])
+            return audioop.adpcm2lin(swapped, 2, state)[0]
+        if codec == CODEC_IMA_ADPCM:
+            return ima
+    if codec == CODEC_ULAW:
+        return ulaw_reference
+    if codec == CODEC_IMA_ADPCM:
+        return ima_reference
+    return bytes
+
+
+def snr_db(original, decoded):
+    a = memoryview(original).cast('h')
+    b = memoryview(decoded).cast('h')
+    signal = sum(x * x for x in a)
+    noise = sum((x - y) * (x - y) for x, y in zip(a, b))
+    return 10 * math.log10(signal / noise) if noise else float('inf')
+
+
+def check(codec, fixtures):
+    """返回 (线上字节数, PCM 字节数, 信噪比, 错误列表)"""
+    encoder = audio_codec.get(codec)
+    inplace = audio_codec.get(codec)
+    decoder = audio_codec.get(codec)
+    reference = reference_decoder(codec)
+    errors = []
+    wire = pcm_bytes = 0
+    original = bytearray()
+    decoded = bytearray()
+    out = bytearray(vad_fixtures.FRAME_BYTES)
+    pcm = bytearray(vad_fixtures.FRAME_BYTES)
+    for name, data, _ in fixtures:
+        encoder.reset()
+        inplace.reset()
+        for k, frame in enumerate(vad_fixtures.frames(data)):
+            n = encoder.encode(frame, len(frame), out)
+            payload = bytes(out[:n])
+            work = bytearray(frame)
+            if inplace.encode(work, len(work), work) != n or work[:n] != payload:
+                errors.append('%s frame %d: in-place encode differs' % (name, k))
+            m = decoder.decode(payload, n, pcm)
+            if m != len(frame):
+                errors.append('%s frame %d: decoded %d bytes' % (name, k, m))
+            if bytes(pcm[:m]) != reference(payload):
+                errors.append('%s frame %d: differs from reference decoder' % (name, k))
+            wire += n
+            pcm_bytes += len(frame)
+            original += frame
+            decoded += pcm[:m]
+    return wire, pcm_bytes, snr_db(original, decoded), errors
+
+
+def throughput(codec, seconds):
+    """编码吞吐量, 返回 (每秒 PCM 字节数, 实时倍数)"""
+    encoder = audio_codec.get(codec)
+    frames = vad_fixtures.frames(vad_fixtures.load()[0][1])
+    out = bytearray(vad_fixtures.FRAME_BYTES)
+    done = 0
+    t0 = time.perf_counter()
+    deadline = t0 + seconds
+    while time.perf_counter() < deadline:
+        for frame in frames:
+            encoder.encode(frame, len(frame), out)
+        done += len(frames) * vad_fixtures.FRAME_BYTES
+    rate = done / (time.perf_counter() - t0)
+    return rate, rate / (vad_fixtures.RATE * 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=2, help='每种编码测吞吐量的时长')
+    args = parser.parse_args()
+
+    fixtures = vad_fixtures.load()
+    print('reference decoder: %s' % ('audioop' if audioop else 'built-in'))
+    print(f'{"codec":<11}{"ratio":>7}{"SNR dB":>8}{"encode KB/s":>13}{"realtime":>10}{"errors":>8}')
+    failed = False
+    for codec in (CODEC_PCM16, CODEC_ULAW, CODEC_IMA_ADPCM):
+        wire, pcm_bytes, snr, errors = check(codec, fixtures)
+        rate, realtime = throughput(codec, args.seconds)
+        failed |= bool(errors)
+        print(f'{CODEC_NAMES[codec]:<11}{pcm_bytes / wire:>6.2f}x{snr:>8.1f}'
+              f'{rate / 1024:>13.0f}{realtime:>9.1f}x{len(errors):>8}')
+        for error in errors[:5]:
+            print('  ' + error)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
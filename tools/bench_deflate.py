@@ -0,0 +1,100 @@
+"""
+permessage-deflate 省下的线上字节数 (CPython)
+
+用一段典型的对话记录(控制消息、AI 文本回复、旧版 JSON+hex 音频)
+分别按三种配置压缩, 统计上下行线上字节数(含帧头):
+  - off:      不压缩
+  - device:   无上下文接管, 服务端窗口 2^10 (ESP32 上的默认配置)
+  - takeover: 上下文接管, 窗口 2^15 (内存换压缩率)
+
+用法: python3 tools/bench_deflate.py
+"""
+import json
+import math
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import wsdeflate  # noqa: E402
+
+REPLIES = [
+    '你好！我是你的语音助手，有什么可以帮你的吗？',
+    '今天天气晴，气温二十二度到二十八度，适合户外活动，记得做好防晒。',
+    '好的，已经帮你把客厅的灯打开了。',
+    '抱歉，我没有听清楚，可以再说一遍吗？',
+    '明天早上七点的闹钟已经设置好了，祝你晚安。',
+]
+
+
+def transcript(turns=20):
+    """(方向, 消息) 列表, 方向 'up' 表示设备发往服务端"""
+    rng = random.Random(1)
+    messages = [('up', {'type': 'hello', 'audio': 'binary', 'sample_rate': 8000, 'codec': 'pcm16'}),
+                ('down', {'type': 'hello', 'audio': 'binary'})]
+    for turn in range(turns):
+        # 旧服务端仍在用的 JSON+hex 音频: 一段 1KB 带噪声的 8kHz 正弦波
+        pcm = bytearray()
+        for i in range(512):
+            sample = int(3000 * math.sin(2 * math.pi * 440 * (turn * 512 + i) / 8000))
+            sample += rng.randint(-200, 200)
+            pcm += sample.to_bytes(2, 'little', signed=True)
+        messages.append(('up', {'type': 'audio', 'audio': pcm.hex()}))
+        messages.append(('up', {'type': 'end_recording'}))
+        messages.append(('down', {'type': 'status', 'message': '正在识别语音...'}))
+        messages.append(('down', {'type': 'text', 'text': REPLIES[turn % len(REPLIES)]}))
+        messages.append(('down', {'type': 'status', 'message': '回复完成'}))
+        if turn % 7 == 6:
+            messages.append(('down', {'type': 'error', 'message': 'TTS 服务超时，请稍后再试'}))
+    return messages
+
+
+def frame_overhead(length, masked):
+    header = 2 if length < 126 else 4 if length < 65536 else 10
+    return header + (4 if masked else 0)
+
+
+def run(mode, messages):
+    """返回 {方向: (原始字节, 线上字节)}"""
+    if mode == 'off':
+        client = server = None
+    else:
+        offer = wsdeflate.offer(context_takeover=(mode == 'takeover'),
+                                window_bits=10 if mode == 'device' else None)
+        params = wsdeflate.parse_response(offer)
+        client = wsdeflate.PerMessageDeflate(params)
+        server = wsdeflate.PerMessageDeflate(params, server=True)
+        if mode == 'device':
+            # 模拟设备端的一次性压缩器窗口
+            client.compress_bits = 10
+
+    totals = {'up': [0, 0], 'down': [0, 0]}
+    for direction, message in messages:
+        raw = json.dumps(message).encode('utf-8')
+        sender, receiver = (client, server) if direction == 'up' else (server, client)
+        payload = sender.compress(raw) if sender else None
+        if payload is None:
+            payload = raw
+        else:
+            assert receiver.decompress(payload) == raw
+        totals[direction][0] += len(raw)
+        totals[direction][1] += len(payload) + frame_overhead(len(payload), direction == 'up')
+    return totals
+
+
+def main():
+    messages = transcript()
+    print(f"{len(messages)} messages")
+    print(f"{'mode':>9} {'uplink wire':>12} {'downlink wire':>14} {'total':>8} {'saved':>7}")
+    baseline = None
+    for mode in ('off', 'device', 'takeover'):
+        totals = run(mode, messages)
+        wire = totals['up'][1] + totals['down'][1]
+        baseline = baseline or wire
+        print(f"{mode:>9} {totals['up'][1]:>12,} {totals['down'][1]:>14,} "
+              f"{wire:>8,} {1 - wire / baseline:>6.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""
+抖动缓冲测试 (CPython)
+
+本机 UDP 替身按 audio_boardcast 的下行格式(类型 1B + 序号 2B + 音频)
+实时发包, 并注入网络抖动、乱序、丢包和重复包; 接收端按播放节奏从
+JitterBuffer 取帧, 逐帧校验内容(每个包的音频填充的是自己的序号),
+统计补帧、欠载和端到端延迟。同时给出原来"按到达顺序直接写入"
+会播出的乱序帧和重复帧数量作对比。
+
+用法: python3 tools/bench_jitter.py [--seconds 6]
+"""
+import argparse
+import heapq
+import os
+import random
+import select
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from jitter_buffer import CONCEALED, PLAYED, WAITING, JitterBuffer  # noqa: E402
+
+FRAME_MS = 20
+FRAME_BYTES = 960  # 24kHz 16位单声道 20ms
+
+# 名称, 平均额外延迟(ms), 丢包率, 重复率
+SCENARIOS = (
+    ('clean LAN', 0, 0.0, 0.0),
+    ('busy WiFi', 15, 0.03, 0.01),
+    ('congested', 40, 0.08, 0.02),
+)
+
+
+def sender(port, start, frames, delay_ms, loss, duplicate, seed):
+    """UDP 替身: 从 start 开始按帧节奏发包, 每个包额外延迟服从指数分布, 因此会乱序"""
+    rng = random.Random(seed)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    queue = []
+    for seq in range(frames):
+        packet = bytes((1, seq >> 8, seq & 0xff)) + bytes((seq & 0xff,)) * FRAME_BYTES
+        if rng.random() < loss:
+            continue
+        copies = 2 if rng.random() < duplicate else 1
+        for _ in range(copies):
+            extra = rng.expovariate(1 / delay_ms) if delay_ms else 0
+            heapq.heappush(queue, (start + (seq * FRAME_MS + extra) / 1000, seq, packet))
+    while queue:
+        due, seq, packet = heapq.heappop(queue)
+        wait = due - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        sock.sendto(packet, ('127.0.0.1', port))
+    sock.close()
+
+
+def run(frames, delay_ms, loss, duplicate, seed=1):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.setblocking(False)
+    port = sock.getsockname()[1]
+    started = time.monotonic() + 0.05
+    thread = threading.Thread(target=sender,
+                              args=(port, started, frames, delay_ms, loss, duplicate, seed))
+    thread.start()
+
+    jitter = JitterBuffer(FRAME_BYTES, FRAME_MS, slots=64, max_depth=24)
+    frame = bytearray(FRAME_BYTES)
+    latencies = []
+    corrupt = 0
+    # 原来的做法: 按到达顺序写入
+    arrival_max = -1
+    reordered = dupes = 0
+    seen = set()
+    next_due = None
+    deadline = started + frames * FRAME_MS / 1000 + 2
+    while time.monotonic() < deadline:
+        now = time.monotonic()
+        timeout = max(0, next_due - now) if next_due else 0.005
+        if select.select([sock], [], [], timeout)[0]:
+            while True:
+                try:
+                    data = sock.recv(1500)
+                except BlockingIOError:
+                    break
+                seq = (data[1] << 8) | data[2]
+                if seq in seen:
+                    dupes += 1
+                elif seq < arrival_max:
+                    reordered += 1
+                seen.add(seq)
+                arrival_max = max(arrival_max, seq)
+                jitter.put(seq, memoryview(data)[3:])
+        now = time.monotonic()
+        if next_due is not None and now < next_due:
+            continue
+        expected = jitter._next
+        n, status = jitter.get_into(frame)
+        if status == WAITING:
+            next_due = None
+            continue
+        next_due = (next_due or now) + FRAME_MS / 1000
+        if status == PLAYED:
+            if frame[0] != expected & 0xff or n != FRAME_BYTES:
+                corrupt += 1
+            # 从这一帧的发送时刻(不含注入的延迟)到开始播放
+            latencies.append((now - started) * 1000 - expected * FRAME_MS)
+        elif status != CONCEALED:
+            corrupt += 1
+    thread.join()
+    sock.close()
+    stats = jitter.stats()
+    stats.update(reordered=reordered, dupes_old=dupes, corrupt=corrupt,
+                 played=len(latencies),
+                 latency_ms=sum(latencies) / len(latencies) if latencies else 0)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=6)
+    args = parser.parse_args()
+    frames = int(args.seconds * 1000 / FRAME_MS)
+
+    print(f'{"scenario":<12}{"played":>8}{"conceal":>9}{"late":>6}{"under":>7}'
+          f'{"jitter":>8}{"target":>8}{"latency":>9}{"old reorder":>13}{"old dup":>9}{"bad":>5}')
+    failed = False
+    for name, delay_ms, loss, duplicate in SCENARIOS:
+        s = run(frames, delay_ms, loss, duplicate)
+        failed |= bool(s['corrupt'])
+        print(f'{name:<12}{s["played"]:>8}{s["concealed"]:>9}{s["late"]:>6}{s["underruns"]:>7}'
+              f'{s["jitter_ms"]:>6}ms{s["target"]:>8}{s["latency_ms"]:>7.0f}ms'
+              f'{s["reordered"]:>13}{s["dupes_old"]:>9}{s["corrupt"]:>5}')
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""
+音频流水线组合演示与分环节计时 (CPython)
+
+用 fake_i2s 的 I2S 替身和本机网络, 把三个脚本的数据流都写成
+audio_pipeline 的组合:
+  - loopback:  mic_speaker, 麦克风直接送扬声器
+  - chat:      audio_chat_client, 8kHz 麦克风 -> VAD -> ADPCM 编码 ->
+               二进制音频帧(帧头写在 headroom 里); 下行按帧头解码 ->
+               8k->24k 重采样 -> 扬声器 (本机队列代替 WebSocket 服务端回声)
+  - boardcast: audio_boardcast, 16kHz 麦克风 -> VAD -> 预录缓冲 ->
+               UDP(2 字节序号); 下行 UDP -> 16k->24k 重采样 -> 扬声器
+每种组合分别用线程调度和 asyncio 调度运行, 输出各环节的调用次数、
+平均/最大耗时, 以及帧池耗尽次数。
+
+用法: python3 tools/bench_pipeline.py [--seconds 3] [--scheduler thread|async|both]
+"""
+import argparse
+import asyncio
+import collections
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import audio_codec  # noqa: E402
+import audio_proto  # noqa: E402
+import vad_fixtures  # noqa: E402
+from audio_pipeline import (DecodeStage, EncodeStage, FuncStage, I2SSink, I2SSource,  # noqa: E402
+                            Pipeline, PreRollStage, ResampleStage, Source, VadStage)
+from fake_i2s import FakeI2S  # noqa: E402
+from resample import Resampler  # noqa: E402
+from vad import Vad  # noqa: E402
+
+
+def speech(rate):
+    """带语音段的测试音频, 8kHz 时隔一个采样取一个"""
+    pcm = vad_fixtures.load()[2][1]
+    if rate == vad_fixtures.RATE:
+        return pcm
+    step = vad_fixtures.RATE // rate
+    mv = memoryview(pcm).cast('h')
+    return mv[::step].tobytes()
+
+
+class QueueSource(Source):
+    """从队列里取下行音频包: 帧头 + 数据, 解析出编码和采样率"""
+    name = 'net_in'
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def read(self, frame):
+        if not self.queue:
+            return 0
+        packet = self.queue.popleft()
+        _, codec, seq, rate = audio_proto.unpack_header(packet)
+        n = len(packet) - audio_proto.HEADER_SIZE
+        frame.data[:n] = packet[audio_proto.HEADER_SIZE:]
+        frame.codec = codec
+        frame.rate = rate
+        return n
+
+
+class UdpSource(Source):
+    """非阻塞 UDP, 去掉 2 字节序号"""
+    name = 'udp_in'
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.buf = bytearray(2048)
+
+    def read(self, frame):
+        try:
+            n = self.sock.recv_into(self.buf)
+        except BlockingIOError:
+            return 0
+        frame.data[:n - 2] = memoryview(self.buf)[2:n]
+        frame.rate = 16000
+        return n - 2
+
+
+def loopback():
+    mic = FakeI2S(FakeI2S.RX, 16000, speech(16000))
+    speaker = FakeI2S(FakeI2S.TX, 16000)
+    return [Pipeline(I2SSource(mic, 16000), [I2SSink(speaker)], frames=2, name='loopback')]
+
+
+def chat():
+    network = collections.deque()
+    header = audio_proto.HEADER_SIZE
+
+    def send(frame):
+        # 帧头写进 headroom, 和数据一起作为一个二进制帧发出
+        audio_proto.pack_header(frame.buf, audio_proto.MSG_AUDIO, frame.seq, frame.rate,
+                                frame.codec)
+        network.append(bytes(frame.buf[:header + frame.n]))
+        return None
+
+    mic = FakeI2S(FakeI2S.RX, 8000, speech(8000))
+    uplink = Pipeline(I2SSource(mic, 8000),
+                      [VadStage(Vad(window=4, min_voice_frames=3)),
+                       EncodeStage(audio_codec.ImaAdpcm()),
+                       FuncStage(send, 'ws_send')],
+                      frames=2, headroom=header, name='chat up')
+    speaker = FakeI2S(FakeI2S.TX, 24000)
+    decoders = {codec: audio_codec.get(codec) for codec in audio_proto.CODEC_NAMES}
+    downlink = Pipeline(QueueSource(network),
+                        [DecodeStage(decoders),
+                         ResampleStage(Resampler(8000, 24000)),
+                         I2SSink(speaker)],
+                        frames=4, frame_bytes=4096, name='chat down')
+    return [uplink, downlink]
+
+
+def boardcast():
+    rx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rx.bind(('127.0.0.1', 0))
+    rx.setblocking(False)
+    tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server = rx.getsockname()
+
+    def send(frame):
+        frame.buf[0] = frame.seq >> 8
+        frame.buf[1] = frame.seq & 0xff
+        tx.sendto(memoryview(frame.buf)[:2 + frame.n], server)
+        return None
+
+    mic = FakeI2S(FakeI2S.RX, 16000, speech(16000))
+    uplink = Pipeline(I2SSource(mic, 16000),
+                      [VadStage(Vad(window=4, min_voice_frames=2, hangover_frames=50)),
+                       PreRollStage(9),
+                       FuncStage(send, 'udp_send')],
+                      frames=12, headroom=2, name='boardcast up')
+    speaker = FakeI2S(FakeI2S.TX, 24000)
+    downlink = Pipeline(UdpSource(rx),
+                        [ResampleStage(Resampler(16000, 24000)), I2SSink(speaker)],
+                        frames=3, frame_bytes=2048, name='boardcast down')
+    return [uplink, downlink]
+
+
+CONFIGS = (('loopback', loopback), ('chat', chat), ('boardcast', boardcast))
+
+
+def run_threads(pipelines, seconds):
+    for pipeline in pipelines:
+        pipeline.start_thread(idle_ms=1)
+    time.sleep(seconds)
+    for pipeline in pipelines:
+        pipeline.stop()
+    time.sleep(0.2)
+
+
+def run_async(pipelines, seconds):
+    async def main():
+        tasks = [asyncio.ensure_future(p.run_async(idle_ms=1)) for p in pipelines]
+        await asyncio.sleep(seconds)
+        for pipeline in pipelines:
+            pipeline.stop()
+        await asyncio.gather(*tasks)
+    asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--scheduler', choices=('thread', 'async', 'both'), default='both')
+    args = parser.parse_args()
+    schedulers = (('thread', run_threads), ('async', run_async))
+    if args.scheduler != 'both':
+        schedulers = [s for s in schedulers if s[0] == args.scheduler]
+
+    print(f'{"config":<11}{"sched":<8}{"pipeline":<16}{"stage":<10}'
+          f'{"calls":>7}{"avg us":>8}{"max us":>8}{"pool":>6}')
+    for name, build in CONFIGS:
+        for scheduler, run in schedulers:
+            pipelines = build()
+            run(pipelines, args.seconds)
+            for pipeline in pipelines:
+                for i, (stage, calls, avg_us, max_us) in enumerate(pipeline.stats()):
+                    pool = pipeline.pool.exhausted if i == 0 else ''
+                    print(f'{name:<11}{scheduler:<8}{pipeline.name:<16}{stage:<10}'
+                          f'{calls:>7}{avg_us:>8}{max_us:>8}{pool:>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+播放线程: 轮询 vs 事件驱动 (CPython)
+
+接收线程按 1024 字节一块、比实时快 network 倍地把几段"回复"写进
+环形缓冲区(其中一段短于高水位, 只能靠 flush_ms 之后开始播放),
+播放线程写给 fake_i2s 的 I2S 替身(24kHz)。对比:
+  - poll:  原来 audio_player_thread 的写法, sleep_ms(10)/(5) 轮询,
+           缓冲区满时接收线程 sleep_ms(20)
+  - event: audio_player.RingPlayer, 水位事件 + 一次性定时器, 阻塞写 I2S
+  - irq:   同上, I2S 非阻塞写, 写完的回调唤醒播放线程
+输出播放线程和接收线程的空转唤醒次数、开始播放的延迟(满足开始条件
+到第一次写 I2S: 越过高水位, 或最后一次写入 flush_ms 之后)、欠载次数和
+进程 CPU 时间。
+
+用法: python3 tools/bench_player.py [--network 3] [--replies 3000,150,1500]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from audio_player import RingPlayer  # noqa: E402
+from fake_i2s import FakeI2S, FakeTimer  # noqa: E402
+from myutil import WatermarkRing, ticks_diff, ticks_ms  # noqa: E402
+
+RATE = 24000
+CHUNK = 1024
+HIGH = CHUNK * 16
+LOW = CHUNK * 8
+FLUSH_MS = 200
+IDLE_RESET_MS = 300  # 比回复之间的间隔短, 每段回复都从攒数据开始
+
+
+def sleep_ms(ms):
+    time.sleep(ms / 1000)
+
+
+class Speaker(FakeI2S):
+    """记录每次写入的时间"""
+
+    def __init__(self):
+        super().__init__(FakeI2S.TX, RATE)
+        self.times = []
+
+    def write(self, buf):
+        self.times.append(time.monotonic())
+        return super().write(buf)
+
+
+class PollingPlayer:
+    """原来的 audio_player_thread / play_audio(轮询), 只加了计数"""
+
+    def __init__(self, ring, audio_out):
+        self.ring = ring
+        self.audio_out = audio_out
+        self.running = False
+        self._rx_ms = ticks_ms()
+        self.wakeups = 0
+        self.producer_wakeups = 0
+        self.underruns = 0
+
+    def received(self):
+        self._rx_ms = ticks_ms()
+
+    def write(self, buf):
+        src = memoryview(buf)
+        while len(src):
+            written = self.ring.write_from(src)
+            if not written:
+                self.producer_wakeups += 1
+                sleep_ms(20)
+            else:
+                src = src[written:]
+        self.received()
+
+    def run(self):
+        ring = self.ring
+        self.running = True
+        waiting = True
+        empty_ms = None
+        while self.running:
+            if waiting:
+                if (ring.available < HIGH and
+                        (ring.available == 0 or ticks_diff(ticks_ms(), self._rx_ms) < FLUSH_MS)):
+                    self.wakeups += 1
+                    sleep_ms(10)
+                    continue
+                waiting = False
+            if ring.available:
+                if empty_ms is not None and ticks_diff(ticks_ms(), empty_ms) <= IDLE_RESET_MS:
+                    self.underruns += 1
+                empty_ms = None
+                for chunk in ring.peek_views(CHUNK):
+                    written = 0
+                    while written < len(chunk):
+                        written += self.audio_out.write(chunk[written:])
+                    ring.consume(written)
+            else:
+                if empty_ms is None:
+                    empty_ms = ticks_ms()
+                elif ticks_diff(ticks_ms(), empty_ms) > IDLE_RESET_MS:
+                    waiting = True
+                    empty_ms = None
+                self.wakeups += 1
+                sleep_ms(5)
+
+    def stop(self):
+        self.running = False
+
+
+def produce(player, ring, replies, network, gap_ms, ready):
+    """按回复长度(毫秒)发送, 记录每段回复满足开始条件的时间"""
+    chunk = bytes(CHUNK)
+    for ms in replies:
+        total = RATE * 2 * ms // 1000
+        sent = 0
+        crossed = None
+        t0 = time.monotonic()
+        while sent < total:
+            n = min(CHUNK, total - sent)
+            player.write(chunk[:n])
+            last = time.monotonic()
+            sent += n
+            if crossed is None and ring.available >= HIGH:
+                crossed = time.monotonic()
+            # 网络比实时快 network 倍
+            wait = t0 + sent / (2 * RATE * network) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        ready.append(crossed if crossed is not None else last + FLUSH_MS / 1000)
+        # 等这段回复播完, 再隔一段时间开始下一段
+        while ring.available:
+            time.sleep(0.01)
+        time.sleep(gap_ms / 1000)
+
+
+def run(kind, replies, network, gap_ms):
+    ring = WatermarkRing(1024 * 32, HIGH, LOW)
+    speaker = Speaker()
+    if kind == 'poll':
+        player = PollingPlayer(ring, speaker)
+    else:
+        player = RingPlayer(ring, speaker, CHUNK, FakeTimer(), FLUSH_MS, IDLE_RESET_MS,
+                            use_irq=kind == 'irq')
+    thread = threading.Thread(target=player.run, daemon=True)
+    cpu0 = time.process_time()
+    thread.start()
+    ready = []
+    produce(player, ring, replies, network, gap_ms, ready)
+    player.stop()
+    thread.join(1)
+    cpu = (time.process_time() - cpu0) * 1000
+    # 每段回复满足开始条件之后的第一次写入
+    latency = []
+    for t in ready:
+        first = min((w for w in speaker.times if w >= t - 0.005), default=None)
+        latency.append((first - t) * 1000 if first is not None else float('nan'))
+    if kind == 'poll':
+        wakeups, producer = player.wakeups, player.producer_wakeups
+    else:
+        wakeups, producer = player.wakeups, ring.space_ready.wakeups
+    return wakeups, producer, latency, player.underruns, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--network', type=float, default=3, help='接收速度是实时的几倍')
+    parser.add_argument('--replies', default='3000,150,1500', help='每段回复的毫秒数')
+    parser.add_argument('--gap', type=int, default=500, help='回复之间的间隔(毫秒)')
+    args = parser.parse_args()
+    # CPython 默认 5ms 才切换一次线程, 会掩盖唤醒延迟
+    sys.setswitchinterval(0.0002)
+    replies = [int(x) for x in args.replies.split(',')]
+
+    print(f'{"player":<8}{"wakeups":>9}{"rx waits":>10}{"start ms":>24}{"underruns":>11}{"cpu ms":>8}')
+    for kind in ('poll', 'event', 'irq'):
+        wakeups, producer, latency, underruns, cpu = run(kind, replies, args.network, args.gap)
+        starts = ' '.join(f'{x:.1f}' for x in latency)
+        print(f'{kind:<8}{wakeups:>9}{producer:>10}{starts:>24}{underruns:>11}{cpu:>8.0f}')
+
+
+if __name__ == '__main__':
+    main()
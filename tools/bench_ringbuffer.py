@@ -0,0 +1,125 @@
+"""
+myutil.RingBuffer 双线程压力测试和吞吐量测试 (CPython)
+
+  - 压力测试: 生产者线程按随机块大小写入递增字节序列, 消费者线程用
+    readinto / peek_views 交替读取并逐字节校验, 覆盖各种环绕情况
+  - 吞吐量: 单线程交替 write_from/readinto 和 write_from/peek_views,
+    输出不同块大小下的 MB/s
+
+用法: python3 tools/bench_ringbuffer.py [--mbytes 16] [--size 4096]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from myutil import RingBuffer  # noqa: E402
+
+CHUNKS = (64, 256, 1024, 4096)
+MIN_SECONDS = 0.5
+
+
+def pattern(length):
+    """长度为 length 的 0..250 循环字节序列, 251 是质数, 不会和 2 的幂对齐"""
+    return bytes(i % 251 for i in range(length))
+
+
+def stress(total, size, seed=1):
+    """两个线程传输 total 字节, 返回 (错误信息或 None, 耗时秒)"""
+    ring = RingBuffer(size)
+    source = pattern(total + 4096)
+    errors = []
+
+    def producer():
+        rng = random.Random(seed)
+        sent = 0
+        while sent < total:
+            n = min(rng.randint(1, size), total - sent)
+            written = ring.write_from(memoryview(source)[sent:], n)
+            sent += written
+            if not written:
+                time.sleep(0)
+
+    def consumer():
+        rng = random.Random(seed + 1)
+        buf = bytearray(size)
+        received = 0
+        while received < total and not errors:
+            n = rng.randint(1, size)
+            if rng.random() < 0.5:
+                got = ring.readinto(buf, n)
+                chunk = buf[:got]
+            else:
+                chunk = bytearray()
+                for view in ring.peek_views(n):
+                    chunk += view
+                got = len(chunk)
+                ring.consume(got)
+            if not got:
+                time.sleep(0)
+                continue
+            if chunk != source[received:received + got]:
+                errors.append('mismatch at byte %d' % received)
+            received += got
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=producer), threading.Thread(target=consumer)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    if not errors and ring.available:
+        errors.append('%d bytes left over' % ring.available)
+    return (errors[0] if errors else None), elapsed
+
+
+def throughput(size, chunk, zero_copy):
+    """单线程写入再读出, 返回 MB/s"""
+    ring = RingBuffer(size)
+    data = bytearray(chunk)
+    out = bytearray(chunk)
+    count = 0
+    started = time.perf_counter()
+    while True:
+        for _ in range(1000):
+            ring.write_from(data)
+            if zero_copy:
+                n = 0
+                for view in ring.peek_views(chunk):
+                    n += len(view)
+                ring.consume(n)
+            else:
+                ring.readinto(out)
+        count += 1000
+        elapsed = time.perf_counter() - started
+        if elapsed >= MIN_SECONDS:
+            return count * chunk / elapsed / 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mbytes', type=float, default=16, help='压力测试传输的数据量(MB)')
+    parser.add_argument('--size', type=int, default=4096, help='环形缓冲区大小')
+    args = parser.parse_args()
+
+    total = int(args.mbytes * 1e6)
+    error, elapsed = stress(total, args.size)
+    print('stress: %d bytes through a %d byte ring in %.2fs: %s' % (
+        total, RingBuffer(args.size).size, elapsed, error or 'ok'))
+
+    print(f'{"chunk":>8}{"readinto MB/s":>16}{"peek_views MB/s":>18}')
+    for chunk in CHUNKS:
+        size = max(args.size, chunk * 2)
+        print(f'{chunk:>8}{throughput(size, chunk, False):>16.1f}'
+              f'{throughput(size, chunk, True):>18.1f}')
+    if error:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+wss:// 握手耗时: 完整握手 vs 会话恢复 (CPython)
+
+用 openssl 命令行生成临时自签名证书, 在本机启动 TLS 版 ws_audio_server
+替身, 然后:
+  - full:    每次新建 Connector, 每次都是完整 TLS 握手
+  - resumed: 复用同一个 Connector, 重连时带上次的 TLS 会话
+统计 TCP+TLS+HTTP 升级的总耗时、其中 TLS 部分的耗时和会话恢复次数。
+
+用法: python3 tools/bench_tls.py [--rounds 20]
+"""
+import argparse
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import uwebsockets  # noqa: E402
+import ws_audio_server  # noqa: E402
+from bench_audio_framing import free_port  # noqa: E402
+
+
+def self_signed(directory):
+    """生成 127.0.0.1 的自签名证书, 返回 (证书, 私钥) 路径"""
+    cert = os.path.join(directory, 'cert.pem')
+    key = os.path.join(directory, 'key.pem')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'ec',
+                    '-pkeyopt', 'ec_paramgen_curve:prime256v1', '-nodes',
+                    '-keyout', key, '-out', cert, '-days', '1',
+                    '-subj', '/CN=127.0.0.1', '-addext', 'subjectAltName=IP:127.0.0.1'],
+                   check=True, capture_output=True)
+    return cert, key
+
+
+def run(uri, context, rounds, reuse):
+    """返回 (总耗时列表, TLS 耗时列表, 恢复次数)"""
+    connector = None
+    totals, tls, resumed = [], [], 0
+    for _ in range(rounds):
+        if connector is None or not reuse:
+            connector = uwebsockets.Connector(uri, ssl_context=context)
+        ws = connector.connect()
+        totals.append(connector.handshake_ms)
+        tls.append(connector.tls_ms)
+        resumed += connector.tls_resumed
+        ws.close()
+    return totals, tls, resumed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        cert, key = self_signed(directory)
+        port = free_port()
+        threading.Thread(target=ws_audio_server.serve, daemon=True,
+                         kwargs={'port': port, 'host': '127.0.0.1', 'echo': False,
+                                 'tls': ws_audio_server.tls_context(cert, key)}).start()
+        time.sleep(0.2)
+
+        # 客户端只信任这张自签名证书
+        context = ssl.create_default_context(cafile=cert)
+        uri = 'wss://127.0.0.1:%d/ws' % port
+
+        print(f'{"mode":<10}{"total ms":>10}{"tls ms":>10}{"resumed":>10}')
+        for mode, reuse in (('full', False), ('resumed', True)):
+            totals, tls, resumed = run(uri, context, args.rounds, reuse)
+            print(f'{mode:<10}{statistics.median(totals):>10}{statistics.median(tls):>10}'
+                  f'{resumed:>6}/{args.rounds}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+"""
+VAD 性能对比 (CPython)
+
+在 vad_fixtures 的带标注样本上逐帧运行:
+  - chat_old:      audio_chat_client 原来的 detect_voice_activity
+  - boardcast_old: audio_boardcast 原来的 calculate_energy + detect_voice
+  - vad_fixed:     vad.Vad, 固定门限 200
+  - vad_adaptive:  vad.Vad, 噪声底自适应门限
+  - vad_spectral:  vad.Vad(mode='spectral'), 自适应门限 + 过零率 + 谱通量
+输出每帧平均/最大耗时, 逐帧判决的准确率、精确率(判为说话的帧里
+真是语音的比例)、召回率(语音帧被判为说话的比例), 以及按说话状态
+发送时要发出的字节数(理想值是语音帧的总字节数)。
+CPython 上 vad 走 memoryview.cast 路径, 设备上走 viper 路径。
+
+用法: python3 tools/bench_vad.py [--per-fixture]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import vad_fixtures  # noqa: E402
+from vad import Vad  # noqa: E402
+
+
+class ChatOld:
+    """audio_chat_client.detect_voice_activity 的原实现(去掉打印)"""
+
+    def __init__(self, threshold=200, window_size=4, confirm_silence=6):
+        self.vad_window = []
+        self.vad_window_size = window_size
+        self.vad_threshold = threshold
+        self.frames_to_confirm_silence = confirm_silence
+        self.voice_frames = 0
+        self.silence_frames = 0
+        self.is_speaking = False
+
+    def process(self, audio_data):
+        audio_copy = audio_data[:]
+        total = 0
+        data_length = len(audio_copy)
+        i = 0
+        while i < data_length - 1:
+            value = (audio_copy[i + 1] << 8) | audio_copy[i]
+            if value & 0x8000:
+                value -= 65536
+            total += abs(value)
+            i += 2
+        current_average = total / (data_length // 2)
+        self.vad_window.append(current_average)
+        if len(self.vad_window) > self.vad_window_size:
+            self.vad_window.pop(0)
+        window_average = sum(self.vad_window) / len(self.vad_window)
+        if window_average > self.vad_threshold:
+            self.voice_frames += 1
+            self.silence_frames = 0
+            if self.voice_frames > 2:
+                self.is_speaking = True
+        else:
+            if self.is_speaking:
+                self.silence_frames += 1
+            self.voice_frames = 0
+        if self.is_speaking and self.silence_frames >= self.frames_to_confirm_silence:
+            # 原实现在这里让录音结束, 之后重新开始检测
+            self.is_speaking = False
+            self.silence_frames = 0
+            return False
+        return self.is_speaking
+
+
+class BoardcastOld:
+    """audio_boardcast.calculate_energy + detect_voice 的原实现(去掉打印)"""
+
+    def __init__(self, threshold=500, window_size=4, confirm_silence=50):
+        self.vad_window = []
+        self.vad_window_size = window_size
+        self.vad_threshold = threshold
+        self.frames_to_confirm_silence = confirm_silence
+        self.voice_frames = 0
+        self.silence_frames = 0
+        self.is_speaking = False
+
+    def calculate_energy(self, buffer, length):
+        energy = 0
+        for i in range(0, length, 2):
+            sample = buffer[i] | (buffer[i + 1] << 8)
+            if sample & 0x8000:
+                sample = sample - 0x10000
+            energy += abs(sample)
+        return energy / (length // 2)
+
+    def process(self, buffer):
+        current_energy = self.calculate_energy(buffer, len(buffer))
+        self.vad_window.append(current_energy)
+        if len(self.vad_window) > self.vad_window_size:
+            self.vad_window.pop(0)
+        average_energy = sum(self.vad_window) / len(self.vad_window)
+        if average_energy > self.vad_threshold:
+            self.voice_frames += 1
+            self.silence_frames = 0
+            if self.voice_frames >= 2:
+                self.is_speaking = True
+        else:
+            if self.is_speaking:
+                self.silence_frames += 1
+            self.voice_frames = 0
+        if self.is_speaking and self.silence_frames >= self.frames_to_confirm_silence:
+            self.is_speaking = False
+        return self.is_speaking
+
+
+DETECTORS = (
+    ('chat_old', lambda: ChatOld().process),
+    ('boardcast_old', lambda: BoardcastOld().process),
+    ('vad_fixed', lambda: Vad(threshold=200, hangover_frames=6).process),
+    ('vad_adaptive', lambda: Vad(hangover_frames=6).process),
+    ('vad_spectral', lambda: Vad(hangover_frames=6, mode='spectral').process),
+)
+
+
+def run(make, fixtures):
+    """返回 {avg_us, max_us, accuracy, precision, recall, sent, speech} (字节数按帧计)"""
+    total_us = max_us = 0.0
+    tp = fp = fn = tn = 0
+    for name, pcm, labels in fixtures:
+        process = make()
+        for frame, label in zip(vad_fixtures.frames(pcm), labels):
+            t0 = time.perf_counter()
+            speaking = process(frame)
+            dt = (time.perf_counter() - t0) * 1e6
+            total_us += dt
+            max_us = max(max_us, dt)
+            if speaking:
+                if label:
+                    tp += 1
+                else:
+                    fp += 1
+            elif label:
+                fn += 1
+            else:
+                tn += 1
+    count = tp + fp + fn + tn
+    return {
+        'avg_us': total_us / count,
+        'max_us': max_us,
+        'accuracy': (tp + tn) / count,
+        'precision': tp / (tp + fp) if tp + fp else 0,
+        'recall': tp / (tp + fn) if tp + fn else 0,
+        'sent': (tp + fp) * vad_fixtures.FRAME_BYTES,
+        'speech': (tp + fn) * vad_fixtures.FRAME_BYTES,
+    }
+
+
+def report(fixtures):
+    print(f'{"detector":<15}{"avg us":>8}{"max us":>8}{"accuracy":>10}{"precision":>11}'
+          f'{"recall":>8}{"sent KB":>9}{"speech KB":>11}')
+    for name, make in DETECTORS:
+        r = run(make, fixtures)
+        print(f'{name:<15}{r["avg_us"]:>8.1f}{r["max_us"]:>8.1f}{r["accuracy"]:>10.1%}'
+              f'{r["precision"]:>11.1%}{r["recall"]:>8.1%}{r["sent"] / 1024:>9.0f}'
+              f'{r["speech"] / 1024:>11.0f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--per-fixture', action='store_true', help='每个样本单独统计')
+    args = parser.parse_args()
+
+    fixtures = vad_fixtures.load()
+    frames = sum(len(labels) for _, _, labels in fixtures)
+    print('%d fixtures, %d frames of %d bytes' % (len(fixtures), frames, vad_fixtures.FRAME_BYTES))
+    if args.per_fixture:
+        for fixture in fixtures:
+            print('\n' + fixture[0])
+            report([fixture])
+    else:
+        report(fixtures)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Websocket 掩码性能测试 (CPython)
+
+对比 uwebsockets 原来的逐字节生成器写法和 wsmask 的原地按字异或,
+输出 125B / 1KB / 16KB / 64KB 帧的吞吐量(bytes/sec)。
+
+用法: python3 tools/bench_wsmask.py
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from wsmask import mask  # noqa: E402
+
+SIZES = (125, 1024, 16 * 1024, 64 * 1024)
+MIN_SECONDS = 0.5
+
+
+def legacy_mask(data, mask_bits):
+    return bytes(b ^ mask_bits[i % 4] for i, b in enumerate(data))
+
+
+def wsmask_inplace(buf, mask_bits):
+    return mask(buf, mask_bits)
+
+
+def measure(func, buf, mask_bits):
+    """重复执行直到超过 MIN_SECONDS, 返回 bytes/sec"""
+    rounds = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < MIN_SECONDS:
+        func(buf, mask_bits)
+        rounds += 1
+        elapsed = time.perf_counter() - start
+    return len(buf) * rounds / elapsed
+
+
+def main():
+    mask_bits = b'\x12\x34\x56\x78'
+    print(f"{'size':>8} {'legacy B/s':>14} {'wsmask B/s':>14} {'speedup':>8}")
+    for size in SIZES:
+        payload = bytearray(os.urandom(size))
+        # 先校验两种实现结果一致
+        expected = legacy_mask(payload, mask_bits)
+        assert bytes(mask(bytearray(payload), mask_bits)) == expected
+        legacy = measure(legacy_mask, payload, mask_bits)
+        fast = measure(wsmask_inplace, payload, mask_bits)
+        print(f"{size:>8} {legacy:>14,.0f} {fast:>14,.0f} {fast / legacy:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""
+全双工打断检测的检查: 回声抑制门 + VAD (CPython)
+
+用 vad_fixtures 的样本离线模拟播放回复时的麦克风: 扬声器播放一段回复
+(quiet_room), 麦克风录到它的回声(按 gain 缩放、延迟 delay 帧)加上用户
+自己说的话(typing, 可以不加)。逐帧按 audio_chat_client.listen_for_barge_in
+的逻辑判断: 播放端每帧调用 EchoGate.reference(), 麦克风端 is_echo() +
+打断用的 Vad, 连续 frames 帧有声且不是回声算一次打断(之后重新开始计数)。
+EchoGate 的 coupling 按已知的 gain 乘 margin 设置(相当于在设备上标定过)。
+时钟按帧推进(每帧 32ms), EchoGate 的 tail_ms 按模拟时间计算。
+输出: 只有回声时的误打断次数; 有用户说话时检测到的语音段数和从开口
+到检测到的平均延迟。gate=off 是不用回声抑制门(只看 VAD)的对照。
+
+用法: python3 tools/check_barge_in.py [--gains 0.3,0.6,1.0] [--margin 1.5] [--delay 3]
+                                      [--frames 2]
+"""
+import argparse
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import vad  # noqa: E402
+import vad_fixtures  # noqa: E402
+
+FRAME_MS = vad_fixtures.FRAME_SAMPLES * 1000 // vad_fixtures.RATE
+
+
+class Clock:
+    """模拟的 ticks_ms, 每帧推进 FRAME_MS"""
+
+    def __init__(self):
+        self.ms = 0
+
+    def __call__(self):
+        return self.ms
+
+
+def mix(reply, user, gain, delay):
+    """麦克风信号: 延迟 delay 帧、乘 gain 的回声 + 用户说话(可为 None)"""
+    echo = memoryview(reply).cast('h')
+    shift = delay * vad_fixtures.FRAME_SAMPLES
+    n = len(echo)
+    out = array('h', bytes(n * 2))
+    speech = memoryview(user).cast('h') if user is not None else None
+    for i in range(n):
+        value = int(echo[i - shift] * gain) if i >= shift else 0
+        if speech is not None and i < len(speech):
+            value += speech[i]
+        out[i] = max(-32768, min(32767, value))
+    return out.tobytes()
+
+
+def onsets(labels):
+    """语音段开始的帧号"""
+    return [i for i, label in enumerate(labels) if label and (i == 0 or not labels[i - 1])]
+
+
+def run(reply, mic, user_labels, gate_on, coupling, barge_frames, vad_threshold):
+    clock = Clock()
+    vad.ticks_ms = clock
+    gate = vad.EchoGate(coupling)
+    barge_vad = vad.Vad(window=2, min_voice_frames=1, min_threshold=vad_threshold,
+                        hangover_frames=2)
+    ref_frames = vad_fixtures.frames(reply)
+    count = 0
+    triggers = []
+    for i, frame in enumerate(vad_fixtures.frames(mic)):
+        clock.ms = i * FRAME_MS
+        gate.reference(ref_frames[i], len(ref_frames[i]))
+        echo = gate.is_echo(frame, len(frame)) if gate_on else False
+        speaking = barge_vad.process(frame, len(frame))
+        count = count + 1 if speaking and not echo else 0
+        if count >= barge_frames:
+            triggers.append(i)
+            count = 0
+    false = sum(1 for i in triggers if not user_labels or not user_labels[i])
+    detected = 0
+    latency = 0
+    if user_labels:
+        for start in onsets(user_labels):
+            hit = next((i for i in triggers if i >= start), None)
+            end = start
+            while end < len(user_labels) and user_labels[end]:
+                end += 1
+            if hit is not None and hit < end:
+                detected += 1
+                latency += (hit - start + 1) * FRAME_MS
+    return false, detected, latency // max(1, detected)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--gains', default='0.3,0.6,1.0', help='扬声器到麦克风的回声增益')
+    parser.add_argument('--margin', type=float, default=1.5, help='coupling 相对 gain 的余量')
+    parser.add_argument('--delay', type=int, default=3, help='回声延迟的帧数')
+    parser.add_argument('--frames', type=int, default=2, help='连续多少帧算打断')
+    parser.add_argument('--threshold', type=int, default=200, help='打断用 VAD 的最低门限')
+    args = parser.parse_args()
+    fixtures = {name: (pcm, labels) for name, pcm, labels in vad_fixtures.load()}
+    reply = fixtures['quiet_room'][0]
+    user, user_labels = fixtures['typing']
+    n = min(len(reply), len(user))
+    reply, user, user_labels = reply[:n], user[:n], user_labels[:n // vad_fixtures.FRAME_BYTES]
+    segments = len(onsets(user_labels))
+
+    print(f'{"gain":>5}{"gate":>6}{"echo only: false":>18}'
+          f'{"with user: false":>18}{"detected":>10}{"latency ms":>12}')
+    for gain in (float(x) for x in args.gains.split(',')):
+        echo_only = mix(reply, None, gain, args.delay)
+        both = mix(reply, user, gain, args.delay)
+        coupling = int(gain * args.margin * 256)
+        for gate_on in (False, True):
+            false_echo, _, _ = run(reply, echo_only, None, gate_on, coupling, args.frames,
+                                   args.threshold)
+            false_user, detected, latency = run(reply, both, user_labels, gate_on, coupling,
+                                                args.frames, args.threshold)
+            gate = 'on' if gate_on else 'off'
+            print(f'{gain:>5.1f}{gate:>6}{false_echo:>18}{false_user:>18}'
+                  f'{f"{detected}/{segments}":>10}{latency:>12}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+非阻塞 I2S 输出(audio_player.PingPongI2S)的检查 (CPython)
+
+模拟事件循环里的播放任务: "网络"按几种节奏送来 1024 字节的帧
+(每帧填自己的序号), 播放任务收到就写给 I2S, 对比:
+  - blocking: 直接 i2s.write(), 和原来的 play_audio 一样
+  - pingpong: PingPongI2S.write(), 两块缓冲区都在用时丢帧
+输出 write() 的平均/最大耗时(事件循环被卡住的时间)、underrun/overrun
+次数, 并检查 I2S 收到的数据都是完整的帧、序号递增、丢帧数和 overrun 一致。
+I2S 用 fake_i2s 的替身(24kHz, ibuf 4096)。
+
+用法: python3 tools/check_i2s_sink.py [--frames 200]
+"""
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from audio_player import PingPongI2S  # noqa: E402
+from fake_i2s import FakeI2S  # noqa: E402
+
+RATE = 24000
+FRAME = 1024
+FRAME_S = FRAME / (2 * RATE)
+
+# 每帧到达间隔(相对帧时长)的生成函数
+PROFILES = {
+    'steady': lambda i: 1.0,
+    'jitter': lambda i: random.uniform(0.5, 1.5),
+    'burst': lambda i: 0.1 if i % 8 else 7.3,   # 8 帧一批
+    'fast': lambda i: 0.5,                        # 比实时快一倍, 一定会 overrun
+    'slow': lambda i: 1.3,                        # 比实时慢, 一定会 underrun
+}
+
+
+def frame_bytes(seq):
+    return struct.pack('<H', seq) * (FRAME // 2)
+
+
+def run(kind, profile, frames):
+    i2s = FakeI2S(FakeI2S.TX, RATE, keep=True)
+    sink = PingPongI2S(i2s, RATE, FRAME) if kind == 'pingpong' else None
+    times = []
+    dropped = 0
+    due = time.monotonic()
+    for seq in range(frames):
+        due += PROFILES[profile](seq) * FRAME_S
+        wait = due - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        data = frame_bytes(seq)
+        t0 = time.perf_counter()
+        if sink is None:
+            i2s.write(data)
+        elif not sink.write(data):
+            dropped += 1
+        times.append(time.perf_counter() - t0)
+    if sink is not None:
+        while sink.pending:
+            time.sleep(0.005)
+        sink.end()
+    # 检查输出: 整帧, 序号递增
+    out = i2s.written
+    ok = len(out) == (frames - dropped) * FRAME and (sink is None or sink.overruns == dropped)
+    last = -1
+    for k in range(0, len(out), FRAME):
+        seq = out[k] | out[k + 1] << 8
+        ok = ok and out[k:k + FRAME] == frame_bytes(seq) and seq > last
+        last = seq
+    underruns = sink.underruns if sink else '-'
+    overruns = sink.overruns if sink else '-'
+    return (sum(times) / len(times) * 1e6, max(times) * 1e6, underruns, overruns,
+            dropped, 'ok' if ok else 'BAD')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--frames', type=int, default=200)
+    args = parser.parse_args()
+    random.seed(1)
+
+    print(f'{"profile":<9}{"sink":<10}{"avg us":>9}{"max us":>9}{"under":>7}{"over":>6}'
+          f'{"dropped":>9}{"data":>6}')
+    for profile in PROFILES:
+        for kind in ('blocking', 'pingpong'):
+            avg, worst, under, over, dropped, ok = run(kind, profile, args.frames)
+            print(f'{profile:<9}{kind:<10}{avg:>9.0f}{worst:>9.0f}{under:>7}{over:>6}'
+                  f'{dropped:>9}{ok:>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+machine.I2S / machine.Timer 的替身 (CPython)
+
+和真实 I2S 一样按采样率的节奏阻塞:
+  - RX: readinto() 等到"采集"够一整块才返回, 数据来自给定的 PCM
+    (循环播放)或静音; 读得太慢, 积压超过内部缓冲区(ibuf)时丢掉最旧的
+    数据, 计入 overflow(字节), 和 DMA 溢出一样
+  - TX: write() 在内部缓冲区(ibuf 字节)满时等待, 按采样率"播放"掉;
+    keep=True 时保存写入的全部数据, 便于检查输出
+  - irq(handler) 之后 readinto()/write() 变成非阻塞: 立即返回, 在后台线程里
+    按上面的节奏读满/"拷进"内部缓冲区后调用 handler(i2s), 和真实 I2S 一样
+    在回调之前 buf 不能改动
+realtime=False 时不等待, 用来测吞吐量。只支持 16 位单声道。
+FakeTimer 只支持一次性/周期定时, 回调在后台线程里调用。
+"""
+import queue
+import threading
+import time
+
+
+class FakeI2S:
+    RX = 0
+    TX = 1
+    MONO = 0
+
+    def __init__(self, mode, rate=16000, data=None, ibuf=4096, realtime=True, keep=False):
+        self.mode = mode
+        self.rate = rate
+        self.data = memoryview(bytes(data or b''))
+        self.ibuf = ibuf
+        self.realtime = realtime
+        self.keep = keep
+        self.written = bytearray()
+        self.bytes = 0     # 读出/写入的总字节数
+        self.overflow = 0  # RX 溢出丢掉的字节数
+        self._pos = 0      # data 里的读取位置
+        self._start = None
+        self._handler = None
+
+    def _elapsed_bytes(self):
+        if self._start is None:
+            self._start = time.monotonic()
+        return int((time.monotonic() - self._start) * self.rate) * 2
+
+    def readinto(self, buf):
+        if self._handler is not None:
+            self._queue.put(buf)
+            return len(buf) & ~1
+        return self._readinto(buf)
+
+    def _readinto(self, buf):
+        n = len(buf) & ~1
+        if self.realtime:
+            lost = (self._elapsed_bytes() - self.bytes - self.ibuf) & ~1
+            if lost > 0:
+                self.overflow += lost
+                self.bytes += lost
+                if len(self.data):
+                    self._pos = (self._pos + lost) % len(self.data)
+            # 等到这一块的最后一个采样"采集"到
+            wait = (self.bytes + n - self._elapsed_bytes()) / (2 * self.rate)
+            if wait > 0:
+                time.sleep(wait)
+        mv = memoryview(buf)
+        data = self.data
+        if not len(data):
+            mv[:n] = bytes(n)
+        else:
+            done = 0
+            while done < n:
+                k = min(n - done, len(data) - self._pos)
+                mv[done:done + k] = data[self._pos:self._pos + k]
+                done += k
+                self._pos = (self._pos + k) % len(data)
+        self.bytes += n
+        return n
+
+    def irq(self, handler):
+        if self._handler is None:
+            self._queue = queue.Queue()
+            threading.Thread(target=self._worker, daemon=True).start()
+        self._handler = handler
+
+    def write(self, buf):
+        if self._handler is None:
+            return self._write(buf)
+        self._queue.put(buf)
+        return len(buf)
+
+    def _worker(self):
+        io = self._readinto if self.mode == self.RX else self._write
+        while True:
+            io(self._queue.get())
+            self._handler(self)
+
+    def _write(self, buf):
+        n = len(buf)
+        if self.realtime:
+            # 内部缓冲区里还没播完的数据加上这一块超过 ibuf 时等待
+            queued = self.bytes - self._elapsed_bytes()
+            if queued < 0:
+                # 缓冲区已经播空(欠载), 时钟从现在重新算
+                self._start = time.monotonic() - self.bytes / (2 * self.rate)
+                queued = 0
+            wait = (queued + n - self.ibuf) / (2 * self.rate)
+            if wait > 0:
+                time.sleep(wait)
+        if self.keep:
+            self.written += buf
+        self.bytes += n
+        return n
+
+    def deinit(self):
+        pass
+
+
+class FakeTimer:
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id=0):
+        self._cond = threading.Condition()
+        self._deadline = None
+        self._mode = self.ONE_SHOT
+        self._period = 0
+        self._callback = None
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def init(self, mode=ONE_SHOT, period=0, callback=None):
+        with self._cond:
+            self._mode = mode
+            self._period = period / 1000
+            self._callback = callback
+            self._deadline = time.monotonic() + self._period
+            self._cond.notify()
+
+    def deinit(self):
+        with self._cond:
+            self._deadline = None
+            self._cond.notify()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while self._deadline is None or time.monotonic() < self._deadline:
+                    wait = None if self._deadline is None else self._deadline - time.monotonic()
+                    self._cond.wait(wait)
+                callback = self._callback
+                if self._mode == self.PERIODIC:
+                    self._deadline += self._period
+                else:
+                    self._deadline = None
+            callback(self)
@@ -0,0 +1,131 @@
+"""
+延迟打点(latency_trace)的分段统计 (CPython)
+
+读入设备导出的 CSV(串口上 dump_trace() 的输出, 或 ws_audio_server --trace
+保存的文件; 夹杂的其他打印行会被忽略, 多次导出的重复记录只算一次),
+按轮次把事件配对, 统计每一段的延迟: 次数、最小/中位/P90/最大值和直方图。
+每段取本轮第一次出现的事件, play_last 取最后一次。
+时间是 30 位的 ticks_us, 按回绕相减。每次开机轮次从 1 重新计数,
+不同次开机的记录请分成不同的文件。
+
+用法: python3 tools/trace_histogram.py trace.csv [more.csv ...] [--bins 5,10,20,50,...]
+      (文件名为 - 时读标准输入)
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from latency_trace import EVENT_NAMES, TICKS_MASK  # noqa: E402
+
+# 名称, 起点事件, 终点事件
+STAGES = (
+    ('end_detect', 'vad_end', 'end_sent'),      # 说完到发出结束标记
+    ('server', 'end_sent', 'rx_first'),         # 服务端处理 + 网络往返
+    ('buffering', 'rx_first', 'play_first'),    # 设备上攒数据
+    ('response', 'end_sent', 'play_first'),     # 结束标记到听见回复
+    ('speech_to_audio', 'vad_end', 'play_first'),
+    ('reply', 'play_first', 'play_last'),       # 回复的播放时长
+    ('barge_stop', 'barge_in', 'end_sent'),     # 打断后说完的录音
+)
+LAST_EVENTS = ('play_last',)
+DEFAULT_BINS = '5,10,20,50,100,200,500,1000,2000,5000'
+
+
+def ticks_diff(end, start):
+    d = (end - start) & TICKS_MASK
+    return d - TICKS_MASK - 1 if d > TICKS_MASK // 2 else d
+
+
+def read_records(paths):
+    """{(文件, 轮次): {事件: [时间, ...]}}, 去掉重复记录"""
+    turns = {}
+    seen = set()
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path)
+        with f:
+            for line in f:
+                parts = line.strip().split(',')
+                if len(parts) != 4 or parts[1] not in EVENT_NAMES:
+                    continue
+                try:
+                    turn, t = int(parts[0]), int(parts[2])
+                except ValueError:
+                    continue
+                key = (path, turn, parts[1], t)
+                if key in seen:
+                    continue
+                seen.add(key)
+                turns.setdefault((path, turn), {}).setdefault(parts[1], []).append(t)
+    return turns
+
+
+def stage_latencies(turns):
+    """{阶段名: [毫秒, ...]}"""
+    result = {name: [] for name, _, _ in STAGES}
+    for events in turns.values():
+        for name, start, end in STAGES:
+            if start not in events or end not in events:
+                continue
+            t0 = events[start][0]
+            t1 = events[end][-1] if end in LAST_EVENTS else events[end][0]
+            d = ticks_diff(t1, t0)
+            if d >= 0:
+                result[name].append(d / 1000)
+    return result
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def histogram(values, bins, width=40):
+    counts = [0] * (len(bins) + 1)
+    for v in values:
+        i = 0
+        while i < len(bins) and v >= bins[i]:
+            i += 1
+        counts[i] += 1
+    peak = max(counts) or 1
+    lines = []
+    for i, count in enumerate(counts):
+        lo = 0 if i == 0 else bins[i - 1]
+        hi = f'{bins[i]:g}' if i < len(bins) else 'inf'
+        label = f'{lo:g}-{hi} ms'
+        lines.append(f'  {label:>16}{count:>6}  {"#" * (count * width // peak)}')
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('files', nargs='+', help='CSV 文件, - 为标准输入')
+    parser.add_argument('--bins', default=DEFAULT_BINS, help='直方图的分界(毫秒)')
+    parser.add_argument('--no-hist', action='store_true', help='只输出汇总表')
+    args = parser.parse_args()
+    bins = [float(x) for x in args.bins.split(',')]
+
+    turns = read_records(args.files)
+    latencies = stage_latencies(turns)
+    print(f'{len(turns)} turns')
+    print(f'{"stage":<17}{"from":<11}{"to":<11}{"n":>5}{"min":>9}{"p50":>9}{"p90":>9}{"max":>9}')
+    for name, start, end in STAGES:
+        values = latencies[name]
+        if not values:
+            print(f'{name:<17}{start:<11}{end:<11}{0:>5}')
+            continue
+        print(f'{name:<17}{start:<11}{end:<11}{len(values):>5}{min(values):>9.1f}'
+              f'{percentile(values, 50):>9.1f}{percentile(values, 90):>9.1f}{max(values):>9.1f}')
+    if args.no_hist:
+        return
+    for name, _, _ in STAGES:
+        values = latencies[name]
+        if values:
+            print()
+            print(f'{name} (ms)')
+            print('\n'.join(histogram(values, bins)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""
+VAD 测试用的带标注 PCM 样本 (CPython)
+
+按固定随机种子合成 16kHz 16位单声道音频: 背景噪声(可能中途变大
+模拟风扇/空调打开, 或周期起伏模拟摇头风扇)上叠加若干段"语音"
+(基频缓慢变化的谐波加共振峰包络, 按音节起伏), 以及键盘敲击一类的
+短促噪声。每 1024 字节一帧,
+帧内一半以上采样落在语音段里就标为语音。
+
+也可以把样本写成 wav + 标注文件, 供设备上回放或换成真实录音:
+    python3 tools/vad_fixtures.py --write fixtures/
+标注文件每行一个 0/1, 对应一帧。
+"""
+import argparse
+import math
+import os
+import random
+import struct
+import wave
+
+RATE = 16000
+FRAME_BYTES = 1024
+FRAME_SAMPLES = FRAME_BYTES // 2
+
+# 名称, 时长(秒), 基础噪声幅度, 中途噪声幅度(None 不变), 语音幅度, 敲击次数,
+# 噪声幅度的周期起伏(摇头风扇, 0 不起伏), 噪声低通系数(越大越低沉, 风扇约 0.9)
+FIXTURES = (
+    ('quiet_room', 12, 60, None, 3000, 0, 0, 0.7),
+    ('noisy_office', 12, 250, None, 2500, 6, 0, 0.7),
+    ('fan_turns_on', 14, 80, 500, 3000, 0, 0, 0.9),
+    ('soft_speech', 12, 120, None, 900, 3, 0, 0.7),
+    ('oscillating_fan', 14, 450, None, 3000, 0, 0.6, 0.9),
+    ('typing', 12, 100, None, 2500, 40, 0, 0.7),
+)
+
+
+def _speech_segments(rng, seconds):
+    """[(开始采样, 结束采样)], 每段 0.6~2.5 秒, 间隔 0.8~2.5 秒"""
+    segments = []
+    t = rng.uniform(0.8, 1.5)
+    while True:
+        length = rng.uniform(0.6, 2.5)
+        if t + length > seconds - 0.5:
+            return segments
+        segments.append((int(t * RATE), int((t + length) * RATE)))
+        t += length + rng.uniform(0.8, 2.5)
+
+
+def synthesize(seconds, noise, noise_after, speech, clicks, seed, swing=0, lowpass=0.7):
+    """返回 (pcm bytes, 每帧标注 list, 语音段)"""
+    rng = random.Random(seed)
+    n = int(seconds * RATE)
+    samples = [0.0] * n
+
+    # 背景噪声: 一阶低通的白噪声, 中途可能变大; 按低通系数补偿幅度
+    step_at = n // 2 if noise_after else n
+    gain = math.sqrt((1 + lowpass) / (1 - lowpass)) / 2.4
+    low = 0.0
+    for i in range(n):
+        low = lowpass * low + (1 - lowpass) * rng.gauss(0, 1) * gain
+        level = noise if i < step_at else noise_after
+        if swing:
+            level *= 1 + swing * math.sin(2 * math.pi * 0.25 * i / RATE)
+        samples[i] = low * level * 1.6
+
+    segments = _speech_segments(rng, seconds)
+    for start, end in segments:
+        f0 = rng.uniform(110, 220)
+        phase = 0.0
+        syllable = rng.uniform(3.5, 5.5)  # 每秒音节数
+        for i in range(start, end):
+            t = (i - start) / RATE
+            f = f0 * (1 + 0.08 * math.sin(2 * math.pi * 0.7 * t))
+            phase += 2 * math.pi * f / RATE
+            # 谐波, 第 3~5 次谐波加重, 模拟共振峰
+            value = (math.sin(phase) + 0.6 * math.sin(2 * phase) + 0.8 * math.sin(3 * phase)
+                     + 0.7 * math.sin(4 * phase) + 0.4 * math.sin(5 * phase)
+                     + 0.2 * math.sin(7 * phase))
+            envelope = 0.35 + 0.65 * abs(math.sin(math.pi * syllable * t))
+            # 起止 30ms 渐入渐出
+            fade = min(1.0, (i - start) / 480, (end - i) / 480)
+            samples[i] += value * envelope * fade * speech / 2.2
+
+    for _ in range(clicks):
+        at = rng.randrange(n - 400)
+        for i in range(at, at + 400):
+            samples[i] += rng.gauss(0, 1) * 4000 * math.exp(-(i - at) / 60)
+
+    pcm = bytearray(n * 2)
+    for i, value in enumerate(samples):
+        struct.pack_into('<h', pcm, i * 2, max(-32768, min(32767, int(value))))
+
+    labels = []
+    for frame in range(n // FRAME_SAMPLES):
+        lo, hi = frame * FRAME_SAMPLES, (frame + 1) * FRAME_SAMPLES
+        covered = sum(max(0, min(hi, end) - max(lo, start)) for start, end in segments)
+        labels.append(covered * 2 > FRAME_SAMPLES)
+    return bytes(pcm[:len(labels) * FRAME_BYTES]), labels, segments
+
+
+def load():
+    """[(名称, pcm, 每帧标注)], 按固定种子生成, 每次结果相同"""
+    fixtures = []
+    for seed, (name, *params) in enumerate(FIXTURES):
+        seconds, noise, noise_after, speech, clicks, swing, lowpass = params
+        pcm, labels, _ = synthesize(seconds, noise, noise_after, speech, clicks, seed + 1,
+                                    swing, lowpass)
+        fixtures.append((name, pcm, labels))
+    return fixtures
+
+
+def frames(pcm):
+    """按帧切分, 返回 memoryview 列表"""
+    mv = memoryview(pcm)
+    return [mv[i:i + FRAME_BYTES] for i in range(0, len(pcm) - FRAME_BYTES + 1, FRAME_BYTES)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--write', metavar='DIR', required=True, help='输出目录')
+    args = parser.parse_args()
+    os.makedirs(args.write, exist_ok=True)
+    for name, pcm, labels in load():
+        with wave.open(os.path.join(args.write, name + '.wav'), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(RATE)
+            f.writeframes(pcm)
+        with open(os.path.join(args.write, name + '.txt'), 'w') as f:
+            f.write(''.join('1\n' if label else '0\n' for label in labels))
+        print('%s: %d frames, %d speech' % (name, len(labels), sum(labels)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+"""
+本地 WebSocket 语音服务端替身 (CPython)
+
+模拟真实服务端的协议行为, 方便在电脑上调试 audio_chat_client 和做性能对比:
+  - 回复 hello 协商 (--json-only 模拟不支持二进制的旧服务端),
+    从客户端提出的上行编码里选第一个支持的 (--codecs 限定可选范围)
+  - 接收 JSON+hex 或二进制音频帧(按帧头解码), 统计音频字节数和线上字节数
+  - 收到 end_recording 后回复 status/text, 并把录到的音频按原格式回放,
+    二进制模式下按客户端 downlink_codecs 里第一个支持的编码压缩;
+    回放在单独的线程里发送(--pace 按实时的几倍速度发送), 收到 cancel
+    (客户端打断)时停止并回复 status: cancelled
+  - --trace FILE 时每次回放完向客户端要一次延迟打点(type: trace),
+    把返回的 CSV 追加到 FILE, 用 tools/trace_histogram.py 统计
+  - 客户端请求时启用 permessage-deflate (--no-deflate 关闭)
+  - --tls CERT KEY 时以 wss:// 提供服务 (可用自签名证书)
+
+用法: python3 tools/ws_audio_server.py [--port 8000] [--json-only] [--tls CERT KEY]
+                                       [--codecs pcm16 ulaw ima-adpcm] [--pace 2]
+                                       [--trace trace.csv]
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import socket
+import ssl
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import audio_codec  # noqa: E402
+import audio_proto  # noqa: E402
+import uwebsockets  # noqa: E402
+import wsdeflate  # noqa: E402
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+REPLY_CHUNK = 1024
+
+
+class CountingStream(uwebsockets.SocketStream):
+    """统计收到的线上字节数"""
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.bytes_in = 0
+
+    def read(self, n):
+        data = super().read(n)
+        self.bytes_in += len(data)
+        return data
+
+    def readinto(self, buf):
+        n = super().readinto(buf)
+        self.bytes_in += n
+        return n
+
+    def readline(self):
+        line = super().readline()
+        self.bytes_in += len(line)
+        return line
+
+
+def accept_key(key):
+    digest = hashlib.sha1((key + WS_GUID).encode('ascii')).digest()
+    return base64.b64encode(digest).decode('ascii')
+
+
+def accept_deflate(offer):
+    """接受客户端的 permessage-deflate 请求, 返回(回复头的值, 参数)"""
+    params = wsdeflate.parse_response(offer)
+    if params is None:
+        return None, None
+    accepted = [wsdeflate.EXTENSION]
+    for name in ('server_no_context_takeover', 'client_no_context_takeover'):
+        if name in params:
+            accepted.append(name)
+    if params.get('server_max_window_bits') not in (None, True):
+        accepted.append('server_max_window_bits=%s' % params['server_max_window_bits'])
+    return '; '.join(accepted), wsdeflate.parse_response('; '.join(accepted))
+
+
+def handshake(stream, deflate=True):
+    """完成服务端握手, 返回 permessage-deflate 参数(未启用时为 None)"""
+    request = stream.readline()
+    if not request.startswith(b'GET '):
+        raise ValueError('bad request: %r' % request)
+    headers = {}
+    while True:
+        line = stream.readline().strip()
+        if not line:
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    extension, params = None, None
+    if deflate and 'sec-websocket-extensions' in headers:
+        extension, params = accept_deflate(headers['sec-websocket-extensions'])
+    response = (
+        'HTTP/1.1 101 Switching Protocols\r\n'
+        'Upgrade: websocket\r\n'
+        'Connection: Upgrade\r\n'
+        'Sec-WebSocket-Accept: %s\r\n' % accept_key(headers['sec-websocket-key'])
+    )
+    if extension:
+        response += 'Sec-WebSocket-Extensions: %s\r\n' % extension
+    stream.write((response + '\r\n').encode('ascii'))
+    return params
+
+
+class Session:
+    """一个客户端连接"""
+
+    def __init__(self, sock, json_only=False, echo=True, deflate=True, codecs=None, pace=0,
+                 trace=None):
+        self.stream = CountingStream(sock)
+        self.json_only = json_only
+        self.deflate = deflate
+        self.echo = echo
+        self.binary = False
+        self.audio = bytearray()
+        self.audio_bytes = 0  # 线上的音频字节数(编码后)
+        self.pcm_bytes = 0    # 解码后的 PCM 字节数
+        self.codecs = codecs or tuple(audio_proto.CODEC_NAMES)  # 接受的上行编码
+        self.codec = audio_proto.CODEC_PCM16  # 协商选定的上行编码
+        self.downlink = audio_proto.CODEC_PCM16  # 回放用的下行编码
+        self._decoders = {}
+        self.messages = 0
+        self.sample_rate = 8000
+        self.pace = pace  # 回放速度是实时的几倍, 0 不限速
+        self.cancels = 0
+        self.trace = trace  # 保存客户端延迟打点的文件名
+        self._cancel = threading.Event()
+        self._send_lock = threading.Lock()  # 回放线程和接收线程都会发送
+
+    def run(self):
+        params = handshake(self.stream, self.deflate)
+        self.ws = uwebsockets.Websocket(self.stream)
+        if params is not None:
+            self.ws._deflate = wsdeflate.PerMessageDeflate(params, server=True)
+        while self.ws.open:
+            try:
+                message = self.ws.recv()
+            except (OSError, ValueError):
+                break
+            if message is None:
+                break
+            self.messages += 1
+            if isinstance(message, str):
+                self.on_control(json.loads(message))
+            else:
+                self.on_binary(message)
+        self.stream.close()
+
+    def on_control(self, data):
+        kind = data.get('type')
+        if kind == 'hello':
+            if self.json_only:
+                self.send_json({'type': 'error', 'message': 'unknown type: hello'})
+                return
+            self.binary = data.get('audio') == 'binary'
+            self.sample_rate = data.get('sample_rate', self.sample_rate)
+            self.codec = audio_proto.CODEC_PCM16
+            for name in data.get('codecs', ()):
+                codec = audio_proto.codec_by_name(name)
+                if codec in self.codecs:
+                    self.codec = codec
+                    break
+            self.downlink = audio_proto.CODEC_PCM16
+            for name in data.get('downlink_codecs', ()):
+                codec = audio_proto.codec_by_name(name)
+                if codec in self.codecs:
+                    self.downlink = codec
+                    break
+            self.send_json({'type': 'hello', 'audio': 'binary' if self.binary else 'json',
+                            'codec': audio_proto.CODEC_NAMES[self.codec]})
+        elif kind == 'audio':
+            chunk = bytes.fromhex(data['audio'])
+            self.audio_bytes += len(chunk)
+            self.pcm_bytes += len(chunk)
+            if self.echo:
+                self.audio += chunk
+        elif kind == 'end_recording':
+            self.send_json({'type': 'status', 'message': 'received %d bytes' % len(self.audio)})
+            self.send_json({'type': 'text', 'text': 'echo'})
+            if self.echo:
+                self._cancel.clear()
+                threading.Thread(target=self.reply_audio, args=(self.audio,),
+                                 daemon=True).start()
+            self.audio = bytearray()
+        elif kind == 'cancel':
+            self.cancels += 1
+            self._cancel.set()
+            self.send_json({'type': 'status', 'message': 'cancelled'})
+        elif kind == 'trace':
+            if self.trace:
+                with open(self.trace, 'a') as f:
+                    f.write(data['csv'] + '\n')
+
+    def on_binary(self, frame):
+        msg_type, codec, sequence, sample_rate = audio_proto.unpack_header(frame)
+        if msg_type == audio_proto.MSG_AUDIO:
+            payload = memoryview(frame)[audio_proto.HEADER_SIZE:]
+            self.audio_bytes += len(payload)
+            decoder = self._decoders.get(codec)
+            if decoder is None:
+                decoder = self._decoders[codec] = audio_codec.get(codec)
+            pcm = bytearray(decoder.decoded_size(len(payload)))
+            n = decoder.decode(payload, len(payload), pcm)
+            self.pcm_bytes += n
+            if self.echo:
+                self.audio += pcm[:n]
+
+    def reply_audio(self, audio):
+        header = audio_proto.HEADER_SIZE
+        packet = bytearray(header + REPLY_CHUNK)
+        encoder = audio_codec.get(self.downlink)
+        t0 = time.monotonic()
+        for seq, i in enumerate(range(0, len(audio), REPLY_CHUNK)):
+            if self._cancel.is_set():
+                break
+            chunk = audio[i:i + REPLY_CHUNK]
+            try:
+                if self.binary:
+                    # 每个消息一块, ADPCM 块不跨消息
+                    audio_proto.pack_header(packet, audio_proto.MSG_AUDIO, seq, self.sample_rate,
+                                            encoder.codec)
+                    n = encoder.encode(chunk, len(chunk), memoryview(packet)[header:])
+                    with self._send_lock:
+                        self.ws.send_into(packet, 0, header + n)
+                else:
+                    self.send_json({'type': 'audio', 'audio': chunk.hex()})
+            except OSError:
+                break
+            if self.pace:
+                wait = t0 + (i + len(chunk)) / (2 * self.sample_rate * self.pace) - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+        else:
+            if self.trace:
+                # 客户端播完这段回复之后再取打点, 才有 play_last
+                time.sleep(len(audio) / (2 * self.sample_rate) + 1)
+                try:
+                    self.send_json({'type': 'trace'})
+                except OSError:
+                    pass
+
+    def send_json(self, data):
+        with self._send_lock:
+            self.ws.send(json.dumps(data))
+
+
+def tls_context(cert, key):
+    """服务端 TLS 上下文, 允许会话恢复(session ticket)"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+def serve(port=8000, host='0.0.0.0', json_only=False, echo=True, on_session=None,
+          deflate=True, tls=None, codecs=None, pace=0, trace=None):
+    """阻塞运行服务端, 每个连接一个线程; on_session 在会话结束后回调, tls 为 SSLContext 时走 wss"""
+    server = socket.socket()
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen(4)
+
+    def handle(sock):
+        if tls is not None:
+            try:
+                sock = tls.wrap_socket(sock, server_side=True)
+            except (OSError, ssl.SSLError):
+                sock.close()
+                return
+        session = Session(sock, json_only, echo, deflate, codecs, pace, trace)
+        try:
+            session.run()
+        finally:
+            if on_session:
+                on_session(session)
+
+    while True:
+        sock, addr = server.accept()
+        threading.Thread(target=handle, args=(sock,), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--json-only', action='store_true', help='模拟不支持二进制音频的旧服务端')
+    parser.add_argument('--no-deflate', action='store_true', help='不接受 permessage-deflate')
+    parser.add_argument('--tls', nargs=2, metavar=('CERT', 'KEY'), help='证书和私钥, 启用 wss://')
+    parser.add_argument('--codecs', nargs='+', choices=list(audio_proto.CODEC_NAMES.values()),
+                        help='接受的上行编码, 默认全部')
+    parser.add_argument('--pace', type=float, default=0,
+                        help='回放速度是实时的几倍(模拟流式回复, 方便测试打断), 默认不限速')
+    parser.add_argument('--trace', metavar='FILE', help='每次回放后取回客户端的延迟打点, 追加到 FILE')
+    args = parser.parse_args()
+
+    def report(session):
+        print('session closed: %d messages, %d audio bytes (%d pcm), %d wire bytes '
+              '(%s, up %s, down %s), %d cancels' % (
+                  session.messages, session.audio_bytes, session.pcm_bytes,
+                  session.stream.bytes_in, 'binary' if session.binary else 'json',
+                  audio_proto.CODEC_NAMES[session.codec],
+                  audio_proto.CODEC_NAMES[session.downlink], session.cancels))
+
+    tls = tls_context(*args.tls) if args.tls else None
+    print('listening on %s://0.0.0.0:%d/ws' % ('wss' if tls else 'ws', args.port))
+    codecs = [audio_proto.codec_by_name(name) for name in args.codecs] if args.codecs else None
+    serve(args.port, json_only=args.json_only, on_session=report,
+          deflate=not args.no_deflate, tls=tls, codecs=codecs, pace=args.pace,
+          trace=args.trace)
+
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,34 @@ Based very heavily on
 https://github.com/aaugustin/websockets/blob/master/websockets/client.py
 """
 
-import ubinascii as binascii
-import urandom as random
-import ure as re
-import ustruct as struct
-import usocket as socket
-from ucollections import namedtuple
+import binascii
+import hashlib
+import random
+import re
+import struct
+import socket
+from array import array
+from collections import namedtuple
+
+try:
+    from micropython import const
+except ImportError:  # CPython, for host-side tools
+    def const(x):
+        return x
+
+try:
+    import ssl
+except ImportError:  # port built without TLS
+    ssl = None
+
+try:
+    from _thread import allocate_lock
+except ImportError:  # port without threads
+    allocate_lock = None
+
+from myutil import ticks_ms, ticks_us, ticks_diff
+from wsmask import mask as apply_mask
+import wsdeflate
 
 # Opcodes
 OP_CONT = const(0x0)
@@ -31,22 +53,158 @@ CLOSE_TOO_BIG = const(1009)
 CLOSE_MISSING_EXTN = const(1010)
 CLOSE_BAD_CONDITION = const(1011)
 
-URL_RE = re.compile(r'ws://([A-Za-z0-9\-\.]+)(?:\:([0-9]+))?(/.+)?')
-URI = namedtuple('URI', ('hostname', 'port', 'path'))
+# Number of recent ping round trips kept for rtt_stats()
+RTT_SAMPLES = const(32)
+
+# Outstanding pings whose pongs are still matched (and timed)
+PING_SLOTS = const(8)
+
+# Largest handshake response we accept
+HANDSHAKE_MAX = const(1024)
+
+WS_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+# Resolved server addresses, (host, port) -> (addrinfo, expiry ticks_ms)
+_dns_cache = {}
+
+URL_RE = re.compile(r'(wss?)://([A-Za-z0-9\-\.]+)(?:\:([0-9]+))?(/.*)?')
+URI = namedtuple('URI', ('hostname', 'port', 'path', 'secure'))
+
+def parse_header(header):
+    """
+    Decode the first two bytes of a frame into (fin, opcode, mask, length),
+    where length may still be one of the 126/127 magic values.
+    """
+    byte1, byte2 = struct.unpack('!BB', header)
+
+    # Byte 1: FIN(1) _(1) _(1) _(1) OPCODE(4)
+    fin = bool(byte1 & 0x80)
+    opcode = byte1 & 0x0f
+
+    # Byte 2: MASK(1) LENGTH(7)
+    mask = bool(byte2 & (1 << 7))
+    length = byte2 & 0x7f
+
+    return fin, opcode, mask, length
+
+def handshake_request(uri, extensions=None):
+    """
+    Build the HTTP upgrade request for a parsed URI, optionally offering
+    extensions. Returns (request bytes, Sec-WebSocket-Key).
+    """
+    # Sec-WebSocket-Key is 16 bytes of random base64 encoded
+    key = binascii.b2a_base64(bytes(random.getrandbits(8)
+                                    for _ in range(16)))[:-1]
+
+    lines = (
+        'GET %s HTTP/1.1' % (uri.path or '/'),
+        'Host: %s:%s' % (uri.hostname, uri.port),
+        'Connection: Upgrade',
+        'Upgrade: websocket',
+        'Sec-WebSocket-Key: %s' % key.decode('utf-8'),
+        'Sec-WebSocket-Version: 13',
+        'Origin: http://localhost',
+    )
+    if extensions:
+        lines += ('Sec-WebSocket-Extensions: %s' % extensions,)
+    lines += ('', '')
+    return '\r\n'.join(lines).encode('utf-8'), key
 
 def urlparse(uri):
     match = URL_RE.match(uri)
     if match:
-        return URI(match.group(1), int(match.group(2)), match.group(3))
+        secure = match.group(1) == 'wss'
+        port = match.group(3)
+        return URI(match.group(2), int(port) if port else (443 if secure else 80),
+                   match.group(4), secure)
     else:
         raise ValueError("Invalid URL: %s" % uri)
 
+def accept_key(key):
+    """Sec-WebSocket-Accept the server must answer for our key."""
+    return binascii.b2a_base64(hashlib.sha1(key + WS_GUID).digest())[:-1]
+
+def check_response(head, key):
+    """
+    Validate a handshake response head (status line and headers, without
+    the blank line) against our key. Returns the headers as a dict with
+    lower-case names; raises ValueError if the upgrade was refused.
+    """
+    lines = head.split(b'\r\n')
+    status = lines[0].split(b' ')
+    if len(status) < 2 or status[1] != b'101':
+        raise ValueError('Handshake refused: %s' % lines[0])
+
+    headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(b':')
+        headers[name.strip().lower()] = value.strip()
+
+    if headers.get(b'sec-websocket-accept') != accept_key(key):
+        raise ValueError('Bad Sec-WebSocket-Accept')
+    return headers
+
+def resolve(hostname, port, ttl_ms=0):
+    """
+    getaddrinfo() for a TCP connection, cached for ttl_ms so reconnects
+    skip the DNS round trip.
+    """
+    key = (hostname, port)
+    entry = _dns_cache.get(key)
+    now = ticks_ms()
+    if entry and ticks_diff(entry[1], now) > 0:
+        return entry[0]
+    addrinfo = socket.getaddrinfo(hostname, port, 0, socket.SOCK_STREAM)[0]
+    if ttl_ms:
+        _dns_cache[key] = (addrinfo, now + ttl_ms)
+    return addrinfo
+
+def forget(hostname, port):
+    """Drop a cached address, e.g. after connecting to it failed."""
+    _dns_cache.pop((hostname, port), None)
+
+def settimeout(sock, raw, timeout):
+    """
+    Set a timeout on sock, or on the raw socket under it: micropython's
+    TLS sockets leave timeouts to the socket below.
+    """
+    (sock if hasattr(sock, 'settimeout') else raw).settimeout(timeout)
+
 class Websocket:
     is_client = False
 
-    def __init__(self, sock):
+    def __init__(self, sock, raw=None):
         self._sock = sock
+        self._raw = raw or sock  # plain socket under a TLS stream
         self.open = True
+        self._frame_buf = bytearray(0)
+        self._frag_opcode = None  # opcode of a message still being received
+        # recv_into() position inside the current frame
+        self._rx_remaining = 0
+        self._rx_opcode = None
+        self._rx_fin = True
+        self._rx_mask = None
+        self._rx_phase = 0
+        # Decompressed message recv_into() is handing out
+        self._rx_pending = None
+        # permessage-deflate state, set by connect() when negotiated
+        self._deflate = None
+        self._frame_rsv1 = False
+        # Frames may be written from several threads (sender, receiver
+        # answering pings, keepalive), never interleave them
+        self._write_lock = allocate_lock() if allocate_lock else None
+        # Keepalive, disabled until set_keepalive()
+        self.ping_interval = 0
+        self.max_missed_pongs = 0
+        self.missed_pongs = 0  # pings sent since the peer last answered
+        self._ping_seq = 0
+        self._ping_payload = bytearray(4)
+        # send time of each outstanding ping, by seq % PING_SLOTS
+        self._ping_seqs = array('I', [0] * PING_SLOTS)
+        self._ping_sent = array('I', [0] * PING_SLOTS)
+        self._last_ping = 0
+        self._rtt = array('I', [0] * RTT_SAMPLES)
+        self._rtt_count = 0
 
     def __enter__(self):
         return self
@@ -55,20 +213,30 @@ class Websocket:
         self.close()
 
     def settimeout(self, timeout):
-        self._sock.settimeout(timeout)
+        settimeout(self._sock, self._raw, timeout)
 
     def read_frame(self, max_size=None):
 
-        # Frame header
-        byte1, byte2 = struct.unpack('!BB', self._sock.read(2))
+        fin, opcode, length, mask_bits = self._read_header()
 
-        # Byte 1: FIN(1) _(1) _(1) _(1) OPCODE(4)
-        fin = bool(byte1 & 0x80)
-        opcode = byte1 & 0x0f
+        try:
+            data = self._read_payload(length, mask_bits)
+        except MemoryError:
+            # We can't receive this many bytes, close the socket
+            self.close(code=CLOSE_TOO_BIG)
+            return True, OP_CLOSE, None
 
-        # Byte 2: MASK(1) LENGTH(7)
-        mask = bool(byte2 & (1 << 7))
-        length = byte2 & 0x7f
+        return fin, opcode, data
+
+    def _read_header(self):
+
+        # Frame header
+        header = self._sock.read(2)
+        fin, opcode, mask, length = parse_header(header)
+        # Anything from the peer answers the pings sent so far
+        self.missed_pongs = 0
+        # RSV1 on the first frame marks a compressed message
+        self._frame_rsv1 = bool(header[0] & 0x40)
 
         if length == 126:  # Magic number, length header is 2 bytes
             length, = struct.unpack('!H', self._sock.read(2))
@@ -77,62 +245,143 @@ class Websocket:
 
         if mask:  # Mask is 4 bytes
             mask_bits = self._sock.read(4)
-
+        else:
+            mask_bits = None
+
+        return fin, opcode, length, mask_bits
+
+    def _read_payload(self, length, mask_bits):
+        if mask_bits:
+            # Unmask in place, no second copy of the payload
+            data = bytearray(length)
+            mv = memoryview(data)
+            got = 0
+            while got < length:
+                n = self._sock.readinto(mv[got:])
+                if not n:
+                    raise ValueError('Connection closed inside a frame')
+                got += n
+            apply_mask(data, mask_bits)
+            return data
+        data = self._sock.read(length)
+        if len(data) < length:
+            raise ValueError('Connection closed inside a frame')
+        return data
+
+    def _get_frame_buf(self, size):
+        # Reused between frames so steady streaming does not allocate
+        if len(self._frame_buf) < size:
+            self._frame_buf = bytearray(size)
+        return self._frame_buf
+
+    def write_frame(self, opcode, data=b'', offset=0, length=None, rsv1=False):
+        lock = self._write_lock
+        if lock:
+            lock.acquire()
         try:
-            data = self._sock.read(length)
-        except MemoryError:
-            # We can't receive this many bytes, close the socket
-            self.close(code=CLOSE_TOO_BIG)
-            return True, OP_CLOSE, None
-
-        if mask:
-            data = bytes(b ^ mask_bits[i % 4]
-                         for i, b in enumerate(data))
-
-        return fin, opcode, data
+            self._sock.write(self._build_frame(opcode, data, offset, length,
+                                               rsv1))
+        finally:
+            if lock:
+                lock.release()
 
-    def write_frame(self, opcode, data=b''):
+    def _build_frame(self, opcode, data, offset=0, length=None, rsv1=False):
 
         fin = True
         mask = self.is_client  # messages sent by client are masked
 
-        length = len(data)
+        # Lengths count bytes, also for wider arrays (e.g. array('h') PCM)
+        data = memoryview(data)
+        if getattr(data, 'itemsize', 1) != 1:
+            if not hasattr(data, 'cast'):
+                raise TypeError('payload must be bytes-like')
+            data = data.cast('B')
+
+        if length is None:
+            length = len(data) - offset
+        if offset < 0 or length < 0 or offset + length > len(data):
+            raise ValueError('payload range out of bounds')
 
         # Frame header
         # Byte 1: FIN(1) _(1) _(1) _(1) OPCODE(4)
         byte1 = 0x80 if fin else 0
         byte1 |= opcode
+        if rsv1:
+            byte1 |= 0x40  # Compressed (permessage-deflate)
 
         # Byte 2: MASK(1) LENGTH(7)
         byte2 = 0x80 if mask else 0
 
         if length < 126:  # 126 is magic value to use 2-byte length header
             byte2 |= length
-            self._sock.write(struct.pack('!BB', byte1, byte2))
+            header_len = 2
 
         elif length < (1 << 16):  # Length fits in 2-bytes
             byte2 |= 126  # Magic code
-            self._sock.write(struct.pack('!BBH', byte1, byte2, length))
+            header_len = 4
 
         elif length < (1 << 64):
             byte2 |= 127  # Magic code
-            self._sock.write(struct.pack('!BBQ', byte1, byte2, length))
+            header_len = 10
 
         else:
             raise ValueError()
 
-        if mask:  # Mask is 4 bytes
-            mask_bits = struct.pack('!I', random.getrandbits(32))
-            self._sock.write(mask_bits)
+        payload_start = header_len + 4 if mask else header_len
+        frame_len = payload_start + length
 
-            data = bytes(b ^ mask_bits[i % 4]
-                         for i, b in enumerate(data))
+        # Header and payload go out in a single write from the reusable
+        # frame buffer; the caller's buffer is only read, never copied
+        # into a temporary object.
+        buf = self._get_frame_buf(frame_len)
+        struct.pack_into('!BB', buf, 0, byte1, byte2)
+        if header_len == 4:
+            struct.pack_into('!H', buf, 2, length)
+        elif header_len == 10:
+            struct.pack_into('!Q', buf, 2, length)
 
-        self._sock.write(data)
+        buf[payload_start:frame_len] = data[offset:offset + length]
+
+        if mask:  # Mask is 4 bytes
+            struct.pack_into('!I', buf, header_len, random.getrandbits(32))
+            apply_mask(buf, buf[header_len:payload_start],
+                       payload_start, frame_len)
+
+        return memoryview(buf)[:frame_len]
 
     def recv(self):
         assert self.open
 
+        opcode = None
+        message = None
+        for opcode, data in self.recv_stream():
+            if message is None:
+                message = data
+            else:
+                # Fragmented message, reassemble it
+                if not isinstance(message, bytearray):
+                    message = bytearray(message)
+                message += data
+
+        if message is None:
+            return
+        if opcode == OP_TEXT:
+            return message.decode('utf-8')
+        return message
+
+    def recv_stream(self):
+        """
+        Iterate over the next data message as its frames arrive.
+
+        Yields (opcode, data) once per frame of the message, where opcode
+        is the message's OP_TEXT or OP_BYTES (also for continuation
+        frames), and stops after the final fragment. Text is yielded as
+        raw UTF-8, which may be split mid-character. Control frames in
+        between are handled as in recv(). Consume it to the end before
+        reading again. A compressed message is yielded once, whole.
+        """
+        assert self.open
+
         while self.open:
             try:
                 fin, opcode, data = self.read_frame()
@@ -140,29 +389,244 @@ class Websocket:
                 self._close()
                 return
 
-            if not fin:
-                raise NotImplementedError()
+            if opcode & 0x08:
+                self._handle_control(opcode, data)
+                continue
 
-            if opcode == OP_TEXT:
-                return data.decode('utf-8')
-            elif opcode == OP_BYTES:
-                return data
-            elif opcode == OP_CLOSE:
-                self._close()
+            opcode = self._message_opcode(fin, opcode)
+            if opcode is None:
+                self.close(code=CLOSE_PROTOCOL_ERROR)
+                return
+
+            if self._frame_rsv1 and self._deflate:
+                data = self._inflate_message(fin, data)
+                if data is not None:
+                    yield opcode, data
                 return
-            elif opcode == OP_PONG:
-                # Ignore this frame, keep waiting for a data frame
+
+            yield opcode, data
+            if fin:
+                return
+
+    def recv_into(self, buf):
+        """
+        Read the next part of a data message directly into buf.
+
+        At most len(buf) bytes are read from the socket per call, so a
+        message of any length passes through a fixed-size buffer (for
+        example a free region of a ring buffer). Returns
+        (nbytes, opcode, done): buf[:nbytes] holds payload of a message
+        with the given opcode, and done is True once its last byte has
+        been returned. Returns (0, None, True) when the connection closed.
+        Don't mix with recv()/recv_stream() in the middle of a message.
+        Compressed messages are inflated whole, then handed out in slices.
+        """
+        assert self.open
+
+        mv = memoryview(buf)
+        while not self._rx_remaining and self._rx_pending is None:
+            if not self.open:
+                return 0, None, True
+            try:
+                fin, opcode, length, mask_bits = self._read_header()
+                if opcode & 0x08 or (self._frame_rsv1 and self._deflate):
+                    # Control frames are at most 125 bytes, compressed
+                    # messages are inflated whole
+                    payload = self._read_payload(length, mask_bits)
+            except ValueError:
+                self._close()
+                return 0, None, True
+
+            if opcode & 0x08:
+                self._handle_control(opcode, payload)
                 continue
-            elif opcode == OP_PING:
-                # We need to send a pong frame
-                self.write_frame(OP_PONG, data)
-                # And then wait to receive
+
+            opcode = self._message_opcode(fin, opcode)
+            if opcode is None:
+                self.close(code=CLOSE_PROTOCOL_ERROR)
+                return 0, None, True
+
+            self._rx_opcode = opcode
+            if self._frame_rsv1 and self._deflate:
+                data = self._inflate_message(fin, payload)
+                if data is None:
+                    return 0, None, True
+                self._rx_pending = memoryview(data)
+                break
+
+            self._rx_fin = fin
+            self._rx_mask = mask_bits
+            self._rx_phase = 0
+            self._rx_remaining = length
+            if not length and fin:
+                return 0, opcode, True
+
+        pending = self._rx_pending
+        if pending is not None:
+            n = min(len(mv), len(pending))
+            mv[:n] = pending[:n]
+            pending = pending[n:]
+            self._rx_pending = pending if len(pending) else None
+            return n, self._rx_opcode, self._rx_pending is None
+
+        # A short read returns what arrived; the rest of the frame comes
+        # with the next call
+        n = self._sock.readinto(mv[:min(len(mv), self._rx_remaining)])
+        if not n:
+            self._close()
+            return 0, None, True
+        self.missed_pongs = 0
+        if self._rx_mask:
+            apply_mask(mv, self._rx_mask, 0, n, self._rx_phase)
+            self._rx_phase = (self._rx_phase + n) & 3
+        self._rx_remaining -= n
+
+        return n, self._rx_opcode, self._rx_fin and not self._rx_remaining
+
+    def _inflate_message(self, fin, data):
+        # Collect the rest of a compressed message and inflate it whole.
+        # Returns None if the connection closed on the way.
+        message = data
+        while not fin:
+            try:
+                fin, opcode, data = self.read_frame()
+            except ValueError:
+                self._close()
+                return None
+
+            if opcode & 0x08:
+                self._handle_control(opcode, data)
+                if not self.open:
+                    return None
                 continue
-            elif opcode == OP_CONT:
-                # This is a continuation of a previous frame
-                raise NotImplementedError(opcode)
-            else:
-                raise ValueError(opcode)
+
+            if self._message_opcode(fin, opcode) is None:
+                self.close(code=CLOSE_PROTOCOL_ERROR)
+                return None
+
+            if not isinstance(message, bytearray):
+                message = bytearray(message)
+            message += data
+
+        return self._deflate.decompress(message)
+
+    def _message_opcode(self, fin, opcode):
+        # Track fragmentation, returns the opcode of the message this data
+        # frame belongs to, or None on a protocol error
+        if opcode == OP_CONT:
+            # This is a continuation of a previous frame
+            if self._frag_opcode is None:
+                return None
+            opcode = self._frag_opcode
+        elif opcode == OP_TEXT or opcode == OP_BYTES:
+            if self._frag_opcode is not None:
+                # A new message before the last one finished
+                return None
+        else:
+            raise ValueError(opcode)
+
+        self._frag_opcode = None if fin else opcode
+        return opcode
+
+    def _handle_control(self, opcode, data):
+        if opcode == OP_CLOSE:
+            self._close()
+        elif opcode == OP_PONG:
+            # Only used for keepalive, keep waiting for a data frame
+            self._on_pong(data)
+        elif opcode == OP_PING:
+            # We need to send a pong frame
+            self.write_frame(OP_PONG, data)
+        else:
+            raise ValueError(opcode)
+
+    def set_keepalive(self, interval_ms, max_missed=2):
+        """
+        Ping the peer every interval_ms (0 disables) once keepalive() is
+        being called; after max_missed pings without any answer it is
+        dead. A pong or any other frame from the peer counts as an answer,
+        so a dead link is found within about max_missed * interval_ms.
+        The reader must keep reading meanwhile (frames queued behind data
+        it does not read can't answer).
+        """
+        self.ping_interval = interval_ms
+        self.max_missed_pongs = max_missed
+        self.missed_pongs = 0
+        self._last_ping = ticks_ms()
+
+    def keepalive(self):
+        """
+        Drive keepalive pings. Call it often (from a monitor thread or
+        timer), at least every ping interval. Returns False once the
+        peer missed too many pongs; the socket is closed then, which
+        also wakes a recv() blocked in another thread.
+        """
+        due = self._keepalive_due()
+        if due is None:
+            return self.open
+        if not due:
+            self._close()
+            return False
+        self.ping()
+        return True
+
+    def ping(self):
+        """Send a keepalive ping; its pong is timed for rtt_stats()."""
+        self.write_frame(OP_PING, self._next_ping())
+
+    def rtt_stats(self):
+        """
+        Round trip times of the recent pings as a dict with min_ms,
+        avg_ms and p95_ms, plus total pongs and pings sent since the
+        peer last answered.
+        None until the first pong.
+        """
+        n = min(self._rtt_count, RTT_SAMPLES)
+        if not n:
+            return None
+        samples = sorted(self._rtt[:n])
+        return {
+            'min_ms': samples[0] / 1000,
+            'avg_ms': sum(samples) / n / 1000,
+            'p95_ms': samples[(n * 95 + 99) // 100 - 1] / 1000,
+            'count': self._rtt_count,
+            'missed': self.missed_pongs,
+        }
+
+    def _keepalive_due(self):
+        # None: nothing to do, True: send a ping now, False: peer is dead
+        if not self.open or not self.ping_interval:
+            return None
+        if ticks_diff(ticks_ms(), self._last_ping) < self.ping_interval:
+            return None
+        # Every ping sent so far had at least an interval to be answered
+        return self.missed_pongs < self.max_missed_pongs
+
+    def _next_ping(self):
+        seq = (self._ping_seq + 1) & 0xffffffff or 1  # 0 marks a free slot
+        self._ping_seq = seq
+        struct.pack_into('!I', self._ping_payload, 0, seq)
+        slot = seq % PING_SLOTS
+        self._ping_seqs[slot] = seq
+        self._ping_sent[slot] = ticks_us() & 0x3fffffff
+        self._last_ping = ticks_ms()
+        self.missed_pongs += 1
+        return self._ping_payload
+
+    def _on_pong(self, data):
+        # Any pong of a ping still in its slot is timed; unsolicited ones
+        # still count as an answer (see _read_header)
+        if len(data) != 4:
+            return
+        seq = struct.unpack('!I', data)[0]
+        slot = seq % PING_SLOTS
+        if not seq or self._ping_seqs[slot] != seq:
+            return
+        self._ping_seqs[slot] = 0
+        rtt = ticks_diff(ticks_us() & 0x3fffffff, self._ping_sent[slot]) & 0x3fffffff
+        self._rtt[self._rtt_count % RTT_SAMPLES] = rtt
+        self._rtt_count += 1
+        self.missed_pongs = 0
 
     def send(self, buf):
 
@@ -171,13 +635,36 @@ class Websocket:
         if isinstance(buf, str):
             opcode = OP_TEXT
             buf = buf.encode('utf-8')
-        elif isinstance(buf, bytes):
+        elif isinstance(buf, (bytes, bytearray, memoryview)):
             opcode = OP_BYTES
         else:
             raise TypeError()
 
+        # Only text is compressed, PCM audio hardly shrinks
+        if opcode == OP_TEXT and self._deflate:
+            compressed = self._deflate.compress(buf)
+            if compressed is not None:
+                self.write_frame(opcode, compressed, rsv1=True)
+                return
+
         self.write_frame(opcode, buf)
 
+    def send_into(self, buf, offset=0, length=None, opcode=OP_BYTES):
+        """
+        Send buf[offset:offset + length] as one frame without slicing it.
+
+        buf is any buffer; offset and length count bytes, also for wider
+        arrays (e.g. array('h')), which are viewed as bytes where
+        memoryview supports cast() and rejected where it reports an
+        itemsize but cannot cast. A range past the end of buf raises
+        ValueError. The payload is copied straight into the reusable
+        frame buffer.
+        """
+
+        assert self.open
+
+        self.write_frame(opcode, buf, offset, length)
+
     def close(self, code=CLOSE_OK, reason=''):
 
         if not self.open:
@@ -196,40 +683,212 @@ class WebsocketClient(Websocket):
     is_client = True
 
 
-def connect(uri):
+class SocketStream:
     """
-    Connect a websocket.
+    Give a CPython socket the micropython stream methods used here
+    (read/readinto/readline/write), so the same code runs on the host.
     """
 
-    uri = urlparse(uri)
-    assert uri
+    def __init__(self, sock):
+        self._sock = sock
+        self._file = sock.makefile('rb')
 
-    sock = socket.socket()
-    addr = socket.getaddrinfo(uri.hostname, uri.port)
-    sock.connect(addr[0][4])
+    def read(self, n):
+        return self._file.read(n)
 
-    def send_header(header, *args):
-        sock.send(header % args + '\r\n')
+    def readinto(self, buf):
+        return self._file.readinto(buf)
 
-    # Sec-WebSocket-Key is 16 bytes of random base64 encoded
-    key = binascii.b2a_base64(bytes(random.getrandbits(8)
-                                    for _ in range(16)))[:-1]
+    def readline(self):
+        return self._file.readline()
+
+    def recv(self, n):
+        return self._sock.recv(n)
+
+    def write(self, buf):
+        self._sock.sendall(buf)
+        return len(buf)
+
+    def settimeout(self, timeout):
+        self._sock.settimeout(timeout)
+
+    def close(self):
+        self._file.close()
+        self._sock.close()
+
+
+class PrefixedStream:
+    """
+    Socket stream that first returns bytes already received past the
+    handshake response (a frame the server sent right away).
+    """
+
+    def __init__(self, sock, prefix, raw=None):
+        self._sock = sock
+        self._prefix = prefix
+        self._raw = raw or sock
+
+    def read(self, n):
+        prefix = self._prefix
+        if not prefix:
+            return self._sock.read(n)
+        data = prefix[:n]
+        self._prefix = prefix[n:]
+        if len(data) < n:
+            data += self._sock.read(n - len(data))
+        return data
+
+    def readinto(self, buf):
+        prefix = self._prefix
+        if not prefix:
+            return self._sock.readinto(buf)
+        n = min(len(buf), len(prefix))
+        buf[:n] = prefix[:n]
+        self._prefix = prefix[n:]
+        if n < len(buf):
+            n += self._sock.readinto(memoryview(buf)[n:])
+        return n
+
+    def write(self, buf):
+        return self._sock.write(buf)
 
-    send_header(b'GET %s HTTP/1.1', uri.path or '/')
-    send_header(b'Host: %s:%s', uri.hostname, uri.port)
-    send_header(b'Connection: Upgrade')
-    send_header(b'Upgrade: websocket')
-    send_header(b'Sec-WebSocket-Key: %s', key)
-    send_header(b'Sec-WebSocket-Version: 13')
-    send_header(b'Origin: http://localhost')
-    send_header(b'')
+    def settimeout(self, timeout):
+        settimeout(self._sock, self._raw, timeout)
+
+    def close(self):
+        self._sock.close()
 
-    header = sock.readline()[:-2]
-    assert header == b'HTTP/1.1 101 Switching Protocols', header
 
-    # We don't (currently) need these headers
-    # FIXME: should we check the return key?
-    while header:
-        header = sock.readline()[:-2]
+class Connector:
+    """
+    Connection settings for one server, reused by every reconnect: the
+    parsed URI, a DNS cache entry with a TTL and a connect timeout, so
+    reconnecting costs the TCP handshake plus a single HTTP round trip.
 
-    return WebsocketClient(sock)
\ No newline at end of file
+    For wss:// URIs the TLS session of the last connection is offered
+    again on reconnect (where the ssl module supports it), so the server
+    can resume it instead of running a full key exchange.
+    """
+
+    def __init__(self, uri, compress=False, context_takeover=False,
+                 timeout=5, dns_ttl=300, ssl_context=None):
+        self.uri = urlparse(uri)
+        self.compress = compress
+        self.context_takeover = context_takeover
+        self.timeout = timeout  # seconds, for TCP connect and handshake
+        self.dns_ttl = dns_ttl  # seconds
+        self.ssl_context = ssl_context
+        self.handshake_ms = 0  # duration of the last successful connect
+        self.tls_ms = 0  # part of it spent in the TLS handshake
+        self.tls_resumed = False  # whether the last TLS session was resumed
+        self._tls_session = None
+
+    def connect(self):
+        uri = self.uri
+        started = ticks_ms()
+        family, type_, proto, _, addr = resolve(uri.hostname, uri.port,
+                                                self.dns_ttl * 1000)
+        sock = raw = socket.socket(family, type_, proto)
+        try:
+            sock.settimeout(self.timeout)
+            sock.connect(addr)
+            tls = None
+            if uri.secure:
+                tls_started = ticks_ms()
+                sock = tls = self._wrap(sock)
+                self.tls_ms = ticks_diff(ticks_ms(), tls_started)
+            if not hasattr(sock, 'readinto'):
+                sock = SocketStream(sock)
+            ws = self._handshake(sock, raw)
+            settimeout(sock, raw, None)
+        except Exception:
+            sock.close()
+            # The server may have moved, resolve again next time
+            forget(uri.hostname, uri.port)
+            self._tls_session = None
+            raise
+        if tls is not None:
+            # Taken after the HTTP exchange: TLS 1.3 servers send their
+            # session ticket after the handshake proper
+            self._tls_session = getattr(tls, 'session', None)
+            self.tls_resumed = getattr(tls, 'session_reused', False)
+        self.handshake_ms = ticks_diff(ticks_ms(), started)
+        return ws
+
+    def _wrap(self, sock):
+        if ssl is None:
+            raise OSError('This port has no TLS support')
+        context = self.ssl_context
+        if context is None:
+            if hasattr(ssl, 'create_default_context'):  # CPython
+                context = ssl.create_default_context()
+            elif hasattr(ssl, 'SSLContext'):
+                context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+            else:  # micropython < 1.23
+                return ssl.wrap_socket(sock, server_hostname=self.uri.hostname)
+            self.ssl_context = context
+        if self._tls_session is not None:
+            return context.wrap_socket(sock, server_hostname=self.uri.hostname,
+                                       session=self._tls_session)
+        return context.wrap_socket(sock, server_hostname=self.uri.hostname)
+
+    def reconnect(self, ws=None):
+        """Drop ws (if still open) and connect again."""
+        if ws is not None and ws.open:
+            try:
+                ws._close()
+            except OSError:
+                pass
+        return self.connect()
+
+    def _handshake(self, sock, raw):
+        extensions = None
+        if self.compress and wsdeflate.available():
+            extensions = wsdeflate.offer(self.context_takeover)
+
+        request, key = handshake_request(self.uri, extensions)
+        sock.write(request)
+
+        # Read the whole response head at once instead of line by line;
+        # micropython's TLS sockets only have stream methods
+        recv = getattr(sock, 'recv', None) or sock.readline
+        response = b''
+        while True:
+            chunk = recv(HANDSHAKE_MAX - len(response))
+            if not chunk:
+                raise OSError('Connection closed during handshake')
+            response += chunk
+            end = response.find(b'\r\n\r\n')
+            if end >= 0:
+                break
+            if len(response) >= HANDSHAKE_MAX:
+                raise ValueError('Handshake response too long')
+
+        headers = check_response(response[:end], key)
+
+        leftover = response[end + 4:]
+        if leftover:
+            sock = PrefixedStream(sock, leftover, raw)
+        ws = WebsocketClient(sock, raw)
+
+        value = headers.get(b'sec-websocket-extensions')
+        if extensions and value:
+            params = wsdeflate.parse_response(value.decode('utf-8'))
+            if params is not None:
+                ws._deflate = wsdeflate.PerMessageDeflate(params)
+        return ws
+
+
+def connect(uri, compress=False, context_takeover=False, timeout=5,
+            ssl_context=None):
+    """
+    Connect a websocket, over TLS for wss:// URIs.
+
+    compress offers permessage-deflate for text messages when the port
+    has zlib/deflate. Without context_takeover every message is inflated
+    on its own, so no compression window stays allocated between them.
+    ssl_context overrides the default TLS context (certificate checks,
+    a private CA). Keep a Connector instead to reconnect faster.
+    """
+    return Connector(uri, compress, context_takeover, timeout,
+                     ssl_context=ssl_context).connect()
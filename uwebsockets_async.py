@@ -0,0 +1,363 @@
+"""
+Asyncio websockets client for micropython
+
+Same framing as uwebsockets, over uasyncio streams (or CPython asyncio),
+so receiving, sending and audio playback can share one event loop
+instead of one thread each:
+
+    ws = await uwebsockets_async.connect('ws://host:8000/ws')
+    await ws.send('hello')
+    reply = await ws.recv()
+
+audio_chat_client still runs on the blocking uwebsockets client and its
+threads; this module is the transport for an event-loop client such as
+audio_boardcast's.
+"""
+
+import struct
+
+try:
+    from errno import ETIMEDOUT
+except ImportError:
+    ETIMEDOUT = 110
+
+try:
+    import uasyncio as asyncio
+    # uasyncio's Stream.write copies into its own buffer
+    _WRITE_COPIES = True
+except ImportError:
+    import asyncio
+    # CPython transports may queue the memoryview itself
+    _WRITE_COPIES = False
+
+from uwebsockets import (CLOSE_OK, CLOSE_PROTOCOL_ERROR, CLOSE_TOO_BIG,
+                         OP_BYTES, OP_CLOSE, OP_PING, OP_PONG, OP_TEXT,
+                         Websocket, check_response, handshake_request,
+                         parse_header, urlparse)
+from wsmask import mask as apply_mask
+
+
+class AsyncWebsocket(Websocket):
+    """
+    Client websocket over an asyncio (reader, writer) pair.
+
+    recv, recv_into, send, send_into and close are coroutines with the
+    same meaning as in Websocket, and recv_stream() is iterated with
+    async for. Every write awaits drain(), so a slow peer applies
+    backpressure to the sender instead of growing buffers.
+    """
+    is_client = True
+
+    def __init__(self, reader, writer):
+        super().__init__(None)
+        self._reader = reader
+        self._writer = writer
+        self._timeout = None
+        # uasyncio streams read straight into a buffer; CPython's
+        # StreamReader has no readinto()
+        self._readinto = getattr(reader, 'readinto', None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def settimeout(self, timeout):
+        """
+        Seconds to wait for the next frame to start (None waits forever).
+        On expiry recv/recv_into/recv_stream raise OSError(ETIMEDOUT), as
+        the blocking client does; a frame already arriving is not cut off.
+        """
+        self._timeout = timeout
+
+    async def read_frame(self, max_size=None):
+
+        fin, opcode, length, mask_bits = await self._read_header()
+
+        try:
+            data = await self._read_payload(length, mask_bits)
+        except MemoryError:
+            # We can't receive this many bytes, close the socket
+            await self.close(code=CLOSE_TOO_BIG)
+            return True, OP_CLOSE, None
+
+        return fin, opcode, data
+
+    async def _read_header(self):
+        reader = self._reader
+
+        if self._timeout is None:
+            first = await reader.readexactly(2)
+        else:
+            try:
+                first = await asyncio.wait_for(reader.readexactly(2),
+                                               self._timeout)
+            except asyncio.TimeoutError:
+                raise OSError(ETIMEDOUT)
+        fin, opcode, mask, length = parse_header(first)
+        self.missed_pongs = 0  # anything from the peer answers the pings
+
+        if length == 126:  # Magic number, length header is 2 bytes
+            length, = struct.unpack('!H', await reader.readexactly(2))
+        elif length == 127:  # Magic number, length header is 8 bytes
+            length, = struct.unpack('!Q', await reader.readexactly(8))
+
+        if mask:  # Mask is 4 bytes
+            mask_bits = await reader.readexactly(4)
+        else:
+            mask_bits = None
+
+        return fin, opcode, length, mask_bits
+
+    async def _read_payload(self, length, mask_bits):
+        data = await self._reader.readexactly(length)
+        if mask_bits:
+            data = apply_mask(bytearray(data), mask_bits)
+        return data
+
+    async def write_frame(self, opcode, data=b'', offset=0, length=None,
+                          rsv1=False):
+        frame = self._build_frame(opcode, data, offset, length, rsv1)
+        self._writer.write(frame if _WRITE_COPIES else bytes(frame))
+        await self._writer.drain()
+
+    async def recv(self):
+        assert self.open
+
+        opcode = None
+        message = None
+        while self.open:
+            try:
+                fin, opcode, data = await self.read_frame()
+            except (ValueError, EOFError):
+                self._close()
+                return
+
+            if opcode & 0x08:
+                await self._handle_control(opcode, data)
+                continue
+
+            opcode = self._message_opcode(fin, opcode)
+            if opcode is None:
+                await self.close(code=CLOSE_PROTOCOL_ERROR)
+                return
+
+            if message is None:
+                message = data
+            else:
+                # Fragmented message, reassemble it
+                if not isinstance(message, bytearray):
+                    message = bytearray(message)
+                message += data
+
+            if fin:
+                if opcode == OP_TEXT:
+                    return message.decode('utf-8')
+                return message
+
+    def recv_stream(self):
+        """
+        Async iterator over the next data message as its frames arrive,
+        with the same items as Websocket.recv_stream():
+
+            async for opcode, data in ws.recv_stream():
+                ...
+        """
+        assert self.open
+        return _FrameStream(self)
+
+    async def recv_into(self, buf):
+        """
+        Coroutine version of Websocket.recv_into(), same return values.
+        """
+        assert self.open
+
+        mv = memoryview(buf)
+        while not self._rx_remaining:
+            if not self.open:
+                return 0, None, True
+            try:
+                fin, opcode, length, mask_bits = await self._read_header()
+                if opcode & 0x08:
+                    # Control frames are at most 125 bytes
+                    await self._handle_control(
+                        opcode, await self._read_payload(length, mask_bits))
+                    continue
+            except (ValueError, EOFError):
+                self._close()
+                return 0, None, True
+
+            opcode = self._message_opcode(fin, opcode)
+            if opcode is None:
+                await self.close(code=CLOSE_PROTOCOL_ERROR)
+                return 0, None, True
+
+            self._rx_opcode = opcode
+            self._rx_fin = fin
+            self._rx_mask = mask_bits
+            self._rx_phase = 0
+            self._rx_remaining = length
+            if not length and fin:
+                return 0, opcode, True
+
+        n = min(len(mv), self._rx_remaining)
+        try:
+            await self._read_into(mv, n)
+        except EOFError:
+            self._close()
+            return 0, None, True
+        self.missed_pongs = 0
+        if self._rx_mask:
+            apply_mask(mv, self._rx_mask, 0, n, self._rx_phase)
+            self._rx_phase = (self._rx_phase + n) & 3
+        self._rx_remaining -= n
+
+        return n, self._rx_opcode, self._rx_fin and not self._rx_remaining
+
+    async def _read_into(self, mv, n):
+        """Fill mv[:n] from the stream, without allocating where possible"""
+        if self._readinto is None:
+            # the slice is still bounded by len(buf)
+            mv[:n] = await self._reader.readexactly(n)
+            return
+        got = 0
+        while got < n:
+            k = await self._readinto(mv[got:n])
+            if not k:
+                raise EOFError
+            got += k
+
+    async def _handle_control(self, opcode, data):
+        if opcode == OP_CLOSE:
+            self._close()
+        elif opcode == OP_PONG:
+            # Only used for keepalive, keep waiting for a data frame
+            self._on_pong(data)
+        elif opcode == OP_PING:
+            # We need to send a pong frame
+            await self.write_frame(OP_PONG, data)
+        else:
+            raise ValueError(opcode)
+
+    async def ping(self):
+        await self.write_frame(OP_PING, self._next_ping())
+
+    async def keepalive(self):
+        """
+        Keepalive task: pings every ping_interval ms (see set_keepalive)
+        and closes the connection once the peer stops answering, which
+        ends a pending recv().
+        """
+        while self.open and self.ping_interval:
+            due = self._keepalive_due()
+            if due is False:
+                self._close()
+                break
+            if due:
+                await self.ping()
+            await asyncio.sleep(self.ping_interval / 4000)
+
+    async def send(self, buf):
+
+        assert self.open
+
+        if isinstance(buf, str):
+            opcode = OP_TEXT
+            buf = buf.encode('utf-8')
+        elif isinstance(buf, (bytes, bytearray, memoryview)):
+            opcode = OP_BYTES
+        else:
+            raise TypeError()
+
+        await self.write_frame(opcode, buf)
+
+    async def send_into(self, buf, offset=0, length=None, opcode=OP_BYTES):
+
+        assert self.open
+
+        if length is None:
+            length = len(buf) - offset
+
+        await self.write_frame(opcode, buf, offset, length)
+
+    async def close(self, code=CLOSE_OK, reason=''):
+
+        if not self.open:
+            return
+
+        buf = struct.pack('!H', code) + reason.encode('utf-8')
+
+        try:
+            await self.write_frame(OP_CLOSE, buf)
+        finally:
+            self._close()
+            await self._writer.wait_closed()
+
+    def _close(self):
+        self.open = False
+        self._writer.close()
+
+
+class _FrameStream:
+    """AsyncWebsocket.recv_stream(); micropython has no async generators"""
+
+    def __init__(self, ws):
+        self._ws = ws
+        self._done = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        ws = self._ws
+        while not self._done and ws.open:
+            try:
+                fin, opcode, data = await ws.read_frame()
+            except (ValueError, EOFError):
+                ws._close()
+                break
+
+            if opcode & 0x08:
+                await ws._handle_control(opcode, data)
+                continue
+
+            opcode = ws._message_opcode(fin, opcode)
+            if opcode is None:
+                await ws.close(code=CLOSE_PROTOCOL_ERROR)
+                break
+
+            self._done = fin
+            return opcode, data
+        raise StopAsyncIteration
+
+
+async def connect(uri, ssl_context=None):
+    """
+    Connect a websocket, without blocking the event loop on I/O.
+
+    wss:// URIs use ssl_context, or the default one of the port.
+    """
+
+    uri = urlparse(uri)
+    assert uri
+
+    if uri.secure:
+        reader, writer = await asyncio.open_connection(
+            uri.hostname, uri.port, ssl=ssl_context or True)
+    else:
+        reader, writer = await asyncio.open_connection(uri.hostname, uri.port)
+
+    request, key = handshake_request(uri)
+    writer.write(request)
+    await writer.drain()
+
+    lines = []
+    while True:
+        line = (await reader.readline())[:-2]
+        if not line:
+            break
+        lines.append(line)
+    check_response(b'\r\n'.join(lines), key)
+
+    return AsyncWebsocket(reader, writer)
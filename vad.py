@@ -0,0 +1,409 @@
+"""
+语音活动检测 (VAD), audio_chat_client 和 audio_boardcast 共用
+
+每帧计算平均绝对幅度(16位小端 PCM), 在固定长度的窗口上用滑动和
+求平均, O(1) 更新。门限可以固定, 也可以跟随噪声底自适应:
+  threshold = max(min_threshold, noise_floor * margin)
+噪声底取最近 noise_frames 帧里的最小幅度(分三段记录最小值, O(1) 更新),
+再平滑跟随: 说话中字词之间的停顿也能让它跟上环境噪声的变化。
+连续 min_voice_frames 帧超过门限判为开始说话, 说话后连续
+hangover_frames 帧低于门限才判为结束(拖尾)。
+
+mode='spectral' 适合有风扇、键盘声的嘈杂环境, 在幅度之外再看两个特征:
+  - 过零率: 浊音的过零率低, 嘶嘶声/敲击声的过零率高
+  - 频带能量的变化(谱通量): 用三个定点差分滤波器把信号粗分成
+    低/中/高三个频带, 相邻帧频带能量分布的变化量。风扇这类平稳噪声
+    几乎不变, 语音的音节和共振峰一直在变
+三者在窗口上取平均, 同时满足才算有声帧。
+
+EchoGate 是全双工(播放时也听)用的回声抑制门, 比较麦克风和扬声器参考信号的电平。
+
+特征计算: 支持 viper 的端口(esp32)用原生循环按 16 位读取;
+CPython 用 memoryview.cast('h'); 其余端口逐字节解码。
+"""
+import sys
+from array import array
+
+from myutil import ticks_ms, ticks_us, ticks_diff
+
+_LITTLE = sys.byteorder == 'little'
+
+
+def _abs_sum_python(buf, n):
+    """前 n 个采样的绝对值之和"""
+    mv = memoryview(buf)
+    if _LITTLE and hasattr(mv, 'cast'):
+        return sum(map(abs, mv[:n * 2].cast('h')))
+    total = 0
+    for i in range(0, n * 2, 2):
+        value = mv[i] | (mv[i + 1] << 8)
+        if value & 0x8000:
+            value = 0x10000 - value
+        total += value
+    return total
+
+
+_abs_sum = _abs_sum_python
+
+
+# _features() 输出的下标
+_ABS = 0   # |x| 之和
+_ZC = 1    # 过零次数
+_LOW = 2   # |x[n] + x[n-1]| 之和, 低频
+_MID = 3   # |x[n] - x[n-2]| 之和, 中频(峰值在 fs/4)
+_HIGH = 4  # |x[n] - x[n-1]| 之和, 高频
+
+
+def _features_python(buf, n, out):
+    mv = memoryview(buf)
+    if _LITTLE and hasattr(mv, 'cast'):
+        s = mv[:n * 2].cast('h')
+        a, b = s[1:], s[:-1]
+        out[_ABS] = sum(map(abs, s))
+        out[_ZC] = sum(1 for x, y in zip(a, b) if (x ^ y) < 0)
+        out[_LOW] = sum(abs(x + y) for x, y in zip(a, b))
+        out[_MID] = sum(abs(x - y) for x, y in zip(s[2:], s[:-2]))
+        out[_HIGH] = sum(abs(x - y) for x, y in zip(a, b))
+        return
+    total = zc = low = mid = high = 0
+    prev = prev2 = None
+    for i in range(0, n * 2, 2):
+        x = mv[i] | (mv[i + 1] << 8)
+        if x & 0x8000:
+            x -= 0x10000
+        total += abs(x)
+        if prev is not None:
+            if (x ^ prev) < 0:
+                zc += 1
+            low += abs(x + prev)
+            high += abs(x - prev)
+            if prev2 is not None:
+                mid += abs(x - prev2)
+        prev2 = prev
+        prev = x
+    out[_ABS] = total
+    out[_ZC] = zc
+    out[_LOW] = low
+    out[_MID] = mid
+    out[_HIGH] = high
+
+
+_features = _features_python
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _abs_sum_native(buf, n: int) -> int:
+        p = ptr16(buf)
+        total = 0
+        i = 0
+        while i < n:
+            value = p[i]
+            if value & 0x8000:
+                value = 0x10000 - value
+            total += value
+            i += 1
+        return total
+
+    _abs_sum = _abs_sum_native
+
+    @micropython.viper
+    def _features_native(buf, n: int, out):
+        p = ptr16(buf)
+        o = ptr32(out)
+        total = 0
+        zc = 0
+        low = 0
+        mid = 0
+        high = 0
+        prev = 0
+        prev2 = 0
+        i = 0
+        while i < n:
+            x = int(p[i])
+            if x & 0x8000:
+                x -= 0x10000
+            if x < 0:
+                total -= x
+            else:
+                total += x
+            if i > 0:
+                if (x ^ prev) < 0:
+                    zc += 1
+                t = x + prev
+                if t < 0:
+                    t = 0 - t
+                low += t
+                t = x - prev
+                if t < 0:
+                    t = 0 - t
+                high += t
+                if i > 1:
+                    t = x - prev2
+                    if t < 0:
+                        t = 0 - t
+                    mid += t
+            prev2 = prev
+            prev = x
+            i += 1
+        o[0] = total
+        o[1] = zc
+        o[2] = low
+        o[3] = mid
+        o[4] = high
+
+    _features = _features_native
+except (ImportError, AttributeError):
+    pass
+
+
+def mean_abs(buf, nbytes=None):
+    """16位 PCM 的平均绝对幅度(整数), nbytes 默认为整个 buf"""
+    if nbytes is None:
+        nbytes = len(buf)
+    n = nbytes >> 1
+    if not n:
+        return 0
+    return _abs_sum(buf, n) // n
+
+
+class Vad:
+    """
+    threshold 为 None 时按噪声底自适应, 否则使用固定门限。
+    process() 之后可以读取 level(窗口平均幅度)、noise_floor、threshold、
+    is_speaking, 以及本帧是否刚开始/结束说话(started/ended)。
+    mode='spectral' 时还有 zcr(每采样过零率 * 256)和 flux(谱通量 * 256),
+    都是窗口平均, 分别要低于 zcr_max、高于 flux_min。
+    """
+
+    def __init__(self, window=4, threshold=None, min_voice_frames=2,
+                 hangover_frames=8, margin=2, min_threshold=200,
+                 noise_frames=48, noise_shift=2, mode='energy',
+                 zcr_max=48, flux_min=14):
+        if mode not in ('energy', 'spectral'):
+            raise ValueError('unknown VAD mode: %s' % mode)
+        self.spectral = mode == 'spectral'
+        self.zcr_max = zcr_max
+        self.flux_min = flux_min
+        self._feat = array('i', [0] * 5)
+        self._bands = array('i', [0] * 3)  # 上一帧的低/中/高频带能量
+        self._zcrs = array('i', [0] * window)
+        self._fluxes = array('i', [0] * window)
+        self.window = window
+        self.fixed_threshold = threshold
+        self.min_voice_frames = min_voice_frames
+        self.hangover_frames = hangover_frames
+        self.margin = margin
+        self.min_threshold = min_threshold
+        self.noise_shift = noise_shift  # 噪声底每帧向最小幅度靠近 1/2^noise_shift
+        self._levels = array('i', [0] * window)
+        self._noise_block = max(1, noise_frames // 3)
+        self._block_mins = array('i', [0] * 3)
+        self._block_index = 0
+        self._block_count = 0
+        self._block_min = 0
+        self.noise_floor = 0
+        # 处理一帧的耗时(微秒): 最近一帧、最大值、累计
+        self.cpu_us = self.cpu_us_max = self.cpu_us_total = 0
+        self.frames = 0
+        self.reset()
+
+    def reset(self):
+        """开始新的一段录音; 噪声底保留"""
+        for i in range(self.window):
+            self._levels[i] = 0
+            self._zcrs[i] = 0
+            self._fluxes[i] = 0
+        for i in range(3):
+            self._bands[i] = 0
+        self._index = 0
+        self._sum = 0
+        self._zcr_sum = 0
+        self._flux_sum = 0
+        self._filled = 0
+        self.level = 0
+        self.zcr = 0
+        self.flux = 0
+        self.threshold = (self.fixed_threshold if self.fixed_threshold is not None
+                          else self.min_threshold)
+        self.voice_frames = 0
+        self.silence_frames = 0
+        self.is_speaking = False
+        self.started = False
+        self.ended = False
+
+    def process(self, buf, nbytes=None):
+        """处理一帧, 返回当前是否在说话"""
+        t0 = ticks_us()
+        i = self._index
+        if self.spectral:
+            frame_level = self._spectral_features(buf, nbytes, i)
+        else:
+            frame_level = mean_abs(buf, nbytes)
+
+        # 滑动窗口: 换掉最旧的一帧, 更新总和
+        self._sum += frame_level - self._levels[i]
+        self._levels[i] = frame_level
+        self._index = (i + 1) % self.window
+        if self._filled < self.window:
+            self._filled += 1
+        level = self._sum // self._filled
+        self.level = level
+
+        if self.fixed_threshold is None:
+            self._track_noise(frame_level)
+        voiced = level > self.threshold
+        if self.spectral:
+            self.zcr = self._zcr_sum // self._filled
+            self.flux = self._flux_sum // self._filled
+            voiced = voiced and self.zcr < self.zcr_max and self.flux > self.flux_min
+
+        self.started = self.ended = False
+        if voiced:
+            self.voice_frames += 1
+            self.silence_frames = 0
+            if not self.is_speaking and self.voice_frames >= self.min_voice_frames:
+                self.is_speaking = self.started = True
+        else:
+            self.voice_frames = 0
+            if self.is_speaking:  # 只在说话状态下计数静音帧
+                self.silence_frames += 1
+                if self.silence_frames >= self.hangover_frames:
+                    self.is_speaking = False
+                    self.ended = True
+                    self.silence_frames = 0
+
+        dt = ticks_diff(ticks_us(), t0)
+        self.cpu_us = dt
+        self.cpu_us_total += dt
+        self.frames += 1
+        if dt > self.cpu_us_max:
+            self.cpu_us_max = dt
+        return self.is_speaking
+
+    def _spectral_features(self, buf, nbytes, i):
+        """计算本帧的过零率和谱通量并放进窗口, 返回本帧平均幅度"""
+        if nbytes is None:
+            nbytes = len(buf)
+        n = nbytes >> 1
+        if n < 3:
+            return 0
+        f = self._feat
+        _features(buf, n, f)
+        zcr = f[_ZC] * 256 // n
+        low = f[_LOW] // n
+        mid = f[_MID] // n
+        high = f[_HIGH] // n
+        # 谱通量: 三个频带能量相对上一帧的变化, 用两帧总能量归一化
+        bands = self._bands
+        total = low + mid + high + bands[0] + bands[1] + bands[2]
+        flux = 0
+        if total:
+            flux = (abs(low - bands[0]) + abs(mid - bands[1])
+                    + abs(high - bands[2])) * 256 // total
+        bands[0] = low
+        bands[1] = mid
+        bands[2] = high
+        self._zcr_sum += zcr - self._zcrs[i]
+        self._zcrs[i] = zcr
+        self._flux_sum += flux - self._fluxes[i]
+        self._fluxes[i] = flux
+        return f[_ABS] // n
+
+    def _track_noise(self, frame_level):
+        mins = self._block_mins
+        if not self.frames:
+            # 第一帧: 用它初始化所有分段
+            for i in range(3):
+                mins[i] = frame_level
+            self._block_min = self.noise_floor = frame_level
+        # 当前分段的最小值, 分段满了就替换最旧的一段
+        if not self._block_count or frame_level < self._block_min:
+            self._block_min = frame_level
+        self._block_count += 1
+        if self._block_count == self._noise_block:
+            mins[self._block_index] = self._block_min
+            self._block_index = (self._block_index + 1) % 3
+            self._block_count = 0
+        target = min(mins[0], mins[1], mins[2], self._block_min)
+
+        noise = self.noise_floor
+        if target < noise:
+            # 安静下来时立即跟上
+            noise = target
+        else:
+            step = (target - noise) >> self.noise_shift
+            noise += step if step else (1 if target > noise else 0)
+        self.noise_floor = noise
+        self.threshold = max(self.min_threshold, noise * self.margin)
+
+    def stats(self):
+        return {
+            'frames': self.frames,
+            'cpu_us': self.cpu_us,
+            'cpu_us_max': self.cpu_us_max,
+            'cpu_us_avg': self.cpu_us_total // self.frames if self.frames else 0,
+            'level': self.level,
+            'noise_floor': self.noise_floor,
+            'threshold': self.threshold,
+            'zcr': self.zcr,
+            'flux': self.flux,
+        }
+
+
+class EchoGate:
+    """
+    回声抑制门: 全双工时扬声器的声音会被麦克风录到, 不能让它触发 VAD
+
+    播放端每写一块给 I2S 调用 reference(buf, nbytes), 记下这块的平均幅度
+    (参考信号); 麦克风端每帧调用 is_echo(buf, nbytes): 麦克风电平不超过
+    最近 tail_ms 内参考电平的最大值 x coupling 时判为回声。
+    coupling 是扬声器到麦克风的耦合系数(Q8, 256 = 1.0)加上余量, 按外壳和
+    音量在安静环境下播放测一次(见 stats() 里的 ratio)。tail_ms 要盖住 I2S
+    缓冲区和声学路径的延迟。两端可以在不同线程里调用。
+    """
+
+    def __init__(self, coupling=384, tail_ms=300, slots=16):
+        self.coupling = coupling
+        self.tail_ms = tail_ms
+        self._levels = array('i', [0] * slots)
+        self._times = array('i', [0] * slots)
+        self._next = 0
+        self.mic_level = 0
+        self.ref_level = 0
+        self.echo_frames = 0  # 判为回声的帧数
+
+    def reference(self, buf, nbytes=None):
+        """播放端: 记下刚写给 I2S 的一块的电平"""
+        i = self._next
+        self._levels[i] = mean_abs(buf, nbytes)
+        self._times[i] = ticks_ms() & 0x3fffffff
+        self._next = (i + 1) % len(self._levels)
+
+    def _recent_reference(self):
+        now = ticks_ms() & 0x3fffffff
+        peak = 0
+        for i in range(len(self._levels)):
+            if ((now - self._times[i]) & 0x3fffffff) <= self.tail_ms and self._levels[i] > peak:
+                peak = self._levels[i]
+        return peak
+
+    def is_echo(self, buf, nbytes=None):
+        """麦克风端: 这一帧能否用扬声器的回声解释"""
+        mic = mean_abs(buf, nbytes)
+        ref = self._recent_reference()
+        self.mic_level = mic
+        self.ref_level = ref
+        if ref and mic * 256 <= ref * self.coupling:
+            self.echo_frames += 1
+            return True
+        return False
+
+    def stats(self):
+        return {
+            'mic_level': self.mic_level,
+            'ref_level': self.ref_level,
+            'ratio': self.mic_level * 256 // self.ref_level if self.ref_level else 0,
+            'echo_frames': self.echo_frames,
+        }
@@ -0,0 +1,162 @@
+"""
+permessage-deflate (RFC 7692) for uwebsockets
+
+Backends, best first:
+- zlib with compressobj/decompressobj (CPython): streaming, supports
+  context takeover in both directions
+- deflate.DeflateIO (micropython >= 1.21): one-shot per message
+- zlib.decompress (older micropython): receive only, we send uncompressed
+
+Without context takeover every message is (de)compressed on its own, so
+the sliding window is only held in RAM while a message is processed.
+"""
+
+try:
+    import deflate
+    import io
+except ImportError:
+    deflate = None
+
+try:
+    import zlib
+except ImportError:
+    zlib = None
+
+EXTENSION = 'permessage-deflate'
+
+# Every compressed message ends with an empty stored block, which is
+# stripped on the wire (RFC 7692 section 7.2.1)
+_TAIL = b'\x00\x00\xff\xff'
+
+# Messages shorter than this are sent uncompressed, deflate would grow them
+MIN_SIZE = 32
+
+# Window asked from the server on the device, 1 KB instead of 32 KB
+DEVICE_WINDOW_BITS = 10
+
+_STREAMING = zlib is not None and hasattr(zlib, 'decompressobj')
+
+
+def available():
+    """True if this port can at least decompress."""
+    return _STREAMING or deflate is not None or zlib is not None
+
+
+def offer(context_takeover=False, window_bits=None):
+    """
+    Value of the Sec-WebSocket-Extensions request header.
+
+    Context takeover is only offered when the backend can keep a
+    decompressor between messages. window_bits asks the server to use a
+    smaller window, bounding the RAM needed to decompress; one-shot
+    backends ask for DEVICE_WINDOW_BITS by default.
+    """
+    if window_bits is None and not _STREAMING:
+        window_bits = DEVICE_WINDOW_BITS
+    params = [EXTENSION]
+    if not (context_takeover and _STREAMING):
+        params.append('server_no_context_takeover')
+        params.append('client_no_context_takeover')
+    if window_bits:
+        params.append('server_max_window_bits=%d' % window_bits)
+    return '; '.join(params)
+
+
+def parse_response(value):
+    """
+    Parameters the server accepted in its Sec-WebSocket-Extensions header,
+    as a dict, or None if permessage-deflate was not accepted.
+    """
+    for extension in value.split(','):
+        parts = [p.strip() for p in extension.split(';')]
+        if parts[0] != EXTENSION:
+            continue
+        params = {}
+        for param in parts[1:]:
+            name, _, arg = param.partition('=')
+            params[name.strip()] = arg.strip().strip('"') or True
+        return params
+    return None
+
+
+def _window_bits(params, name):
+    value = params.get(name, True)
+    return 15 if value is True else int(value)
+
+
+class PerMessageDeflate:
+    """
+    Compression state for one connection, created from the accepted
+    extension parameters (the client's view, or the server's with
+    server=True). Counts raw and wire bytes in both directions.
+    """
+
+    def __init__(self, params, level=6, compress_bits=10, server=False):
+        local, remote = ('server', 'client') if server else ('client', 'server')
+        self.level = level
+        self.window_bits = _window_bits(params, remote + '_max_window_bits')
+        # Our compressor is always reset per message unless the peer lets
+        # us keep it and the backend can
+        self.compress_takeover = (_STREAMING and
+                                  local + '_no_context_takeover' not in params)
+        self.decompress_takeover = remote + '_no_context_takeover' not in params
+        # Window of our compressor; the peer's decompressor accepts any
+        # size up to the negotiated one, a small one keeps RAM low on the
+        # device
+        self.compress_bits = _window_bits(params, local + '_max_window_bits')
+        if not _STREAMING:
+            self.compress_bits = min(self.compress_bits, compress_bits)
+        self._compressor = None
+        self._decompressor = None
+        self.raw_out = self.wire_out = self.raw_in = self.wire_in = 0
+
+    def compress(self, data):
+        """
+        Compressed payload for a message, or None if it should be sent as
+        is (too short, no compressor, or no gain).
+        """
+        if len(data) < MIN_SIZE:
+            return None
+        if _STREAMING:
+            compressor = self._compressor
+            if compressor is None:
+                compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                              -self.compress_bits)
+                if self.compress_takeover:
+                    self._compressor = compressor
+            out = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            out = out[:-4]
+        elif deflate is not None and hasattr(deflate.DeflateIO, 'write'):
+            buf = io.BytesIO()
+            stream = deflate.DeflateIO(buf, deflate.RAW, self.compress_bits)
+            stream.write(data)
+            stream.close()
+            # A final block followed by the (stripped) empty stored block
+            out = buf.getvalue() + b'\x00'
+        else:
+            return None
+        if len(out) >= len(data) and not self.compress_takeover:
+            # With context takeover the peer has to see every byte the
+            # compressor did, so only a fresh compressor may give up
+            return None
+        self.raw_out += len(data)
+        self.wire_out += len(out)
+        return out
+
+    def decompress(self, data):
+        self.wire_in += len(data)
+        data = bytes(data) + _TAIL
+        if _STREAMING:
+            decompressor = self._decompressor
+            if decompressor is None:
+                decompressor = zlib.decompressobj(-self.window_bits)
+                if self.decompress_takeover:
+                    self._decompressor = decompressor
+            out = decompressor.decompress(data)
+        elif deflate is not None:
+            out = deflate.DeflateIO(io.BytesIO(data), deflate.RAW,
+                                    self.window_bits).read()
+        else:
+            out = zlib.decompress(data, -self.window_bits)
+        self.raw_in += len(out)
+        return out
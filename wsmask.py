@@ -0,0 +1,79 @@
+"""
+Websocket payload masking for micropython
+
+XORs the 4-byte frame mask into a bytearray in place, one 32-bit word at
+a time. Ports with the viper emitter (esp32, unix) get a native loop;
+everything else, CPython included, uses a block-wise big-int fallback.
+"""
+
+# Fallback block size, must be a multiple of 4 so every block starts on
+# mask byte 0.
+_BLOCK = 1024
+
+
+def _xor_python(buf, start, end, m):
+    mv = memoryview(buf)
+    n = end - start
+    block = min(n, _BLOCK) & ~3 or 4
+    key = int.from_bytes(m.to_bytes(4, 'little') * (block // 4), 'little')
+    i = start
+    while end - i >= block:
+        word = int.from_bytes(mv[i:i + block], 'little') ^ key
+        mv[i:i + block] = word.to_bytes(block, 'little')
+        i += block
+    tail = end - i
+    if tail:
+        word = int.from_bytes(mv[i:end], 'little')
+        word ^= key & ((1 << (tail * 8)) - 1)
+        mv[i:end] = word.to_bytes(tail, 'little')
+
+
+_xor = _xor_python
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _xor_native(buf, start: int, end: int, m: uint):
+        p8 = ptr8(buf)
+        i = start
+        # Leading bytes up to the first word-aligned address
+        while i < end and (int(p8) + i) & 3:
+            p8[i] ^= m & 0xff
+            m = (m >> 8) | ((m & 0xff) << 24)
+            i += 1
+        p32 = ptr32(int(p8) + i)
+        n = (end - i) >> 2
+        j = 0
+        while j < n:
+            p32[j] ^= m
+            j += 1
+        i += n << 2
+        while i < end:
+            p8[i] ^= m & 0xff
+            m = (m >> 8) | ((m & 0xff) << 24)
+            i += 1
+
+    _xor = _xor_native
+except (ImportError, AttributeError):
+    pass
+
+
+def mask(buf, mask_bits, start=0, end=None, phase=0):
+    """
+    Apply (or remove) a websocket mask to buf[start:end] in place.
+
+    buf must be a writable buffer (bytearray, or a memoryview of one);
+    mask_bits is the 4-byte masking key from the frame header. phase is
+    the payload offset of buf[start] modulo 4, for payloads that are
+    unmasked in several slices.
+    """
+    if end is None:
+        end = len(buf)
+    if end > start:
+        m = int.from_bytes(mask_bits, 'little')
+        if phase & 3:
+            shift = (phase & 3) * 8
+            m = (m >> shift) | ((m << (32 - shift)) & 0xffffffff)
+        _xor(buf, start, end, m)
+    return buf